@@ -0,0 +1,168 @@
+import re
+from datetime import datetime
+
+# Local APA / Vancouver / Nature reference parser and the splitting of pasted reference
+# text into references, tried before any LLM extraction.
+# Kept free of Streamlit so it can be imported (and tested) on its own.
+
+DOI_RE = re.compile(r"10\.\d{4,9}/[-._;()/:A-Za-z0-9]+", re.I)
+ARXIV_RE = re.compile(r"(?:arXiv:\s*|arxiv\.org/(?:abs|pdf)/)(\d{4}\.\d{4,5})(?:v\d+)?", re.I)
+# Lines that start a new numbered reference ("[12] ...", "12. ...", "12) ...")
+REF_START_RE = re.compile(r"^\s*(?:\[\d{1,4}\]|\d{1,4}[.)])\s+")
+
+# Text longer than this is not one reference: leave it to the LLM instead of matching it
+CITATION_MAX_CHARS = 2000
+
+# A hyphen may only join the pieces of one surname ("Smith-Jones") and a space only
+# separates surname words ("van der Berg", "Garcia Lopez"). Every way of reading a name
+# is then unique, so a reference that fails to match fails in linear time instead of
+# backtracking through every hyphen/space split of every author.
+_NAME_PART = r"[A-Z][\w'’]+(?:-[\w'’]+)*"
+_NAME = rf"{_NAME_PART}(?: (?:[a-z]+ )*{_NAME_PART})*"
+_INITIALS = r"[A-Z]\.(?:[ \-]?[A-Z]\.)*"
+# "Smith, J. A." (APA, Nature) and "Smith JA" (Vancouver)
+_COMMA_AUTHOR = rf"(?:(?:[a-z]+ )*{_NAME}, {_INITIALS})"
+_VANCOUVER_AUTHOR = rf"(?:(?:[a-z]+ )*{_NAME} [A-Z]{{1,3}})"
+
+CITATION_PATTERNS = {
+    # Smith, J. A., & Doe, B. (2020). Title of the work. Journal, 12(3), 45-67.
+    "apa": re.compile(
+        rf"^(?P<authors>{_COMMA_AUTHOR}(?:,? (?:& |and )?{_COMMA_AUTHOR})*(?:,? (?:&|\.\.\.) {_COMMA_AUTHOR})?(?:,? et al\.)?)"
+        r"\s*\((?P<year>(?:19|20)\d{2})[a-z]?[^)]{0,20}\)\.\s+(?P<title>.+?[.?!])(?:\s+(?P<journal>[^,]+),\s*(?P<volume>\d+))?"
+    ),
+    # Smith JA, Doe B, Lee C. Title of the work. J Abbrev. 2020;12(3):45-67.
+    "vancouver": re.compile(
+        rf"^(?P<authors>{_VANCOUVER_AUTHOR}(?:, {_VANCOUVER_AUTHOR})*(?:,? et al)?)\.\s+(?P<title>.+?[.?!])\s+"
+        r"(?P<journal>[A-Z][^;]*?)\.?\s+(?P<year>(?:19|20)\d{2})(?:\s+[A-Z][a-z]{2}(?:\s+\d{1,2})?)?\s*[;:](?P<volume>\d+)?"
+    ),
+    # Smith, J. A., Doe, B. & Lee, C. Title of the work. Nature 580, 123-127 (2020).
+    "nature": re.compile(
+        rf"^(?P<authors>{_COMMA_AUTHOR}(?:, {_COMMA_AUTHOR})*(?:,? & {_COMMA_AUTHOR})?(?: et al\.)?)\s+(?P<title>[A-Z0-9].+?[.?!])\s+"
+        r"(?P<journal>[A-Z][^\d()]*?)\s+(?P<volume>\d+),\s*[\w\-–]+\s*\((?P<year>(?:19|20)\d{2})\)"
+    ),
+}
+
+def _citation_authors(authors: str, style: str) -> list:
+    """Author string of a matched citation -> ["J. A. Smith", ...] (no commas, so later comma splits stay intact)."""
+    authors = re.sub(r",?\s*(?:et al\.?|\.\.\.)", "", authors)
+    if style == "vancouver":
+        names = re.findall(rf"((?:[a-z]+ )*{_NAME}) ([A-Z]{{1,3}})\b", authors)
+    else:
+        names = re.findall(rf"((?:[a-z]+ )*{_NAME}), ({_INITIALS})", authors)
+    return [f"{initials} {surname}".strip() for surname, initials in names]
+
+def parse_citation(text: str):
+    """
+    Parse one APA, Vancouver or Nature-style reference without the LLM.
+    Returns {title, authors, year, doi, parser, confidence} for the best-matching style,
+    or None if no style matches (or the text is longer than CITATION_MAX_CHARS).
+    confidence (0..1) rewards a sane title length, parsed authors, a plausible year and
+    a journal/volume.
+    """
+    text = REF_START_RE.sub("", re.sub(r"\s+", " ", text or "")).strip()
+    if len(text) > CITATION_MAX_CHARS:
+        return None
+    doi_match = DOI_RE.search(text)
+    best = None
+    for style, pattern in CITATION_PATTERNS.items():
+        m = pattern.match(text)
+        if not m:
+            continue
+        title = m.group("title").rstrip(".").strip()
+        authors = _citation_authors(m.group("authors"), style)
+        year = int(m.group("year"))
+        confidence = 0.5
+        confidence += 0.15 if 3 <= len(title.split()) <= 40 else -0.2
+        confidence += 0.15 if authors else -0.2
+        confidence += 0.1 if 1900 <= year <= datetime.now().year + 1 else -0.3
+        confidence += 0.1 if m.group("journal") and m.group("volume") else 0.0
+        # A title that swallowed the journal or a DOI was cut in the wrong place
+        if DOI_RE.search(title) or re.search(r"\b(?:19|20)\d{2}\s*[;:(]", title):
+            confidence -= 0.4
+        result = {
+            "title": title,
+            "authors": authors,
+            "year": year,
+            "doi": doi_match.group(0).rstrip(".,;)") if doi_match else None,
+            "parser": style,
+            "confidence": round(max(0.0, min(1.0, confidence)), 2),
+        }
+        if best is None or result["confidence"] > best["confidence"]:
+            best = result
+    return best
+
+def parse_citations_locally(segment: str, min_confidence: float) -> list:
+    """
+    Confident local parses for a piece of pasted text: one per line when every line is a
+    well-formed reference, else the piece as one (wrapped) reference. [] means use the LLM.
+    """
+    lines = [line for line in segment.splitlines() if line.strip()]
+    if len(lines) > 1:
+        parsed = [parse_citation(line) for line in lines]
+        if all(p and p["confidence"] >= min_confidence for p in parsed):
+            return parsed
+    parsed = parse_citation(segment)
+    return [parsed] if parsed and parsed["confidence"] >= min_confidence else []
+
+# A line that ends like a whole reference (". ", ")", "]" or a page number) rather than mid-title
+_REF_END_RE = re.compile(r"[.)\]\d]\s*$")
+# Words that may accompany an identifier on a line of its own ("doi: ...", "https://doi.org/...")
+_IDENTIFIER_WORDS = {"doi", "https", "http", "www", "org", "arxiv", "abs", "pdf"}
+
+def reference_identifiers(segment: str) -> list:
+    """DOIs (arXiv IDs as their 10.48550 DOIs) in a piece of text, in order, without duplicates."""
+    found = [(m.start(), m.group(0).rstrip(".,;)")) for m in DOI_RE.finditer(segment)]
+    found += [(m.start(), f"10.48550/arXiv.{m.group(1)}") for m in ARXIV_RE.finditer(segment)]
+    return list(dict.fromkeys(doi for _, doi in sorted(found)))
+
+def _identifier_only(line: str) -> bool:
+    rest = ARXIV_RE.sub(" ", DOI_RE.sub(" ", line))
+    return len([w for w in re.findall(r"[A-Za-z]{3,}", rest) if w.lower() not in _IDENTIFIER_WORDS]) <= 1
+
+def _identifier_runs(segment: str) -> list:
+    """
+    Split a multi-line segment that holds identifiers into references: a line with an
+    identifier ends one, and so does a line that ends like a reference, while a line that
+    stops mid-title wraps into the next. A line holding nothing but an identifier belongs
+    to the reference above it.
+    """
+    runs, current = [], []
+    for line in segment.splitlines():
+        if not line.strip():
+            continue
+        has_identifier = bool(reference_identifiers(line))
+        if has_identifier and not current and runs and _identifier_only(line) and not reference_identifiers(runs[-1]):
+            current = [runs.pop()]
+        current.append(line)
+        if has_identifier or _REF_END_RE.search(line):
+            runs.append("\n".join(current))
+            current = []
+    if current:
+        runs.append("\n".join(current))
+    return runs
+
+def reference_segments(raw_text: str) -> list:
+    """
+    Split pasted text into reference-sized pieces: blank-line blocks, further split at
+    numbered entries. Blocks that mix references with and without a DOI/arXiv ID (e.g.
+    one reference per line, no blank lines) are split into their references, so the
+    ones without an identifier are not taken for part of the ones with one.
+    """
+    segments = []
+    for block in re.split(r"\n\s*\n", raw_text or ""):
+        current = []
+        for line in block.splitlines():
+            if REF_START_RE.match(line) and current:
+                segments.append("\n".join(current))
+                current = []
+            if line.strip():
+                current.append(line)
+        if current:
+            segments.append("\n".join(current))
+    pieces = []
+    for segment in segments:
+        if "\n" in segment.strip() and reference_identifiers(segment):
+            pieces.extend(_identifier_runs(segment))
+        else:
+            pieces.append(segment)
+    return [piece.strip() for piece in pieces if piece.strip()]
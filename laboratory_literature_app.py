@@ -1,20 +1,36 @@
 import streamlit as st
 import debug_utils
+from citation_parser import DOI_RE, parse_citation, parse_citations_locally, reference_identifiers, reference_segments
+from rate_limits import AdaptiveThrottle, TokenBucket
+from pubmed_xml import iter_pubmed_articles
+from llm_replies import (check_structured_reply, parse_streamed_reply, ratings_by_paper,
+                         streamed_reply_complete, structured_response_format)
+from relevance import bm25_prescores, prefilter_keep
+from request_classifier import classify_request_locally, request_identifiers
 st.set_page_config(page_title="📚 AI Literature Helper", page_icon="🤖")
-import requests, json, re, os, io
+import json, re, os, io
+import queue
+import random
+import sys
+import uuid
+import httpx
 import xml.etree.ElementTree as ET
 from pyzotero import zotero
 import fitz  # PyMuPDF
-from time import sleep, time
-from requests import RequestException
+from time import sleep, time, monotonic
 from datetime import datetime, timedelta
 import hashlib
+import numpy as np
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # ----------------------------
 # OPENAI (ChatGPT)
 # ----------------------------
-from openai import OpenAI
-import requests
+from openai import OpenAI, AsyncOpenAI, APITimeoutError
+import asyncio
 
 # ============================
 # CONFIG
@@ -27,6 +43,348 @@ SEMANTIC_SCHOLAR_API_KEY = st.secrets["SEMANTIC_SCHOLAR_API_KEY"]
 OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
 NCBI_EMAIL = st.secrets["NCBI_EMAIL"]
 NCBI_API_KEY = st.secrets["NCBI_API_KEY"]
+# Point at a compatible server (e.g. `python openai_batch_stub.py`) to run AI features offline
+OPENAI_BASE_URL = st.secrets.get("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+
+# Shared HTTP client (connection pooling / keep-alive)
+HTTP2_ENABLED = bool(st.secrets.get("HTTP2_ENABLED", False))  # needs `pip install httpx[http2]`
+HTTP_MAX_CONNECTIONS = int(st.secrets.get("HTTP_MAX_CONNECTIONS", 40))
+HTTP_MAX_KEEPALIVE = int(st.secrets.get("HTTP_MAX_KEEPALIVE", 20))
+HTTP_KEEPALIVE_EXPIRY = float(st.secrets.get("HTTP_KEEPALIVE_EXPIRY", 30.0))
+
+# On-disk HTTP response cache for metadata providers (TTLs in seconds, 0 = never cache)
+HTTP_CACHE_ENABLED = bool(st.secrets.get("HTTP_CACHE_ENABLED", True))
+HTTP_CACHE_PATH = st.secrets.get("HTTP_CACHE_PATH", "http_cache.sqlite3")
+HTTP_CACHE_MAX_MB = float(st.secrets.get("HTTP_CACHE_MAX_MB", 256))
+HTTP_CACHE_MAX_STREAM_MB = float(st.secrets.get("HTTP_CACHE_MAX_STREAM_MB", 8))  # larger streamed bodies are not cached
+HTTP_CACHE_TTLS = {
+    "crossref": 30 * 86400,                # DOI metadata is effectively immutable
+    "biorxiv": 7 * 86400,
+    "semantic_scholar": 7 * 86400,         # lookups by DOI / paper id
+    "semantic_scholar_search": 86400,
+    "pubmed": 7 * 86400,                   # ESummary / EFetch by PMID
+    "pubmed_search": 6 * 3600,             # ESearch result lists change as PubMed indexes
+    **dict(st.secrets.get("HTTP_CACHE_TTLS", {})),
+}
+
+# NCBI E-utilities rate limits (requests per second) and request policy
+NCBI_RATE_ANONYMOUS = 3
+NCBI_RATE_WITH_KEY = 10
+PUBMED_TIMEOUT = float(st.secrets.get("PUBMED_TIMEOUT", 45))
+PUBMED_RETRIES = int(st.secrets.get("PUBMED_RETRIES", 3))
+PUBMED_BACKOFF_SECONDS = float(st.secrets.get("PUBMED_BACKOFF_SECONDS", 1.0))  # base delay, doubled per retry, plus jitter
+PUBMED_BATCH_SIZE = 200  # ids per ESummary/EFetch POST
+
+# Semantic Scholar adaptive (AIMD) concurrency and 429 handling
+S2_INITIAL_CONCURRENCY = int(st.secrets.get("S2_INITIAL_CONCURRENCY", 2))
+S2_MAX_CONCURRENCY = int(st.secrets.get("S2_MAX_CONCURRENCY", 8))
+S2_MAX_RETRIES = int(st.secrets.get("S2_MAX_RETRIES", 4))
+
+# Persistent LLM response cache
+LLM_CACHE_ENABLED = bool(st.secrets.get("LLM_CACHE_ENABLED", True))
+LLM_CACHE_PATH = st.secrets.get("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_MAX_MB = float(st.secrets.get("LLM_CACHE_MAX_MB", 64))
+LLM_CACHE_TTL = float(st.secrets.get("LLM_CACHE_TTL_DAYS", 30)) * 86400
+
+# Async LLM executor: process-wide cap on in-flight chat completions, per-request timeout
+LLM_MAX_CONCURRENCY = int(st.secrets.get("LLM_MAX_CONCURRENCY", 8))
+LLM_TIMEOUT = float(st.secrets.get("LLM_TIMEOUT", 90))
+
+# Model routing: tiers name models, each task family gets a tier and a latency deadline
+# (seconds; time to first token when streaming). Override with LLM_TIERS = { fast = "..." }
+# and LLM_ROUTES = { annotate = { tier = "strong", timeout = 120 } }.
+LLM_TIERS = {"fast": "gpt-5-nano", "standard": "gpt-5-mini", "strong": "gpt-5", **dict(st.secrets.get("LLM_TIERS", {}))}
+LLM_FALLBACK_TIER = {"strong": "standard", "standard": "fast"}  # next faster tier after a missed deadline
+LLM_ROUTES = {
+    "classify": {"tier": "fast", "timeout": 20},
+    "query-gen": {"tier": "standard", "timeout": 45},
+    "rate": {"tier": "standard", "timeout": 60},
+    "annotate": {"tier": "standard", "timeout": 90},
+    "extract": {"tier": "standard", "timeout": 60},
+}
+for _family, _route in dict(st.secrets.get("LLM_ROUTES", {})).items():
+    LLM_ROUTES[_family] = {**LLM_ROUTES.get(_family, {"tier": "standard", "timeout": LLM_TIMEOUT}), **dict(_route)}
+
+# LLM usage accounting (tokens, latency, cost per call) and per-user daily budgets
+LLM_USAGE_PATH = st.secrets.get("LLM_USAGE_PATH", "llm_usage.sqlite3")
+LLM_DAILY_TOKEN_BUDGET = int(st.secrets.get("LLM_DAILY_TOKEN_BUDGET", 500000))  # per user; 0 = unlimited
+# USD per 1M tokens (input, output); extend/override with LLM_PRICES = { model = [input, output] }
+LLM_PRICES = {"gpt-5-mini": (0.25, 2.00), "gpt-5": (1.25, 10.00), "gpt-5-nano": (0.05, 0.40),
+              **{model: tuple(price) for model, price in dict(st.secrets.get("LLM_PRICES", {})).items()}}
+LLM_BATCH_DISCOUNT = 0.5  # Batch API requests are billed at half price
+
+# Prompt size budgets (approximate tokens) for paper context: abstract / PDF text
+RATING_CONTEXT_TOKENS = int(st.secrets.get("RATING_CONTEXT_TOKENS", 150))
+ANNOTATION_CONTEXT_TOKENS = int(st.secrets.get("ANNOTATION_CONTEXT_TOKENS", 1200))
+
+# Per-paper analysis pipeline (PDF + AI rating + Zotero) worker pool size
+ANALYSIS_MAX_WORKERS = int(st.secrets.get("ANALYSIS_MAX_WORKERS", 4))
+# Papers rated per LLM request (1 = one request per paper)
+RATING_BATCH_SIZE = int(st.secrets.get("RATING_BATCH_SIZE", 10))
+# Default for streaming AI output into the result expanders. Off by default: streaming
+# rates one paper per request, which gives up RATING_BATCH_SIZE batching
+LLM_STREAMING = bool(st.secrets.get("LLM_STREAMING", False))
+
+# Local BM25 relevance pre-filter ahead of AI rating
+PREFILTER_TOP_K = int(st.secrets.get("PREFILTER_TOP_K", 0))  # 0 = same as "Max articles to fetch"
+PREFILTER_MIN_SCORE = float(st.secrets.get("PREFILTER_MIN_SCORE", 0.35))  # relative to the best paper
+
+# PDF text extraction: download cap and pages read for the first ~5000 characters
+PDF_MAX_MB = float(st.secrets.get("PDF_MAX_MB", 15))
+PDF_MAX_PAGES = int(st.secrets.get("PDF_MAX_PAGES", 5))
+
+# Pasted-text reference extraction: approximate tokens of reference text per LLM request
+EXTRACT_CHUNK_TOKENS = int(st.secrets.get("EXTRACT_CHUNK_TOKENS", 1500))
+# Local APA/Vancouver/Nature parses at or above this confidence skip the LLM
+CITATION_MIN_CONFIDENCE = float(st.secrets.get("CITATION_MIN_CONFIDENCE", 0.75))
+
+# Offline bulk annotation through the OpenAI Batch API
+BATCH_POLL_SECONDS = float(st.secrets.get("BATCH_POLL_SECONDS", 15))
+BATCH_MAX_WAIT_MINUTES = float(st.secrets.get("BATCH_MAX_WAIT_MINUTES", 120))
+# Completion tokens (reasoning included) held against the budget per batch request until its results are in
+BATCH_REPLY_TOKENS = int(st.secrets.get("BATCH_REPLY_TOKENS", 1500))
+
+# ============================
+# HTTP CLIENT
+# ============================
+@st.cache_resource
+def get_http_client() -> httpx.Client:
+    """
+    Process-wide httpx client shared by every provider call (all sessions, all threads).
+    Connections are pooled and kept alive per origin, so repeated calls to
+    Semantic Scholar / NCBI / Crossref / bioRxiv skip the TCP+TLS handshake.
+    """
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            debug_utils.log_warning("HTTP2_ENABLED is set but the 'h2' package is missing - using HTTP/1.1")
+            http2 = False
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    return httpx.Client(
+        http2=http2,
+        limits=limits,
+        timeout=httpx.Timeout(30.0, connect=10.0),
+        follow_redirects=True,
+    )
+
+class SQLiteCache:
+    """
+    Small thread-safe key/value store on SQLite with a TTL per entry, a total size
+    bound (least recently used entries are evicted first) and hit/miss counters.
+    """
+
+    def __init__(self, path: str, table: str = "cache", max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.table = table
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_lru ON {table}(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str):
+        """Return the stored bytes for key, or None if missing/expired."""
+        now = time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return bytes(row[0])
+
+    def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        now = time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), now + ttl, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        # Expired entries go first, then least recently used until under the bound
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+        total = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            f"SELECT key, size FROM {self.table} ORDER BY last_access ASC"
+        ).fetchall():
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "size_mb": size / (1024 * 1024),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+@st.cache_resource
+def get_http_cache() -> SQLiteCache:
+    """Process-wide response cache shared by all sessions (see HTTP_CACHE_TTLS)."""
+    return SQLiteCache(HTTP_CACHE_PATH, table="http_responses", max_bytes=int(HTTP_CACHE_MAX_MB * 1024 * 1024))
+
+# Credentials/contact params don't change the response, so they are left out of cache keys
+_CACHE_KEY_IGNORED_PARAMS = {"api_key", "email", "key", "tool"}
+
+def _http_cache_key(method: str, url: str, params=None, data=None, json_body=None) -> str:
+    def _norm(d):
+        return sorted((str(k), str(v)) for k, v in (d or {}).items() if k not in _CACHE_KEY_IGNORED_PARAMS)
+    raw = json.dumps([method.upper(), url, _norm(params), _norm(data), json_body], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+@st.cache_resource
+def get_ncbi_rate_limiter() -> TokenBucket:
+    """
+    One limiter for every NCBI request in this process (all threads and sessions):
+    3 req/s anonymously, 10 req/s with NCBI_API_KEY. Capacity 1 keeps any one-second
+    window within NCBI's limit.
+    """
+    return TokenBucket(NCBI_RATE_WITH_KEY if NCBI_API_KEY else NCBI_RATE_ANONYMOUS)
+
+# Providers whose network requests draw from the NCBI token bucket
+NCBI_PROVIDERS = {"pubmed", "pubmed_search", "pubmed_web"}
+
+@st.cache_resource
+def get_s2_throttle() -> AdaptiveThrottle:
+    """One AIMD throttle for every Semantic Scholar request in this process."""
+    return AdaptiveThrottle(S2_INITIAL_CONCURRENCY, S2_MAX_CONCURRENCY, S2_MAX_RETRIES)
+
+S2_PROVIDERS = {"semantic_scholar", "semantic_scholar_search"}
+
+def _send_with_provider_controls(provider, send_fn):
+    """Apply the provider's client-side rate control around one network request."""
+    if provider in NCBI_PROVIDERS:
+        limiter = get_ncbi_rate_limiter()
+        for attempt in range(3):
+            limiter.acquire()
+            resp = send_fn()
+            # Throttled anyway (e.g. another process on the same key): queue for another token
+            if resp.status_code != 429 or attempt == 2:
+                break
+            resp.close()
+        return resp
+    if provider in S2_PROVIDERS:
+        return get_s2_throttle().send(send_fn)
+    return send_fn()
+
+def _json_reply(resp):
+    try:
+        return resp.json()
+    except ValueError:
+        return None
+
+def ncbi_reply_ok(resp) -> bool:
+    """E-utilities can answer 200 with an ERROR field (bad term, backend hiccup); don't cache those."""
+    data = _json_reply(resp)
+    if not isinstance(data, dict) or data.get("error") or data.get("ERROR"):
+        return False
+    search = data.get("esearchresult")
+    return not (isinstance(search, dict) and search.get("ERROR"))
+
+def biorxiv_reply_ok(resp) -> bool:
+    """bioRxiv answers unknown DOIs with 200 and a "no posts found" message instead of a collection."""
+    data = _json_reply(resp)
+    return isinstance(data, dict) and bool(data.get("collection"))
+
+def cached_http_request(method: str, url: str, *, provider=None, params=None, data=None, json_body=None, headers=None,
+                        timeout=30, accept=None):
+    """
+    Send a request through the shared client. For providers listed in HTTP_CACHE_TTLS,
+    fresh 2xx bodies are served from the on-disk cache and new 2xx bodies are stored.
+    accept(resp) lets the caller keep 2xx replies that are really errors (e.g. an NCBI
+    ERROR field) out of the cache; a cached body it rejects is treated as a miss.
+    Always returns an httpx.Response.
+    """
+    ttl = HTTP_CACHE_TTLS.get(provider, 0) if provider else 0
+    cache = get_http_cache() if HTTP_CACHE_ENABLED and ttl > 0 else None
+    if cache is not None:
+        key = _http_cache_key(method, url, params, data, json_body)
+        body = cache.get(key)
+        if body is not None:
+            cached = httpx.Response(200, content=body, request=httpx.Request(method, url, params=params))
+            if accept is None or accept(cached):
+                return cached
+    resp = _send_with_provider_controls(provider, lambda: get_http_client().request(
+        method, url, params=params, data=data, json=json_body, headers=headers, timeout=timeout))
+    if cache is not None and 200 <= resp.status_code < 300 and (accept is None or accept(resp)):
+        cache.set(key, resp.content, ttl)
+    return resp
+
+def cached_http_stream(method: str, url: str, *, provider=None, params=None, data=None, headers=None,
+                       timeout=30, chunk_size=64 * 1024):
+    """
+    Streaming counterpart of cached_http_request: yields the response body as byte chunks
+    without ever holding it as one string. A fresh cached body is yielded as a single chunk;
+    network bodies up to HTTP_CACHE_MAX_STREAM_MB are also written to the cache.
+    Raises httpx.HTTPStatusError for non-2xx responses.
+    """
+    ttl = HTTP_CACHE_TTLS.get(provider, 0) if provider else 0
+    cache = get_http_cache() if HTTP_CACHE_ENABLED and ttl > 0 else None
+    if cache is not None:
+        key = _http_cache_key(method, url, params, data)
+        body = cache.get(key)
+        if body is not None:
+            yield body
+            return
+    client = get_http_client()
+    request = client.build_request(method, url, params=params, data=data, headers=headers, timeout=timeout)
+    resp = _send_with_provider_controls(provider, lambda: client.send(request, stream=True))
+    try:
+        resp.raise_for_status()
+        buffer = bytearray() if cache is not None else None
+        for chunk in resp.iter_bytes(chunk_size):
+            if buffer is not None:
+                buffer.extend(chunk)
+                if len(buffer) > HTTP_CACHE_MAX_STREAM_MB * 1024 * 1024:
+                    buffer = None  # too large to cache; keep streaming
+            yield chunk
+        if buffer is not None:
+            cache.set(key, bytes(buffer), ttl)
+    finally:
+        resp.close()
 
 # Initialize OpenAI client with error handling
 openai_client = None
@@ -34,11 +392,10 @@ OPENAI_ENABLED = False
 
 if OPENAI_API_KEY and OPENAI_API_KEY != "REPLACE_WITH_YOUR_OPENAI_API_KEY":
     try:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
+        openai_client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
         # Quick test of the API key
-        import requests
-        test_response = requests.get(
-            'https://api.openai.com/v1/models',
+        test_response = get_http_client().get(
+            f'{OPENAI_BASE_URL}/models',
             headers={'Authorization': f'Bearer {OPENAI_API_KEY}'},
             timeout=5
         )
@@ -56,6 +413,507 @@ else:
     print("📝 Please set OPENAI_API_KEY to enable AI features")
     print("   Get your API key from: https://platform.openai.com/account/api-keys")
 
+# ============================
+# LLM CALLS (single entry point + persistent cache)
+# ============================
+class LLMExecutor:
+    """
+    Runs chat completions on one background asyncio loop with an AsyncOpenAI client.
+    At most max_concurrency requests are in flight process-wide and each one is cut off
+    after `timeout` seconds. Callers on the script or worker threads get a
+    concurrent.futures.Future; cancelling it aborts the underlying HTTP request.
+    """
+
+    def __init__(self, api_key, base_url, max_concurrency, timeout):
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="llm-executor", daemon=True).start()
+        # Client and semaphore must be created on (and bound to) the executor's loop
+        asyncio.run_coroutine_threadsafe(self._setup(api_key, base_url, max_concurrency), self._loop).result()
+
+    async def _setup(self, api_key, base_url, max_concurrency):
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=self.timeout)
+
+    async def _create(self, model, prompt, create_kwargs, timeout=None):
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                self._client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    **create_kwargs
+                ),
+                timeout or self.timeout,
+            )
+
+    async def _stream(self, model, prompt, on_text, create_kwargs, first_token_timeout=None):
+        usage = None
+
+        async def first_token():
+            # Send the request and read up to the first text delta; returns the chunk iterator
+            nonlocal usage
+            stream = await self._client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+                stream=True,
+                stream_options={"include_usage": True},
+                **create_kwargs
+            )
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    return None
+                usage = getattr(chunk, "usage", None) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    on_text(chunk.choices[0].delta.content)
+                    return chunks
+
+        async def consume():
+            nonlocal usage
+            # The first-token deadline starts here, once a concurrency slot is held
+            chunks = await asyncio.wait_for(first_token(), first_token_timeout or self.timeout)
+            if chunks is not None:
+                async for chunk in chunks:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        on_text(chunk.choices[0].delta.content)
+                    usage = getattr(chunk, "usage", None) or usage
+            return usage
+
+        async with self._semaphore:
+            return await asyncio.wait_for(consume(), self.timeout)
+
+    def submit(self, prompt: str, *, model: str, group=None, timeout=None, **create_kwargs):
+        """
+        Schedule a completion; returns a Future resolving to the ChatCompletion.
+        timeout (seconds, default: the executor's) starts once the request is sent.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._create(model, prompt, create_kwargs, timeout), self._loop)
+        if group is not None:
+            group.track(future)
+        return future
+
+    def stream(self, prompt: str, *, model: str, on_text, group=None, first_token_timeout=None, **create_kwargs):
+        """
+        Schedule a streamed completion. on_text(delta) is called on the executor loop as
+        tokens arrive; the returned Future resolves to the usage (or None) at the end.
+        first_token_timeout (seconds) starts once the request is sent, like submit()'s
+        timeout; the whole stream is still cut off after the executor's timeout.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._stream(model, prompt, on_text, create_kwargs, first_token_timeout), self._loop)
+        if group is not None:
+            group.track(future)
+        return future
+
+@st.cache_resource
+def get_llm_executor() -> LLMExecutor:
+    return LLMExecutor(OPENAI_API_KEY, OPENAI_BASE_URL, LLM_MAX_CONCURRENCY, LLM_TIMEOUT)
+
+class LLMCallGroup:
+    """
+    LLM requests issued by one script run. cancel() aborts everything still pending,
+    and anything submitted afterwards is cancelled on arrival, so a stopped run
+    (user navigated away or changed a widget) stops spending on completions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = set()
+        self.cancelled = False
+
+    def track(self, future):
+        with self._lock:
+            if self.cancelled:
+                future.cancel()
+                return
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def cancel(self) -> int:
+        with self._lock:
+            self.cancelled = True
+            pending, self._futures = list(self._futures), set()
+        for future in pending:
+            future.cancel()
+        return len(pending)
+
+# Per script run: module-level state is rebuilt on every Streamlit rerun
+LLM_CALLS = LLMCallGroup()
+
+@st.cache_resource
+def get_llm_cache() -> SQLiteCache:
+    """Process-wide cache of chat completions, shared by all sessions."""
+    return SQLiteCache(LLM_CACHE_PATH, table="llm_responses", max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024))
+
+def profile_fingerprint(profile=None) -> str:
+    """Short stable hash of the interests that drive rating (topics, authors, journals)."""
+    if profile is None:
+        profile = st.session_state.get("user_profile", {}) or {}
+    interests = {k: sorted(profile.get(k, []) or []) for k in ("topics", "authors", "journals")}
+    return hashlib.sha256(json.dumps(interests, sort_keys=True).encode()).hexdigest()[:16]
+
+def _llm_cache_key(model: str, prompt: str, fingerprint: str, extra=None) -> str:
+    normalized = re.sub(r"\s+", " ", prompt).strip()
+    prompt_hash = hashlib.sha256(normalized.encode()).hexdigest()
+    return hashlib.sha256(json.dumps([model, prompt_hash, fingerprint, extra], sort_keys=True).encode()).hexdigest()
+
+class LLMBudgetExceeded(RuntimeError):
+    """The user has spent their daily LLM token budget."""
+
+class LLMUsageLedger:
+    """
+    One SQLite row per LLM call (cache hits included, with zero tokens): who, which run,
+    which task and calling function, model, prompt/completion tokens, latency and cost.
+    Thread-safe; aggregates per run, per user and per day. Also holds in-memory token
+    reservations for work that is billed later (Batch API jobs), see reserve().
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.RLock()
+        self._reserved = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_calls ("
+            "ts REAL NOT NULL, day TEXT NOT NULL, username TEXT NOT NULL, run_id TEXT NOT NULL, "
+            "task TEXT NOT NULL, caller TEXT NOT NULL, model TEXT NOT NULL, "
+            "prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, "
+            "latency REAL, cached INTEGER NOT NULL, cost REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_calls_user_day ON llm_calls(username, day)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_calls_run ON llm_calls(run_id)")
+        self._conn.commit()
+
+    def record(self, *, username, run_id, task, caller, model, prompt_tokens=0, completion_tokens=0,
+               latency=None, cached=False, cost=0.0):
+        now = datetime.now()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO llm_calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now.timestamp(), now.date().isoformat(), username, run_id, task, caller, model,
+                 int(prompt_tokens or 0), int(completion_tokens or 0), latency, int(cached), float(cost)),
+            )
+            self._conn.commit()
+
+    def _summary(self, where: str, args: tuple) -> dict:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(cached), 0), COALESCE(SUM(prompt_tokens), 0), "
+                "COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(cost), 0), AVG(latency) "
+                f"FROM llm_calls WHERE {where}", args
+            ).fetchone()
+        calls, cached, prompt_tokens, completion_tokens, cost, latency = row
+        return {"calls": calls, "cached": cached, "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens, "tokens": prompt_tokens + completion_tokens,
+                "cost": cost, "avg_latency": latency or 0.0}
+
+    def run_summary(self, run_id: str) -> dict:
+        return self._summary("run_id = ?", (run_id,))
+
+    def user_day_summary(self, username: str, day: str = None) -> dict:
+        return self._summary("username = ? AND day = ?", (username, day or datetime.now().date().isoformat()))
+
+    def reserved(self, username: str) -> int:
+        """Tokens currently held for username by reserve()."""
+        with self._lock:
+            return self._reserved.get(username, 0)
+
+    def reserve(self, username: str, tokens: int, budget: int) -> bool:
+        """
+        Hold tokens against username's daily budget (0 = unlimited) unless today's usage plus
+        what is already held would then exceed it. Checked and held under one lock, so
+        concurrent reservations cannot both squeeze under the cap. Undo with release().
+        """
+        with self._lock:
+            if budget > 0 and self.user_day_summary(username)["tokens"] + self.reserved(username) + tokens > budget:
+                return False
+            self._reserved[username] = self.reserved(username) + tokens
+            return True
+
+    def release(self, username: str, tokens: int):
+        with self._lock:
+            left = self.reserved(username) - tokens
+            if left > 0:
+                self._reserved[username] = left
+            else:
+                self._reserved.pop(username, None)
+
+    def by_user(self, since_day: str) -> list:
+        """[(username, calls, tokens, cost)] since since_day (inclusive), biggest spender first."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT username, COUNT(*), SUM(prompt_tokens + completion_tokens), SUM(cost) FROM llm_calls "
+                "WHERE day >= ? GROUP BY username ORDER BY 3 DESC", (since_day,)
+            ).fetchall()
+
+    def by_caller(self, since_day: str) -> list:
+        """[(caller, task, model, calls, tokens, cost, avg_latency)] since since_day (inclusive)."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT caller, task, model, COUNT(*), SUM(prompt_tokens + completion_tokens), SUM(cost), AVG(latency) "
+                "FROM llm_calls WHERE day >= ? GROUP BY caller, task, model ORDER BY 5 DESC", (since_day,)
+            ).fetchall()
+
+@st.cache_resource
+def get_llm_usage() -> LLMUsageLedger:
+    """Process-wide usage ledger shared by all sessions."""
+    return LLMUsageLedger(LLM_USAGE_PATH)
+
+# Per script run, like LLM_CALLS: groups the calls one search (or query generation) made
+LLM_RUN_ID = uuid.uuid4().hex[:12]
+# Also per run: username -> daily token budget, so users.json is read once per user and run
+# rather than before every API call (worker threads included)
+LLM_RUN_BUDGETS = {}
+
+# Wrappers skipped when naming the function that asked for a completion
+_LLM_PLUMBING = {"llm_complete", "llm_stream", "openai_structured", "run_openai_batch", "read_openai_batch_results",
+                 "record_llm_usage", "<lambda>"}
+
+def _llm_caller() -> str:
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_name in _LLM_PLUMBING:
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else "unknown"
+
+def llm_username() -> str:
+    try:
+        return st.session_state.get("username") or "anonymous"
+    except Exception:
+        # No Streamlit script context on this thread
+        return "anonymous"
+
+# Dated snapshot the API reports for an alias, e.g. "gpt-5-mini-2025-08-07"
+_MODEL_SNAPSHOT_RE = re.compile(r"-\d{4}-\d{2}-\d{2}$")
+
+def llm_cost(model: str, prompt_tokens: int, completion_tokens: int, batch: bool = False) -> float:
+    """USD cost of a call from LLM_PRICES (snapshots priced as their alias; 0 for unknown models)."""
+    price_in, price_out = LLM_PRICES.get(model) or LLM_PRICES.get(_MODEL_SNAPSHOT_RE.sub("", model or ""), (0.0, 0.0))
+    cost = ((prompt_tokens or 0) * price_in + (completion_tokens or 0) * price_out) / 1_000_000
+    return cost * (LLM_BATCH_DISCOUNT if batch else 1.0)
+
+def record_llm_usage(task: str, model: str, usage=None, *, latency=None, cached=False, batch=False):
+    """Add one call to the usage ledger; usage is the API's usage object or dict (None for cache hits)."""
+    read = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, None)
+    prompt_tokens = (read("prompt_tokens") if usage is not None else 0) or 0
+    completion_tokens = (read("completion_tokens") if usage is not None else 0) or 0
+    try:
+        get_llm_usage().record(
+            username=llm_username(), run_id=LLM_RUN_ID, task=task, caller=_llm_caller(), model=model,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, latency=latency, cached=cached,
+            cost=llm_cost(model, prompt_tokens, completion_tokens, batch),
+        )
+    except Exception as e:
+        # Accounting must never break the call it describes
+        print(f"LLM usage recording failed: {e}")
+
+def user_token_budget(username: str) -> int:
+    """Daily token budget for a user: their own setting if the admin set one, else LLM_DAILY_TOKEN_BUDGET (0 = unlimited)."""
+    if username not in LLM_RUN_BUDGETS:
+        budget = load_users().get(username, {}).get("daily_token_budget")
+        LLM_RUN_BUDGETS[username] = LLM_DAILY_TOKEN_BUDGET if budget is None else int(budget)
+    return LLM_RUN_BUDGETS[username]
+
+def llm_tokens_left(username: str = None):
+    """Tokens the user may still spend today (less any held by reservations), or None when unlimited."""
+    username = username or llm_username()
+    budget = user_token_budget(username)
+    if budget <= 0:
+        return None
+    usage = get_llm_usage()
+    return max(0, budget - usage.user_day_summary(username)["tokens"] - usage.reserved(username))
+
+def check_llm_budget():
+    """Raise LLMBudgetExceeded when the current user has no tokens left today."""
+    if llm_tokens_left() == 0:
+        raise LLMBudgetExceeded(f"Daily AI token budget of {user_token_budget(llm_username()):,} tokens used up for '{llm_username()}'")
+
+# Task labels passed to llm_complete()/llm_stream() -> routing family in LLM_ROUTES
+_TASK_FAMILIES = {
+    "classify": "classify",
+    "query-gen": "query-gen", "query-plan": "query-gen", "boolean-query": "query-gen",
+    "rate": "rate", "rate-batch": "rate", "rate-stream": "rate",
+    "annotate": "annotate", "annotate-stream": "annotate",
+    "extract-refs": "extract",
+}
+# Deadline misses: our own wait_for (asyncio's TimeoutError is not the builtin one before 3.11) or the client's
+_LLM_DEADLINE_ERRORS = (asyncio.TimeoutError, TimeoutError, APITimeoutError)
+
+def llm_route(task: str, model: str = None) -> dict:
+    """
+    Model choice for a task: {"family", "tier", "models", "timeout"} where models is the
+    primary model followed by the next faster tier's (if any) for a missed deadline.
+    An explicit model bypasses routing (no fallback, executor timeout).
+    """
+    if model:
+        return {"family": None, "tier": None, "models": [model], "timeout": LLM_TIMEOUT}
+    family = _TASK_FAMILIES.get(task.removesuffix("-retry"))
+    route = LLM_ROUTES.get(family, {"tier": "standard", "timeout": LLM_TIMEOUT})
+    tier = route["tier"]
+    models = [LLM_TIERS[tier]]
+    fallback = LLM_FALLBACK_TIER.get(tier)
+    if fallback and LLM_TIERS[fallback] not in models:
+        models.append(LLM_TIERS[fallback])
+    return {"family": family, "tier": tier, "models": models, "timeout": float(route["timeout"])}
+
+def llm_cached_reply(prompt: str, *, model: str = "gpt-5-mini", use_profile: bool = False, **create_kwargs):
+    """Cached reply text for this exact request, or None (also None when the cache is off)."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    fingerprint = profile_fingerprint() if use_profile else ""
+    hit = get_llm_cache().get(_llm_cache_key(model, prompt, fingerprint, create_kwargs or None))
+    return hit.decode("utf-8") if hit is not None else None
+
+def llm_remember(prompt: str, text: str, *, model: str = "gpt-5-mini", use_profile: bool = False, **create_kwargs):
+    """Store a successful reply so llm_complete() serves the same request from disk."""
+    if not LLM_CACHE_ENABLED or not text:
+        return
+    fingerprint = profile_fingerprint() if use_profile else ""
+    get_llm_cache().set(_llm_cache_key(model, prompt, fingerprint, create_kwargs or None), text.encode("utf-8"), LLM_CACHE_TTL)
+
+def llm_complete(prompt: str, *, task: str, model: str = None, use_profile: bool = False, accept=None, **create_kwargs) -> str:
+    """
+    Single entry point for chat completions; returns the (stripped) message text.
+    The model comes from the task's route (LLM_ROUTES) unless given explicitly; when the
+    routed model misses the task's deadline the request is repeated once on the next
+    faster tier. Answers are cached on disk by model + normalized prompt hash (+ the
+    user's profile fingerprint when use_profile=True), so reruns and widget toggles cost
+    no LLM calls. The request itself runs on the shared async executor (bounded
+    concurrency, timeout) and is tracked in this run's LLM_CALLS group so a stopped run
+    can cancel it.
+    Raises if OpenAI is unavailable or the call fails; failures are never cached, nor are
+    replies for which accept(text) returns False (e.g. JSON that fails its schema).
+    Every call is recorded in the usage ledger, and LLMBudgetExceeded is raised instead of
+    calling the API once the user's daily token budget is spent (cache hits stay free).
+    """
+    if not openai_client:
+        raise RuntimeError("OpenAI client not available")
+    route = llm_route(task, model)
+    for model in route["models"]:
+        cached = llm_cached_reply(prompt, model=model, use_profile=use_profile, **create_kwargs)
+        if cached is not None and (accept is None or accept(cached)):
+            print(f"LLM cache hit ({task}, {model})")
+            debug_utils.log_info(f"LLM {task} ({model}): cache hit, ~{approx_tokens(prompt)} prompt tokens saved")
+            record_llm_usage(task, model, cached=True)
+            return cached
+    check_llm_budget()
+    for n, model in enumerate(route["models"]):
+        started = monotonic()
+        try:
+            response = get_llm_executor().submit(prompt, model=model, group=LLM_CALLS, timeout=route["timeout"],
+                                                 **create_kwargs).result()
+            break
+        except _LLM_DEADLINE_ERRORS:
+            if n + 1 == len(route["models"]):
+                raise
+            debug_utils.log_info(f"LLM {task}: {model} missed the {route['timeout']:.0f}s deadline, "
+                                 f"falling back to {route['models'][n + 1]}")
+    text = (response.choices[0].message.content or "").strip()
+    usage = getattr(response, "usage", None)
+    record_llm_usage(task, model, usage, latency=monotonic() - started)
+    debug_utils.log_info(
+        f"LLM {task} ({model}, {route['tier'] or 'explicit'}{' fallback' if model != route['models'][0] else ''}): "
+        f"prompt={getattr(usage, 'prompt_tokens', None)} "
+        f"completion={getattr(usage, 'completion_tokens', None)} tokens (estimated prompt ~{approx_tokens(prompt)})"
+    )
+    if accept is None or accept(text):
+        llm_remember(prompt, text, model=model, use_profile=use_profile, **create_kwargs)
+    return text
+
+def llm_stream(prompt: str, *, task: str, on_text, model: str = None, use_profile: bool = False, accept=None, **create_kwargs) -> str:
+    """
+    Streaming variant of llm_complete(): on_text(delta) is called on the calling thread
+    as the reply arrives, and the full (stripped) text is returned at the end. Shares the
+    routing, cache, executor limits, usage accounting and LLM_CALLS cancellation; a cache
+    hit arrives as one delta. The route's deadline applies to the first token, counted from
+    when the request is sent; a model that misses it is cancelled in favour of the next
+    faster tier. Latency is recorded to the end of the stream.
+    """
+    if not openai_client:
+        raise RuntimeError("OpenAI client not available")
+    route = llm_route(task, model)
+    for model in route["models"]:
+        cached = llm_cached_reply(prompt, model=model, use_profile=use_profile, **create_kwargs)
+        if cached is not None and (accept is None or accept(cached)):
+            print(f"LLM cache hit ({task}, {model})")
+            debug_utils.log_info(f"LLM {task} ({model}): cache hit, ~{approx_tokens(prompt)} prompt tokens saved")
+            record_llm_usage(task, model, cached=True)
+            on_text(cached)
+            return cached
+    check_llm_budget()
+    for n, model in enumerate(route["models"]):
+        # Deltas are handed over through a queue so on_text runs here, not on the executor loop
+        deltas = queue.Queue()
+        started = monotonic()
+        # The executor enforces the first-token deadline after the request leaves its queue,
+        # so waiting for a concurrency slot never counts as a miss (same as llm_complete)
+        future = get_llm_executor().stream(prompt, model=model, on_text=deltas.put, group=LLM_CALLS,
+                                           first_token_timeout=route["timeout"], **create_kwargs)
+        future.add_done_callback(lambda _, deltas=deltas: deltas.put(None))
+        delta = deltas.get()
+        if delta is not None or future.cancelled() or not isinstance(future.exception(), _LLM_DEADLINE_ERRORS):
+            break
+        if n + 1 == len(route["models"]):
+            raise TimeoutError(f"{model} sent nothing within {route['timeout']:.0f}s ({task})") from future.exception()
+        debug_utils.log_info(f"LLM {task}: {model} missed the {route['timeout']:.0f}s first-token deadline, "
+                             f"falling back to {route['models'][n + 1]}")
+    chunks = []
+    while delta is not None:
+        chunks.append(delta)
+        on_text(delta)
+        delta = deltas.get()
+    usage = future.result()  # re-raises API errors, timeouts and cancellation
+    record_llm_usage(task, model, usage, latency=monotonic() - started)
+    text = "".join(chunks).strip()
+    debug_utils.log_info(
+        f"LLM {task} ({model}, {route['tier'] or 'explicit'}{' fallback' if model != route['models'][0] else ''}, streamed): "
+        f"prompt={getattr(usage, 'prompt_tokens', None)} "
+        f"completion={getattr(usage, 'completion_tokens', None)} tokens (estimated prompt ~{approx_tokens(prompt)})"
+    )
+    if accept is None or accept(text):
+        llm_remember(prompt, text, model=model, use_profile=use_profile, **create_kwargs)
+    return text
+
+# ============================
+# STREAMED REPLIES (plain text first, Score/Tags tail)
+# ============================
+class LiveText:
+    """
+    Reply text streamed by a worker thread for one paper. The renderer attaches a
+    placeholder once the paper's expander exists and calls refresh() while it waits;
+    deltas arriving on the renderer's own thread (sequential runs) refresh directly.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._view = None
+        self._owner = None
+        self._shown = ""
+
+    def append(self, delta: str):
+        self._chunks.append(delta)  # list.append is atomic; readers join a snapshot
+        if self._view is not None and threading.get_ident() == self._owner:
+            self.refresh()
+
+    def attach(self, view):
+        self._view, self._owner = view, threading.get_ident()
+        self.refresh()
+
+    def refresh(self):
+        body = parse_streamed_reply("".join(self._chunks))[0]
+        if self._view is not None and body and body != self._shown:
+            self._shown = body
+            self._view.markdown(f"**Abstract (AI, streaming…):**\n\n{body} ▌")
+
 SLEEP = 0.08  # pacing for retries/backoff
 USERS_FILE = "users.json"
 ADMIN_KEYWORD = "AmyloNMRCryo42!"
@@ -270,6 +1128,73 @@ def render_admin_panel():
         st.session_state.default_authors = authors
         st.session_state.default_journals = journals
         st.sidebar.success("Defaults applied to all users.")
+    # HTTP response cache
+    st.sidebar.markdown("**HTTP Response Cache**")
+    if HTTP_CACHE_ENABLED:
+        cache_stats = get_http_cache().stats()
+        st.sidebar.caption(
+            f"{cache_stats['entries']} entries ({cache_stats['size_mb']:.1f} MB) — "
+            f"{cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%} hit rate since start)"
+        )
+        if st.sidebar.button("Clear HTTP Cache"):
+            get_http_cache().clear()
+            st.sidebar.success("HTTP response cache cleared.")
+    else:
+        st.sidebar.caption("Disabled (HTTP_CACHE_ENABLED = false)")
+    # LLM cache
+    st.sidebar.markdown("**LLM Response Cache**")
+    if LLM_CACHE_ENABLED:
+        llm_stats = get_llm_cache().stats()
+        st.sidebar.caption(
+            f"{llm_stats['entries']} entries ({llm_stats['size_mb']:.1f} MB) — "
+            f"{llm_stats['hits']} hits / {llm_stats['misses']} misses "
+            f"({llm_stats['hit_rate']:.0%} hit rate since start)"
+        )
+        if st.sidebar.button("Clear LLM Cache"):
+            get_llm_cache().clear()
+            st.sidebar.success("LLM response cache cleared.")
+    else:
+        st.sidebar.caption("Disabled (LLM_CACHE_ENABLED = false)")
+    # LLM usage and per-user daily budgets
+    st.sidebar.markdown("**LLM Usage & Budgets**")
+    ledger = get_llm_usage()
+    today = datetime.now().date().isoformat()
+    for uname, calls, tokens, cost in ledger.by_user(today):
+        budget = user_token_budget(uname)
+        st.sidebar.caption(
+            f"{uname}: {calls} calls, {tokens:,} tokens"
+            f"{f' of {budget:,}' if budget > 0 else ''} today (~${cost:.3f})"
+        )
+    week = (datetime.now() - timedelta(days=6)).date().isoformat()
+    with st.sidebar.expander("Last 7 days by function"):
+        for caller, task, model, calls, tokens, cost, latency in ledger.by_caller(week):
+            st.caption(f"{caller} ({task} → {model}): {calls} calls, {tokens:,} tokens, ~${cost:.3f}, "
+                       f"{latency or 0:.1f}s avg")
+    st.sidebar.caption("Routing: " + "; ".join(
+        f"{family} → {LLM_TIERS[route['tier']]} ({route['tier']}, {float(route['timeout']):.0f}s)"
+        for family, route in LLM_ROUTES.items()
+    ))
+    budget_user = st.sidebar.selectbox("User", list(users), key="budget_user")
+    if budget_user:
+        new_budget = st.sidebar.number_input(
+            "Daily token budget (0 = unlimited)", min_value=0, step=10000,
+            value=user_token_budget(budget_user), key=f"budget_{budget_user}",
+            help=f"Default for users without their own budget: {LLM_DAILY_TOKEN_BUDGET:,}"
+        )
+        if st.sidebar.button("Save Token Budget"):
+            users[budget_user]["daily_token_budget"] = int(new_budget)
+            save_users(users)
+            LLM_RUN_BUDGETS[budget_user] = int(new_budget)
+            st.sidebar.success(f"Daily token budget for '{budget_user}' set to {int(new_budget):,}.")
+    # Semantic Scholar throttling
+    st.sidebar.markdown("**Semantic Scholar Throttle**")
+    s2_stats = get_s2_throttle().stats()
+    st.sidebar.caption(
+        f"Concurrency limit {s2_stats['limit']:.1f} ({s2_stats['in_flight']} in flight) — "
+        f"{s2_stats['requests']} requests, {s2_stats['throttled']} × 429, "
+        f"{s2_stats['retries']} retries, {s2_stats['gave_up']} gave up"
+    )
     # Delete users
     st.sidebar.markdown("**Delete User**")
     del_user = st.sidebar.selectbox("Select user to delete", [u for u in users if u != st.session_state.username])
@@ -282,6 +1207,9 @@ def render_admin_panel():
 def render_user_profile():
     st.sidebar.markdown("---")
     st.sidebar.subheader(f"👤 Welcome, {st.session_state.username}!")
+    tokens_left = llm_tokens_left(st.session_state.username)
+    if tokens_left is not None:
+        st.sidebar.caption(f"🧾 AI tokens left today: {tokens_left:,} of {user_token_budget(st.session_state.username):,}")
 
     if is_admin():
         render_admin_panel()
@@ -323,6 +1251,8 @@ def render_user_profile():
                                        profile.get("search_preferences", {}).get("max_results", 20))
         default_min_score = st.slider("Default Min Score", 0, 3, 
                                      profile.get("search_preferences", {}).get("min_score", 2))
+        default_workers = st.slider("Default Parallel Workers", 1, 12,
+                                    profile.get("search_preferences", {}).get("analysis_workers", ANALYSIS_MAX_WORKERS))
         
         if st.button("💾 Save Profile"):
             updated_profile = {
@@ -335,7 +1265,8 @@ def render_user_profile():
                 "search_preferences": {
                     "default_source": default_source,
                     "max_results": default_max_results,
-                    "min_score": default_min_score
+                    "min_score": default_min_score,
+                    "analysis_workers": default_workers
                 }
             }
             
@@ -402,6 +1333,28 @@ if search_source:
 max_results = st.slider("📄 Max articles to fetch:", 5, 100, 
                        search_prefs.get("max_results", 20), 1)
 
+analysis_workers = st.slider("⚡ Papers analyzed in parallel:", 1, 12,
+                             search_prefs.get("analysis_workers", ANALYSIS_MAX_WORKERS), 1,
+                             help="1 = one paper at a time. Results are always shown in the original order.")
+
+# Pre-filter ONLY for Keyword Search: pasted references and URL/PDF lookups are always rated
+if search_mode == "Keyword Search":
+    prefilter_enabled = st.checkbox("🎯 Pre-filter by profile relevance before AI rating", value=True,
+                                    help="Ranks papers locally (BM25 over title + abstract against your profile topics, "
+                                         "authors and journals) and only sends the best matches to the AI. Untick to rate everything.")
+    prefilter_top_k = st.slider("🎯 Papers sent to AI rating (top-K by pre-score):", 1, 100,
+                                min(100, PREFILTER_TOP_K or max_results), 1, disabled=not prefilter_enabled,
+                                help=f"Papers scoring at least {PREFILTER_MIN_SCORE:.0%} of the best match are always included.")
+else:
+    prefilter_enabled, prefilter_top_k = False, max_results
+
+bulk_annotation = st.checkbox("📦 Bulk annotation (OpenAI Batch API)",
+                              help="Submit all rating requests as one offline batch job and wait for it. "
+                                   "Slower turnaround but cheaper for hundreds of papers; replies are cached for later runs.")
+stream_ai_output = st.checkbox("⚡ Stream AI abstracts as they are written", value=LLM_STREAMING, disabled=bulk_annotation,
+                               help="Shows each paper's AI text while it is being generated instead of after the full reply. "
+                                    "Papers are then rated with one request each rather than in batches.")
+
 # Unified relevance is score3 (0..3)
 min_score3 = st.slider("⭐ Minimum AI relevance score3 to save to Zotero (0-3):", 0, 3, 
                       search_prefs.get("min_score", 2), 1)
@@ -566,78 +1519,82 @@ def smart_tag_processing(proposed_tags, zot=None):
 # Professor's Enhanced Functions Integration
 # ============================
 
-def what_is_requested(text_list):
-    """
-    GPT-5-mini classification of research query type
-    Returns: (classification_integers, classification_texts)
+# Research request classes shared by classification, query generation and rating
+QUERY_CLASSES = {
+    1: "general research",
+    2: "evolutionary biology research",
+    3: "physical chemistry/biochemistry research",
+    4: "PMID list",
+    5: "DOI list"
+}
+
+def _classify_request_llm(text):
+    """GPT-5-mini classification for ambiguous requests. Returns the class number."""
+    prompt = f"""
+    Classify the following research request into one of these categories:
+    
+    1 = General research topic (broad scientific inquiry)
+    2 = Evolutionary biology research (evolution, phylogenetics, natural selection)  
+    3 = Physical chemistry/biochemistry research (molecular mechanisms, thermodynamics, structural biology)
+    4 = PMID list (contains 8+ digit numbers that look like PubMed IDs)
+    
+    Text to classify: "{text}"
+    
+    Respond with only the number (1, 2, 3, or 4) and a brief description.
+    Format: "Number: Description"
     """
+    result_text = llm_complete(prompt, task="classify")
+    
+    # Parse response
+    if ":" in result_text:
+        number_part = result_text.split(":")[0].strip()
+    else:
+        # Fallback parsing
+        number_match = re.search(r'\b([1-4])\b', result_text)
+        number_part = number_match.group(1) if number_match else "1"
+    
     try:
-        if not text_list or not text_list[0].strip():
-            return [1], ["general research"]
-            
-        text = text_list[0]
-        
-        prompt = f"""
-        Classify the following research request into one of these categories:
-        
-        1 = General research topic (broad scientific inquiry)
-        2 = Evolutionary biology research (evolution, phylogenetics, natural selection)  
-        3 = Physical chemistry/biochemistry research (molecular mechanisms, thermodynamics, structural biology)
-        4 = PMID list (contains 8+ digit numbers that look like PubMed IDs)
-        
-        Text to classify: "{text}"
-        
-        Respond with only the number (1, 2, 3, or 4) and a brief description.
-        Format: "Number: Description"
-        """
-        
-        if not openai_client:
-            # Fallback if no OpenAI client available
-            return [1], ["general research"]
-            
-        response = openai_client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        result_text = response.choices[0].message.content.strip()
-        
-        # Parse response
-        if ":" in result_text:
-            number_part = result_text.split(":")[0].strip()
-            desc_part = result_text.split(":", 1)[1].strip()
-        else:
-            # Fallback parsing
-            number_match = re.search(r'\b([1-4])\b', result_text)
-            number_part = number_match.group(1) if number_match else "1"
-            desc_part = "general research"
-        
-        try:
-            classification_int = int(number_part)
-        except:
-            classification_int = 1
-            
-        # Ensure valid range
-        if classification_int not in [1, 2, 3, 4]:
-            classification_int = 1
-            
-        # Map to description
-        desc_map = {
-            1: "general research",
-            2: "evolutionary biology research", 
-            3: "physical chemistry/biochemistry research",
-            4: "PMID list"
-        }
-        
-        final_desc = desc_map.get(classification_int, desc_part)
-        
-        return [classification_int], [final_desc]
+        classification_int = int(number_part)
+    except:
+        classification_int = 1
         
+    # Ensure valid range
+    if classification_int not in [1, 2, 3, 4]:
+        classification_int = 1
+    return classification_int
+
+def classify_request(text):
+    """
+    Classify a research request: local rules first, the model only for ambiguous input.
+    Returns (classification_int, classification_text, decided_by) where decided_by is
+    "rules (<reason>)", "llm" or "default".
+    """
+    if not text or not text.strip():
+        return 1, QUERY_CLASSES[1], "default"
+    
+    local = classify_request_locally(text)
+    if local:
+        classification_int, reason = local
+        return classification_int, QUERY_CLASSES[classification_int], f"rules ({reason})"
+    
+    if not openai_client:
+        # Fallback if no OpenAI client available
+        return 1, QUERY_CLASSES[1], "default"
+    try:
+        classification_int = _classify_request_llm(text)
+        return classification_int, QUERY_CLASSES[classification_int], "llm"
     except Exception as e:
         st.warning(f"Classification error: {e}")
-        return [1], ["general research"]
+        return 1, QUERY_CLASSES[1], "default"
+
+def what_is_requested(text_list):
+    """
+    Classification of research query type (see classify_request)
+    Returns: (classification_integers, classification_texts)
+    """
+    text = text_list[0] if text_list else ""
+    classification_int, classification_text, _ = classify_request(text)
+    return [classification_int], [classification_text]
 
 def construct_pubmed_query(text, classified_as_int):
     """
@@ -648,7 +1605,11 @@ def construct_pubmed_query(text, classified_as_int):
             pmid_pattern = r'\b\d{8,}\b'
             pmids = re.findall(pmid_pattern, text)
             return " OR ".join([f"{pmid}[PMID]" for pmid in pmids])
-            
+
+        if classified_as_int == 5:  # DOIs (plus any PMIDs pasted alongside)
+            pmids, dois = request_identifiers(text)
+            return " OR ".join([f'"{doi}"[doi]' for doi in dois] + [f"{pmid}[PMID]" for pmid in pmids])
+
         # For other classifications, use GPT to construct query
         area_context = {
             1: "general research topics",
@@ -677,14 +1638,7 @@ def construct_pubmed_query(text, classified_as_int):
             # Fallback if no OpenAI client available
             return text.replace(" ", " AND ")
             
-        response = openai_client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        return response.choices[0].message.content.strip()
+        return llm_complete(prompt, task="query-gen")
         
     except Exception as e:
         st.warning(f"Query construction error: {e}")
@@ -704,12 +1658,12 @@ def search_pubmed_fallback(query, limit=20):
         # If API returns empty, try web scraping
         st.warning("🔄 No results from API, trying alternative search method...")
         
-        search_url = f"https://pubmed.ncbi.nlm.nih.gov/?term={requests.utils.quote(query)}&size={limit}"
+        search_url = "https://pubmed.ncbi.nlm.nih.gov/"
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
         
-        response = requests.get(search_url, headers=headers, timeout=30)
+        response = cached_http_request("GET", search_url, provider="pubmed_web", params={"term": query, "size": limit}, headers=headers, timeout=30)
         response.raise_for_status()
         
         # Extract PMIDs from HTML
@@ -760,124 +1714,211 @@ def remotexs_links(doi):
     
     return links
 
-def rate_publication(metadata, classification_switch):
+# ============================
+# PROMPT BUILDING (token budgets)
+# ============================
+CHARS_PER_TOKEN = 4  # rough average for English prose; good enough for budgeting
+
+def approx_tokens(text: str) -> int:
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def trim_to_tokens(text: str, budget: int) -> str:
+    """Collapse whitespace and cut text to about `budget` tokens at a word boundary."""
+    text = re.sub(r"\s+", " ", text or "").strip()
+    max_chars = max(0, budget) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + " …"
+
+class PromptBuilder:
+    """
+    Assembles a prompt from named sections. Paper context (abstract, PDF text) goes in
+    through add_context(), which trims it to a token budget; build() logs the approximate
+    size of every section so prompt growth is visible in app_debug.log.
+    """
+
+    def __init__(self):
+        self.sections = []  # (name, text)
+        self.context_tokens = 0
+
+    def add(self, name: str, text: str):
+        self.sections.append((name, text.strip("\n")))
+        return self
+
+    def add_context(self, name: str, label: str, text: str, budget: int):
+        trimmed = trim_to_tokens(text, budget)
+        if trimmed:
+            self.add(name, f"{label}: {trimmed}")
+            self.context_tokens += approx_tokens(trimmed)
+        return self
+
+    def context_left(self, total_budget: int) -> int:
+        """Budget remaining after the context added so far."""
+        return max(0, total_budget - self.context_tokens)
+
+    def build(self, label: str) -> str:
+        prompt = "\n\n".join(text for _, text in self.sections if text)
+        sizes = ", ".join(f"{name}={approx_tokens(text)}" for name, text in self.sections)
+        debug_utils.log_debug(f"Prompt '{label}': ~{approx_tokens(prompt)} tokens ({sizes})")
+        return prompt
+
+def _rating_preferences():
+    """Effective (topics, authors, journals) for rating: the user's profile, else admin defaults."""
+    prefs = st.session_state.get('user_profile', {})
+    preferred_topics = prefs.get('topics', [])
+    preferred_authors = prefs.get('authors', [])
+    preferred_journals = prefs.get('journals', [])
+    
+    # Use admin defaults if no user preferences defined
+    admin_defaults = {
+        'topics': ['physical chemistry', 'biochemistry', 'structural biology', 'protein folding', 'molecular dynamics', 'enzyme kinetics'],
+        'authors': [],
+        'journals': ['Nature', 'Science', 'Cell', 'PNAS', 'Journal of Physical Chemistry', 'Biochemistry', 'Nature Structural & Molecular Biology']
+    }
+    
+    # Get effective preferences (user preferences or admin defaults)
+    effective_topics = preferred_topics if preferred_topics else admin_defaults['topics']
+    effective_authors = preferred_authors if preferred_authors else admin_defaults['authors'] 
+    effective_journals = preferred_journals if preferred_journals else admin_defaults['journals']
+    return effective_topics, effective_authors, effective_journals
+
+def interests_block():
+    """The user's effective interests, rendered once per prompt; criteria refer back to it."""
+    topics, authors, journals = _rating_preferences()
+    return (
+        "USER'S RESEARCH INTERESTS (all scoring below refers to these):\n"
+        f"- Primary topics: {'; '.join(topics)}\n"
+        f"- Preferred authors: {'; '.join(authors) if authors else 'no specific preferences'}\n"
+        f"- Preferred journals: {'; '.join(journals)}"
+    )
+
+RATING_CRITERIA = """Rate based ENTIRELY on relevance to the user's research interests above, not general academic merit.
+
+SCORE 3 (Perfect Match - Highly Relevant):
+- DIRECTLY addresses the user's primary topics
+- Published in the user's preferred journals or an elite journal (Nature, Science, Cell, PNAS, field leaders)
+- Authored by the user's preferred researchers (if specified)
+- High-quality methodology; major breakthrough or methodological advance in the user's areas
+
+SCORE 2 (Good Match - Relevant):
+- SIGNIFICANTLY overlaps with the user's topics
+- Reputable journal; solid methodology and meaningful findings
+- Important contribution to the user's field
+
+SCORE 1 (Partial Match - Some Relevance):
+- PARTIALLY or tangentially relevant to the user's topics
+- Competent methodology; useful for background or comparison
+
+SCORE 0 (No Match - Not Relevant):
+- Does not address any of the user's topic areas, or poor methodology / low-quality publication
+- Not useful for the user's research objectives"""
+
+def _rating_instructions():
+    """Interests + criteria block shared by single and batch rating prompts."""
+    return f"{interests_block()}\n\n{RATING_CRITERIA}"
+
+def _paper_details(metadata, builder, name="paper"):
+    """Title/authors/journal/year plus the abstract trimmed to RATING_CONTEXT_TOKENS."""
+    builder.add(name, (
+        f"Title: {metadata.get('Title', '')}\n"
+        f"Authors: {metadata.get('Authors', '')}\n"
+        f"Journal: {metadata.get('Journal', '')}\n"
+        f"Year: {metadata.get('Year', '')}"
+    ))
+    builder.add_context(f"{name}-abstract", "Abstract", metadata.get("Abstract", "") or "", RATING_CONTEXT_TOKENS)
+
+RATING_TAG_PREFIXES = """Tag prefixes explanation:
+- aRT- for research topics/subjects (e.g., aRT-protein-folding, aRT-drug-discovery)
+- aTa- for techniques/technologies (e.g., aTa-NMR-spectroscopy, aTa-machine-learning)
+- aTy- for paper type (e.g., aTy-Review, aTy-Experimental, aTy-Meta-Analysis)
+- aMe- for specific methods/approaches (e.g., aMe-molecular-dynamics, aMe-statistical-analysis)
+- ai-score_X for AI relevance rating (e.g., ai-score_3, ai-score_2)"""
+
+RATING_TAG_GUIDE = "approximately 10 comprehensive tags including: multiple aRT- tags for research topics, multiple aTa- tags for techniques/methods, one aTy- tag for paper type (Review/Experimental/Meta-Analysis/etc), multiple aMe- tags for specific methods/approaches, and one ai-score_X tag where X is your rating score"
+
+def rating_prompt(metadata, streaming=False):
+    """
+    Single-paper rating prompt (Score/Tags/Note reply format, see parse_gpt4_output).
+    streaming=True asks for the note first so it can be shown while the reply streams
+    (see parse_streamed_reply).
+    """
+    builder = PromptBuilder()
+    builder.add("instructions", _rating_instructions())
+    builder.add("header", "Paper Details:")
+    _paper_details(metadata, builder)
+    if streaming:
+        builder.add("format", f"""Respond in this EXACT plain-text format, in this order:
+Note: [Brief explanation of rating and significance]
+Score: [0-3]
+Tags: [Generate {RATING_TAG_GUIDE}]
+{RATING_TAG_PREFIXES}""")
+        return builder.build("rate-stream")
+    builder.add("format", f"""Provide rating in this EXACT format:
+Score: [0-3]
+Tags: [Generate {RATING_TAG_GUIDE}]
+Note: [Brief explanation of rating and significance]
+{RATING_TAG_PREFIXES}""")
+    return builder.build("rate")
+
+def rate_publication(metadata, classification_switch, on_text=None):
     """
     Rate publication using GPT-5-mini based on research area and user preferences
     Returns formatted rating string with score, keywords, and notes
+    With on_text, the reply is streamed (note first) and on_text(delta) sees it as it arrives.
     """
     try:
-        title = metadata.get("Title", "")
-        authors = metadata.get("Authors", "")
-        journal = metadata.get("Journal", "")
-        abstract = metadata.get("Abstract", "")
-        year = metadata.get("Year", "")
-        
-        # Get user preferences from session state
-        prefs = st.session_state.get('user_profile', {})
-        preferred_topics = prefs.get('topics', [])
-        preferred_authors = prefs.get('authors', [])
-        preferred_journals = prefs.get('journals', [])
-        
-        # Use admin defaults if no user preferences defined
-        admin_defaults = {
-            'topics': ['physical chemistry', 'biochemistry', 'structural biology', 'protein folding', 'molecular dynamics', 'enzyme kinetics'],
-            'authors': [],
-            'journals': ['Nature', 'Science', 'Cell', 'PNAS', 'Journal of Physical Chemistry', 'Biochemistry', 'Nature Structural & Molecular Biology']
-        }
-        
-        # Get effective preferences (user preferences or admin defaults)
-        effective_topics = preferred_topics if preferred_topics else admin_defaults['topics']
-        effective_authors = preferred_authors if preferred_authors else admin_defaults['authors'] 
-        effective_journals = preferred_journals if preferred_journals else admin_defaults['journals']
-        
-        # Create user-preference driven criteria
-        criteria = f"""Rate this paper based ENTIRELY on relevance to the user's specific research interests:
-
-        USER'S RESEARCH FOCUS:
-        Primary Topics: {effective_topics}
-        Preferred Authors: {effective_authors if effective_authors else "No specific author preferences"}
-        Preferred Journals: {effective_journals}
-
-        SCORING CRITERIA (User-Interest Driven):
-        SCORE 3 (Perfect Match - Highly Relevant):
-        - DIRECTLY addresses user's primary topics ({effective_topics})
-        - Published in user's preferred journals ({effective_journals})
-        - Authored by user's preferred researchers (if specified)
-        - High-quality methodology with significant findings
-        - Elite journal publication (Nature, Science, Cell, PNAS, field leaders)
-        - Major breakthrough or methodological advance in user's areas of interest
-        
-        SCORE 2 (Good Match - Relevant):
-        - SIGNIFICANTLY overlaps with user's topics of interest
-        - Published in reputable journals (may include user's preferred journals)
-        - Solid methodology and meaningful findings
-        - Clear relevance to user's research focus
-        - Important contribution to user's field of interest
-        
-        SCORE 1 (Partial Match - Some Relevance):
-        - PARTIALLY relevant to user's research interests
-        - Published in decent academic journals
-        - Competent methodology with acceptable findings
-        - Tangential connection to user's topics
-        - May be useful for background or comparative purposes
-        
-        SCORE 0 (No Match - Not Relevant):
-        - NO relevance to user's research interests
-        - Does not address any of the user's topic areas
-        - Poor methodology or low-quality publication
-        - Complete mismatch with user's research focus
-        - Not useful for user's research objectives
-
-        CRITICAL: Score based on RELEVANCE TO USER'S INTERESTS, not general academic merit."""
-        
-        prompt = f"""
-        {criteria}
-
-        EFFECTIVE USER INTERESTS (driving the scoring):
-        Primary Topics: {effective_topics}
-        Preferred Authors: {effective_authors if effective_authors else "No specific preferences"}
-        Preferred Journals: {effective_journals}
-        
-        SCORING INSTRUCTION: Rate based SOLELY on relevance to these specific interests.
-        Ignore general academic merit if the paper doesn't match user's research focus.
-
-        Paper Details:
-        Title: {title}
-        Authors: {authors}
-        Journal: {journal}
-        Year: {year}
-        Abstract: {abstract[:500]}...
-
-        Provide rating in this EXACT format:
-        Score: [0-3]
-        Tags: [Generate approximately 10 comprehensive tags including: multiple aRT- tags for research topics, multiple aTa- tags for techniques/methods, one aTy- tag for paper type (Review/Experimental/Meta-Analysis/etc), multiple aMe- tags for specific methods/approaches, and one ai-score_X tag where X is your rating score]
-        Note: [Brief explanation of rating and significance]
-        
-        Tag prefixes explanation:
-        - aRT- for research topics/subjects (e.g., aRT-protein-folding, aRT-drug-discovery)  
-        - aTa- for techniques/technologies (e.g., aTa-NMR-spectroscopy, aTa-machine-learning)
-        - aTy- for paper type (e.g., aTy-Review, aTy-Experimental, aTy-Meta-Analysis)
-        - aMe- for specific methods/approaches (e.g., aMe-molecular-dynamics, aMe-statistical-analysis)
-        - ai-score_X for AI relevance rating (e.g., ai-score_3, ai-score_2)
-        """
-        
         if not openai_client:
             # Fallback if no OpenAI client available
             return "Score: 1\nTags: [unrated]\nNote: OpenAI API not available"
-            
-        response = openai_client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        return response.choices[0].message.content.strip()
+
+        if on_text is not None:
+            return llm_stream(rating_prompt(metadata, streaming=True), task="rate-stream", on_text=on_text,
+                              use_profile=True, accept=streamed_reply_complete)
+        return llm_complete(rating_prompt(metadata), task="rate", use_profile=True)
         
     except Exception as e:
         st.warning(f"Rating error: {e}")
         return "Score: 1\nTags: [unrated]\nNote: Rating failed due to API error"
 
+def rate_publications_batch(metadata_list, classification_switch):
+    """
+    Rate several publications in ONE request (criteria block sent once), as structured
+    output checked against RATINGS_SCHEMA. Returns one (score, keywords, note) per paper in
+    metadata_list order; papers the reply skipped come back as None so the caller can rate
+    them individually. Raises on API errors or an invalid reply (StructuredOutputError).
+    """
+    if not openai_client:
+        raise RuntimeError("OpenAI client not available")
+    builder = PromptBuilder()
+    builder.add("instructions", _rating_instructions())
+    builder.add("header", f"Rate EACH of the {len(metadata_list)} papers below independently.")
+    for n, m in enumerate(metadata_list, 1):
+        builder.add(f"paper-{n}-id", f"[{n}]")
+        _paper_details(m, builder, name=f"paper-{n}")
+    builder.add("format", f"""Return "ratings" with exactly one object per paper:
+- "id": the paper's number in square brackets
+- "score": 0-3
+- "tags": {RATING_TAG_GUIDE}
+- "explanation": brief explanation of rating and significance
+{RATING_TAG_PREFIXES}""")
+    data = openai_structured(builder.build("rate-batch"), RATINGS_SCHEMA, name="paper_ratings",
+                             task="rate-batch", use_profile=True)
+    ratings = []
+    for rating in ratings_by_paper(data, len(metadata_list)):
+        if rating is None:
+            ratings.append(None)
+            continue
+        score_int, keywords = _finish_rating(rating["score"], [t.strip() for t in rating["tags"] if t.strip()])
+        ratings.append((score_int, keywords, rating["explanation"].strip()))
+    return ratings
+
+def _finish_rating(score_int, keywords):
+    """Clamp score, ensure the ai-score tag is present and normalize tags."""
+    score_int = max(0, min(3, score_int))
+    if not any(tag.startswith("ai-score_") for tag in keywords):
+        keywords.append(f"ai-score_{score_int}")
+    return score_int, normalize_tags(keywords)
+
 def parse_gpt4_output(rating_text):
     """
     Parse GPT-5-mini rating output into structured format
@@ -907,13 +1948,8 @@ def parse_gpt4_output(rating_text):
             elif line.startswith("Note:"):
                 note = line.replace("Note:", "").strip()
         
-        # Ensure ai-score tag is present
-        ai_score_tag = f"ai-score_{score_int}"
-        if not any(tag.startswith("ai-score_") for tag in keywords):
-            keywords.append(ai_score_tag)
-        
-        # Normalize tags to ensure consistent format
-        keywords = normalize_tags(keywords)
+        # Ensure ai-score tag is present and normalize tags to ensure consistent format
+        score_int, keywords = _finish_rating(score_int, keywords)
         
         return score_int, keywords, note
         
@@ -921,35 +1957,50 @@ def parse_gpt4_output(rating_text):
         st.warning(f"Output parsing error: {e}")
         return 1, ["parsing-error"], "Failed to parse rating output"
 
+def parse_streamed_rating(rating_text):
+    """Streamed rate_publication reply (note first) -> (score_int, keywords_list, note_text)."""
+    note, score_int, keywords = parse_streamed_reply(rating_text)
+    score_int, keywords = _finish_rating(1 if score_int is None else score_int, keywords)
+    return score_int, keywords, note
+
 # ============================
 # Enhanced Query Generation for Different Sources
 # ============================
-def openai_boolean_query_with_dates(user_query: str, year_from=None, year_to=None, target_source="PubMed") -> dict:
-    """
-    Generate optimized queries for different academic search sources.
-    Handles both datetime objects and integers for year parameters.
-    """
-    date_clause = ""
-    
+def query_date_clause(year_from=None, year_to=None, target_source="PubMed") -> str:
+    """Date restriction in the target source's query syntax ('' without a range). Accepts datetimes or years."""
     # Extract year from datetime objects if needed
     year_from_int = year_from.year if hasattr(year_from, 'year') else year_from
     year_to_int = year_to.year if hasattr(year_to, 'year') else year_to
     
     if year_from_int and year_to_int:
         if target_source == "PubMed":
-            date_clause = f"year:[{year_from_int} TO {year_to_int}]"
-        else:  # Semantic Scholar
-            date_clause = f"year:{year_from_int}-{year_to_int}"
-    elif year_from_int:
+            return f"year:[{year_from_int} TO {year_to_int}]"
+        return f"year:{year_from_int}-{year_to_int}"  # Semantic Scholar
+    if year_from_int:
         if target_source == "PubMed":
-            date_clause = f"year:[{year_from_int} TO *]"
-        else:  # Semantic Scholar
-            date_clause = f"year:{year_from_int}-"
-    elif year_to_int:
+            return f"year:[{year_from_int} TO *]"
+        return f"year:{year_from_int}-"
+    if year_to_int:
         if target_source == "PubMed":
-            date_clause = f"year:[* TO {year_to_int}]"
-        else:  # Semantic Scholar
-            date_clause = f"year:-{year_to_int}"
+            return f"year:[* TO {year_to_int}]"
+        return f"year:-{year_to_int}"
+    return ""
+
+def with_date_clause(query: str, date_clause: str, target_source="PubMed") -> str:
+    """Append the date clause unless the query already carries it."""
+    if not date_clause or date_clause in query:
+        return query
+    if not query:
+        return date_clause
+    separator = " AND " if target_source == "PubMed" else " "
+    return f"{query}{separator}{date_clause}"
+
+def openai_boolean_query_with_dates(user_query: str, year_from=None, year_to=None, target_source="PubMed") -> dict:
+    """
+    Generate optimized queries for different academic search sources.
+    Handles both datetime objects and integers for year parameters.
+    """
+    date_clause = query_date_clause(year_from, year_to, target_source)
     
     if target_source == "PubMed":
         prompt = generate_pubmed_query_prompt(user_query, date_clause)
@@ -960,7 +2011,11 @@ def openai_boolean_query_with_dates(user_query: str, year_from=None, year_to=Non
     if target_source == "Semantic Scholar":
         print(f"SS Prompt: {prompt[:200]}...")
     
-    data = openai_json(prompt)
+    try:
+        data = openai_structured(prompt, QUERY_SCHEMA, name="search_query", task="query-gen")
+    except Exception as e:
+        print(f"Query generation failed for {target_source}: {e}")
+        data = {}
     
     # Debug: Show what we got back
     if target_source == "Semantic Scholar":
@@ -977,12 +2032,7 @@ def openai_boolean_query_with_dates(user_query: str, year_from=None, year_to=Non
             out["year_to"] = data.get("year_to")
     
     # Add date clause if not already included
-    if date_clause and date_clause not in out["boolean_query"]:
-        if out["boolean_query"]:
-            separator = " AND " if target_source == "PubMed" else " "
-            out["boolean_query"] += f"{separator}{date_clause}"
-        else:
-            out["boolean_query"] = date_clause
+    out["boolean_query"] = with_date_clause(out["boolean_query"], date_clause, target_source)
     
     return out
 
@@ -1032,6 +2082,147 @@ def generate_semantic_scholar_query_prompt(user_query: str, date_clause: str) ->
         prompt += f"\nDate range: {date_clause}"
     return prompt
 
+def combined_query_schema(sources, classify=True) -> dict:
+    query = {
+        "type": "object",
+        "properties": {
+            "boolean_query": {"type": "string"},
+            "keywords": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["boolean_query", "keywords"],
+        "additionalProperties": False,
+    }
+    properties = {
+        "year_from": {"type": ["integer", "null"]},
+        "year_to": {"type": ["integer", "null"]},
+    }
+    if classify:
+        properties = {"classification": {"type": "integer", "enum": [1, 2, 3, 4]}, **properties}
+    if "Semantic Scholar" in sources:
+        properties["semantic_scholar"] = query
+    if "PubMed" in sources:
+        properties["pubmed"] = query
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+def combined_query_prompt(user_query: str, sources, classification=None) -> str:
+    """
+    One prompt covering classification and every requested source's query.
+    Pass classification when it is already known to leave it out of the request.
+    """
+    prompt = "You are an expert research librarian. For the research request below, return JSON with:\n"
+    if classification is None:
+        prompt += (
+            "- \"classification\": 1 = general research topic (broad scientific inquiry), "
+            "2 = evolutionary biology research (evolution, phylogenetics, natural selection), "
+            "3 = physical chemistry/biochemistry research (molecular mechanisms, thermodynamics, structural biology), "
+            "4 = PMID list (contains 8+ digit numbers that look like PubMed IDs)\n"
+        )
+    prompt += "- \"year_from\" / \"year_to\": years explicitly mentioned in the request, else null\n"
+    if "Semantic Scholar" in sources:
+        prompt += (
+            "- \"semantic_scholar\": {\"boolean_query\", \"keywords\"} for Semantic Scholar, which works best with "
+            "concise natural-language phrases and specific technical terms: extract the core concepts, use quotes "
+            "for exact phrases, at most simple AND, include key synonyms but keep it readable "
+            "(e.g. 'amyloid fibril protein aggregation')\n"
+        )
+    if "PubMed" in sources:
+        prompt += (
+            "- \"pubmed\": {\"boolean_query\", \"keywords\"} for PubMed, suited to the classification's field: "
+            "break the request into key concepts; OR together each concept's synonyms and related terms "
+            "(with [MeSH] terms where appropriate and [Title/Abstract] for key terms) in parentheses, "
+            "quote phrases, AND the concept groups together, no stopwords or extraneous words\n"
+        )
+    prompt += "Do not put date restrictions in the queries; dates are applied separately.\n"
+    if classification is not None:
+        prompt += f"The request is classified as {QUERY_CLASSES[classification]}.\n"
+    prompt += f"Research request: {user_query}\n"
+    return prompt
+
+def _generate_search_queries_separately(user_query, year_from, year_to, sources, local=None):
+    """Per-source fallback: classification and each query as their own (concurrent) requests."""
+    llm_calls = {"classification": lambda: classify_request(user_query)}
+    if "Semantic Scholar" in sources:
+        llm_calls["Semantic Scholar"] = lambda: openai_boolean_query_with_dates(user_query, year_from, year_to, "Semantic Scholar")
+    if "PubMed" in sources:
+        llm_calls["PubMed"] = lambda: openai_boolean_query_with_dates(user_query, year_from, year_to, "PubMed")
+    if local:
+        llm_calls["classification"] = lambda: local
+    llm_results = run_concurrently(llm_calls)
+    classification, classification_text, decided_by = llm_results["classification"]
+
+    queries = {}
+    if "Semantic Scholar" in sources:
+        queries["Semantic Scholar"] = llm_results["Semantic Scholar"]
+    if "PubMed" in sources:
+        prof_pubmed_query = construct_pubmed_query(user_query, classification)
+        pubmed_query = llm_results["PubMed"]
+        # Use professor's query as primary, yours as fallback
+        queries["PubMed"] = {
+            "boolean_query": prof_pubmed_query or pubmed_query.get("boolean_query", ""),
+            "keywords": pubmed_query.get("keywords", []),
+            "year_from": year_from,
+            "year_to": year_to,
+            "source": "PubMed",
+            "classification": classification,
+            "classification_text": classification_text
+        }
+    return classification, classification_text, queries, decided_by
+
+def generate_search_queries(user_query: str, year_from=None, year_to=None, search_source="Semantic Scholar"):
+    """
+    Classification plus the Semantic Scholar and/or PubMed query in ONE structured request.
+    Returns (classification, classification_text, {source: query dict}, decided_by); the query
+    dicts have the same shape as before. Requests the local rules can classify skip the model's
+    classification, and identifier lists searched on PubMed alone skip the model entirely.
+    Falls back to separate per-source requests when the combined reply is unusable.
+    """
+    sources = [source for source in ("Semantic Scholar", "PubMed") if search_source in (source, "Both")]
+    local = classify_request_locally(user_query)
+    if local:
+        classification, reason = local
+        local = (classification, QUERY_CLASSES[classification], f"rules ({reason})")
+    # PMID/DOI lists are turned into a PubMed query locally, no model needed
+    identifier_list = bool(local) and local[0] in (4, 5)
+    data = {}
+    if not (identifier_list and sources == ["PubMed"]):
+        try:
+            data = openai_structured(
+                combined_query_prompt(user_query, sources, local[0] if local else None),
+                combined_query_schema(sources, classify=not local),
+                name="search_plan", task="query-plan",
+            )
+        except Exception as e:
+            print(f"Combined query generation failed, using per-source requests: {e}")
+            return _generate_search_queries_separately(user_query, year_from, year_to, sources, local)
+
+    if local:
+        classification, classification_text, decided_by = local
+    else:
+        classification, classification_text, decided_by = data["classification"], QUERY_CLASSES[data["classification"]], "llm"
+
+    queries = {}
+    if "Semantic Scholar" in sources:
+        date_clause = query_date_clause(year_from, year_to, "Semantic Scholar")
+        queries["Semantic Scholar"] = {
+            "boolean_query": with_date_clause(data["semantic_scholar"]["boolean_query"], date_clause, "Semantic Scholar"),
+            "keywords": data["semantic_scholar"]["keywords"],
+            # Keep the UI's datetimes; fall back to years the model found in the request
+            "year_from": year_from or data["year_from"],
+            "year_to": year_to or data["year_to"],
+            "source": "Semantic Scholar",
+        }
+    if "PubMed" in sources:
+        queries["PubMed"] = {
+            "boolean_query": construct_pubmed_query(user_query, classification) if identifier_list else data["pubmed"]["boolean_query"],
+            "keywords": data["pubmed"]["keywords"] if data else [],
+            "year_from": year_from,
+            "year_to": year_to,
+            "source": "PubMed",
+            "classification": classification,
+            "classification_text": classification_text
+        }
+    return classification, classification_text, queries, decided_by
+
 # ============================
 # PROFESSOR'S AI WORKFLOW
 # ============================
@@ -1078,13 +2269,10 @@ def render_query_workflow():
     col1, col2 = st.columns(2)
     with col1:
         if st.button("🤖 Generate AI Query"):
-            if user_input.strip():
+            if user_input.strip() and openai_client and llm_tokens_left() == 0:
+                st.error("🧾 Your daily AI token budget is used up. Try again tomorrow or ask an admin to raise it.")
+            elif user_input.strip():
                 with st.spinner("🧠 AI is analyzing your query and crafting optimized searches..."):
-                    # Step 1: GPT-5-mini classification
-                    classi_int, classi_txt = what_is_requested([user_input])
-                    classification = classi_int[0]
-                    classification_text = classi_txt[0]
-                    
                     # Pass date range from UI if available
                     year_from = None
                     year_to = None
@@ -1093,45 +2281,19 @@ def render_query_workflow():
                     if 'date_to' in globals() and date_to:
                         year_to = date_to  # Pass full datetime object
                     
-                    # Generate optimized queries for different sources
-                    queries = {}
-                    
                     # Get search source from the main UI
                     current_search_source = st.session_state.get('current_search_source', 'Semantic Scholar')
                     
-                    if current_search_source in ("Semantic Scholar", "Both"):
-                        semantic_query = openai_boolean_query_with_dates(user_input, year_from, year_to, "Semantic Scholar")
-                        queries["Semantic Scholar"] = semantic_query
-                    
-                    if current_search_source in ("PubMed", "Both"):
-                        pubmed_boolean = construct_pubmed_query(user_input, classification)
-                        queries["PubMed"] = {
-                            "boolean_query": pubmed_boolean,
-                            "keywords": user_input.split(),
-                            "year_from": year_from,
-                            "year_to": year_to,
-                            "source": "PubMed"
-                        }
-                        prof_pubmed_query = construct_pubmed_query(user_input, classification)
-                        
-                        # Also generate with your existing method for comparison
-                        pubmed_query = openai_boolean_query_with_dates(user_input, year_from, year_to, "PubMed")
-                        
-                        # Use professor's query as primary, yours as fallback
-                        enhanced_pubmed_query = {
-                            "boolean_query": prof_pubmed_query or pubmed_query.get("boolean_query", ""),
-                            "keywords": pubmed_query.get("keywords", []),
-                            "year_from": year_from,
-                            "year_to": year_to,
-                            "source": "PubMed",
-                            "classification": classification,
-                            "classification_text": classification_text
-                        }
-                        queries["PubMed"] = enhanced_pubmed_query
+                    # Step 1: classification and every source's query in one structured request
+                    classification, classification_text, queries, decided_by = generate_search_queries(
+                        user_input, year_from, year_to, current_search_source
+                    )
                     
                     # Store classification for later use
                     st.session_state.query_classification = classification
                     st.session_state.query_classification_text = classification_text
+                    st.session_state.query_classification_path = decided_by
+                    debug_utils.log_info(f"Request classified as {classification} ({classification_text}) by {decided_by}")
                     
                     # Use the primary query for the selected source
                     print(f"\n🔍 DEBUG - Primary query selection:")
@@ -1186,6 +2348,9 @@ def render_query_workflow():
     if st.session_state.query_metadata.get("year_from") or st.session_state.query_metadata.get("year_to"):
         year_info = f"**Years:** {st.session_state.query_metadata.get('year_from', 'start')} - {st.session_state.query_metadata.get('year_to', 'end')}"
         st.caption(year_info)
+    if st.session_state.get("query_classification_path"):
+        st.caption(f"**Request type:** {st.session_state.get('query_classification_text', '')} "
+                   f"(decided by {st.session_state.query_classification_path})")
     
     # Show source-specific optimized queries
     all_queries = st.session_state.query_metadata.get('all_queries', {})
@@ -1277,6 +2442,8 @@ def render_text_extraction_workflow():
         paste_text = st.text_area("📋 Paste citation(s) or Google Scholar results / page text:", 
                                  height=220,
                                  placeholder="Paste bibliographic text, Google Scholar results, or any text containing paper references...")
+        use_local_parser = st.checkbox("⚡ Parse well-formed citations locally (APA, Vancouver, Nature)", value=True,
+                                       help="Confidently parsed references skip the AI; only the rest is sent to it.")
         
         col1, col2 = st.columns(2)
         with col1:
@@ -1284,7 +2451,7 @@ def render_text_extraction_workflow():
                 if paste_text.strip():
                     st.session_state.text_step = 2
                     with st.spinner("🧠 AI is extracting references..."):
-                        refs = openai_extract_from_text(paste_text)
+                        refs = openai_extract_from_text(paste_text, local_parser=use_local_parser)
                         st.session_state.extracted_refs = refs
                         st.session_state.edited_refs = refs.copy()
                     st.rerun()
@@ -1304,6 +2471,10 @@ def render_text_extraction_workflow():
                 st.rerun()
         else:
             st.success(f"Found {len(st.session_state.extracted_refs)} references")
+            parser_counts = {}
+            for ref in st.session_state.extracted_refs:
+                parser_counts[ref.get("parser", "llm")] = parser_counts.get(ref.get("parser", "llm"), 0) + 1
+            st.caption("Parsed by: " + ", ".join(f"{parser} × {count}" for parser, count in parser_counts.items()))
             
             # Allow editing of each reference
             for i, ref in enumerate(st.session_state.extracted_refs):
@@ -1318,13 +2489,19 @@ def render_text_extraction_workflow():
                                               value=', '.join(ref.get('authors', [])) if isinstance(ref.get('authors'), list) else str(ref.get('authors', '')), 
                                               key=f"authors_{i}")
                         doi = st.text_input(f"DOI {i+1}:", value=ref.get('doi', '') or '', key=f"doi_{i}")
+                    if ref.get('confidence') is not None:
+                        st.caption(f"Parser: {ref.get('parser')} (confidence {ref['confidence']:.2f})")
+                    else:
+                        st.caption(f"Parser: {ref.get('parser', 'llm')}")
                     
                     # Update the edited refs
                     st.session_state.edited_refs[i] = {
                         'title': title,
                         'year': year,
                         'authors': [a.strip() for a in authors.split(',') if a.strip()],
-                        'doi': doi
+                        'doi': doi,
+                        'parser': ref.get('parser', 'llm'),
+                        'confidence': ref.get('confidence')
                     }
             
             col1, col2 = st.columns(2)
@@ -1342,9 +2519,7 @@ def render_text_extraction_workflow():
     return st.session_state.text_step == 3, st.session_state.edited_refs
 OPERATORS = {"and": "AND", "or": "OR", "not": "NOT"}
 
-DOI_RE = re.compile(r"10\.\d{4,9}/[-._;()/:A-Za-z0-9]+", re.I)
 HTML_TAG_RE = re.compile(r"<[^>]+>")
-ARXIV_RE = re.compile(r"arXiv:\s*(\d{4}\.\d{4,5})(?:v\d+)?", re.I)
 
 def build_boolean_query_simple(text: str) -> str:
     """Quick AND-join of comma/;/slash separated tokens; phrases quoted and logicals normalized."""
@@ -1362,20 +2537,56 @@ def with_ntu_proxy(url: str | None, style: int = 2) -> str | None:
         return f"https://remotexs.ntu.edu.sg/user/login?dest={url}"
     return f"https://remotexs.ntu.edu.sg/login?url={url}"
 
-def extract_pdf_text(url: str) -> str:
-    """Download a PDF and return the first ~5000 chars of text, or empty string if fails."""
-    if not url:
-        return ""
-    try:
-        r = requests.get(url, timeout=45)
-        r.raise_for_status()
-        with fitz.open(stream=io.BytesIO(r.content), filetype="pdf") as doc:
-            text = []
-            for page in doc:
-                text.append(page.get_text())
-            return ("\n".join(text))[:5000]
-    except Exception:
-        return ""
+PDF_MAGIC = b"%PDF-"
+# Content types that are certainly not a PDF (landing pages, paywalls, API errors)
+_NOT_PDF_TYPES = ("text/", "application/json", "application/xml", "application/xhtml")
+
+def download_pdf(url: str, max_bytes: int = None, timeout=45):
+    """
+    Stream a PDF into memory, at most max_bytes (default PDF_MAX_MB). Returns the bytes, or
+    None without reading the body when the content type or the first chunk's magic bytes
+    show it is not a PDF. A body cut at the cap is returned as is: MuPDF repairs truncated
+    files well enough to read the first pages. Raises on HTTP errors.
+    """
+    max_bytes = max_bytes or int(PDF_MAX_MB * 1024 * 1024)
+    buffer = bytearray()
+    with get_http_client().stream("GET", url, timeout=timeout) as r:
+        r.raise_for_status()
+        ctype = r.headers.get("content-type", "").lower()
+        if "pdf" not in ctype and ctype.startswith(_NOT_PDF_TYPES):
+            return None
+        for chunk in r.iter_bytes(64 * 1024):
+            # The header may follow a little junk, but must come within the first 1 KB
+            if not buffer and PDF_MAGIC not in chunk[:1024]:
+                return None
+            buffer.extend(chunk[:max_bytes - len(buffer)])
+            if len(buffer) >= max_bytes:
+                print(f"PDF download capped at {max_bytes // (1024 * 1024)} MB: {url}")
+                break
+    return bytes(buffer) or None
+
+def pdf_text_prefix(data: bytes, max_chars: int = 5000, max_pages: int = None) -> str:
+    """Text of the first pages only, stopping as soon as max_chars are collected (or max_pages, default PDF_MAX_PAGES, are read)."""
+    max_pages = max_pages or PDF_MAX_PAGES
+    text, size = [], 0
+    with fitz.open(stream=io.BytesIO(data), filetype="pdf") as doc:
+        for number in range(min(doc.page_count, max_pages)):
+            page_text = doc.load_page(number).get_text()
+            text.append(page_text)
+            size += len(page_text) + 1
+            if size >= max_chars:
+                break
+    return ("\n".join(text))[:max_chars]
+
+def extract_pdf_text(url: str) -> str:
+    """Download a PDF and return the first ~5000 chars of text, or empty string if fails."""
+    if not url:
+        return ""
+    try:
+        data = download_pdf(url)
+        return pdf_text_prefix(data, 5000) if data else ""
+    except Exception:
+        return ""
 
 def parse_authors(authors_info: str):
     authors = [a.strip() for a in authors_info.split(",") if a.strip()]
@@ -1624,17 +2835,15 @@ def dedupe_results(results):
         seen.add(key); out.append(r)
     return out
 
-def _request_json_with_retries(url, *, method="GET", headers=None, params=None, data=None, tries=4, timeout=40):
+def _request_json_with_retries(url, *, method="GET", headers=None, params=None, data=None, tries=4, timeout=40, provider=None):
     delay = SLEEP
     for attempt in range(1, tries + 1):
         try:
-            resp = (requests.post(url, headers=headers, params=params, data=data, timeout=timeout)
-                    if method == "POST" else
-                    requests.get(url, headers=headers, params=params, timeout=timeout))
+            resp = cached_http_request(method, url, provider=provider, headers=headers, params=params,
+                                       data=data if method == "POST" else None, timeout=timeout)
             if 200 <= resp.status_code < 300:
                 return resp.json()
-            if 500 <= resp.status_code < 600:
-                raise RequestException(f"Server {resp.status_code}")
+            # 4xx and 5xx alike: HTTPStatusError keeps the response for the caller
             resp.raise_for_status()
         except Exception:
             if attempt == tries:
@@ -1650,6 +2859,51 @@ def _chunks(seq, n):
 def _take(results, k):
     return results[:k] if len(results) > k else results
 
+def iter_in_threads(fn, items, max_workers=4, on_tick=None, tick=0.5):
+    """
+    Run fn(item) on a bounded thread pool and yield (item, result, error) in input order.
+    A failing item yields its exception instead of a result, so one bad paper never sinks
+    the batch. Workers inherit the Streamlit script context (session_state, st.* calls).
+    on_tick() is called every `tick` seconds while waiting; an st.* call in it lets
+    Streamlit stop the run promptly when the user navigates away.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        for item in items:
+            try:
+                yield item, fn(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+
+    ctx = get_script_run_ctx()
+    pool = ThreadPoolExecutor(
+        max_workers=min(max_workers, len(items)),
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx),
+    )
+    try:
+        futures = [pool.submit(fn, item) for item in items]
+        for item, fut in zip(items, futures):
+            if on_tick is not None:
+                while not wait_futures([fut], timeout=tick).done:
+                    on_tick()
+            try:
+                yield item, fut.result(), None
+            except Exception as e:
+                yield item, None, e
+    finally:
+        # Also runs when the consumer stops early (e.g. user navigates away)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def run_concurrently(calls: dict) -> dict:
+    """Run independent zero-argument callables at once; returns {name: result}, re-raising the first failure."""
+    results = {}
+    for name, result, error in iter_in_threads(lambda name: calls[name](), list(calls), len(calls)):
+        if error is not None:
+            raise error
+        results[name] = result
+    return results
+
 def clean_snippet(text: str) -> str:
     if not text:
         return ""
@@ -1663,52 +2917,112 @@ def clean_snippet(text: str) -> str:
 # ============================
 # OPENAI (Boolean, extraction, annotation)
 # ============================
-def openai_json(prompt: str, model: str = "gpt-5-mini") -> dict | list:
-    if not OPENAI_API_KEY or not openai_client:
-        print("Warning: No valid OpenAI API key found - using fallback")
-        return {}
-    try:
-        resp = openai_client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        txt = resp.choices[0].message.content or ""
-        if not txt:
-            print("Warning: Empty response from OpenAI API")
-            return {}
-        try:
-            return json.loads(txt)
-        except Exception as e:
-            print(f"JSON parse error: {e}, trying regex extraction")
-            # Try to extract JSON from the response
-            m = re.search(r"\{[\s\S]*\}|\[[\s\S]*\]", txt)
-            if m:
-                try:
-                    return json.loads(m.group(0))
-                except Exception as e2:
-                    print(f"Regex extraction also failed: {e2}")
-                    # Try to clean common JSON issues
-                    clean_json = m.group(0)
-                    # Fix common issues: trailing commas, missing quotes, etc.
-                    clean_json = re.sub(r',\s*}', '}', clean_json)  # Remove trailing comma before }
-                    clean_json = re.sub(r',\s*]', ']', clean_json)  # Remove trailing comma before ]
-                    try:
-                        return json.loads(clean_json)
-                    except Exception as e3:
-                        print(f"JSON cleaning failed: {e3}")
-                        print(f"Raw response: {txt[:500]}...")
-                        return {}
-            else:
-                print(f"No JSON found in response: {txt[:200]}...")
-                return {}
-    except Exception as e:
-        print(f"OpenAI API error: {e}")
-        return {}
+class StructuredOutputError(ValueError):
+    """Model reply still failed its JSON schema after the one corrective retry."""
+
+# Structured-output schemas (strict mode: every property required, no extra keys)
+QUERY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "boolean_query": {"type": "string"},
+        "keywords": {"type": "array", "items": {"type": "string"}},
+        "year_from": {"type": ["integer", "null"]},
+        "year_to": {"type": ["integer", "null"]},
+    },
+    "required": ["boolean_query", "keywords", "year_from", "year_to"],
+    "additionalProperties": False,
+}
+
+REFERENCES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "references": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string"},
+                    "authors": {"type": "array", "items": {"type": "string"}},
+                    "year": {"type": ["integer", "null"]},
+                    "doi": {"type": ["string", "null"]},
+                },
+                "required": ["title", "authors", "year", "doi"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["references"],
+    "additionalProperties": False,
+}
+
+ANNOTATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "abstract": {"type": "string"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "score3": {"type": "integer", "minimum": 0, "maximum": 3},
+    },
+    "required": ["abstract", "tags", "score3"],
+    "additionalProperties": False,
+}
+
+# Batch rating: an array can't be the top level of a structured-output schema, so it is wrapped
+RATINGS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ratings": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "score": {"type": "integer", "minimum": 0, "maximum": 3},
+                    "tags": {"type": "array", "items": {"type": "string"}},
+                    "explanation": {"type": "string"},
+                },
+                "required": ["id", "score", "tags", "explanation"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["ratings"],
+    "additionalProperties": False,
+}
+
+def openai_structured(prompt: str, schema: dict, *, name: str, task: str, model: str = None, use_profile: bool = False):
+    """
+    JSON completion constrained by `schema` (structured outputs) and validated on receipt.
+    An invalid reply gets exactly one retry that quotes the validation errors back to the
+    model; if that is still invalid, StructuredOutputError is raised instead of guessing.
+    """
+    response_format = structured_response_format(schema, name)
+    accept = lambda text: not check_structured_reply(text, schema)[1]
+    text = llm_complete(prompt, task=task, model=model, use_profile=use_profile,
+                        accept=accept, response_format=response_format)
+    data, errors = check_structured_reply(text, schema)
+    if not errors:
+        return data
+
+    print(f"Structured output for {task} failed validation, retrying once: {errors[:3]}")
+    error_lines = "\n".join(f"- {e}" for e in errors[:10])
+    retry_prompt = f"""{prompt}
+
+Your previous reply did not match the required JSON schema:
+{error_lines}
+
+Previous reply:
+{text[:2000]}
+
+Return the corrected JSON object only."""
+    text = llm_complete(retry_prompt, task=f"{task}-retry", model=model, use_profile=use_profile,
+                        accept=accept, response_format=response_format)
+    data, errors = check_structured_reply(text, schema)
+    if errors:
+        raise StructuredOutputError(f"{name}: {'; '.join(errors[:3])}")
+    return data
 
 def openai_boolean_query(user_query: str) -> dict:
-    data = openai_json(f"""
+    prompt = f"""
 Create a compact Boolean query (use AND/OR/NOT and quotes for phrases) suitable for academic APIs.
 
 CRITICAL: Respond with ONLY valid JSON. No additional text, explanations, or formatting.
@@ -1720,7 +3034,12 @@ Topic: {user_query}
 Priority topics: {prefs.get('topics')}
 
 Remember: ONLY return the JSON object, nothing else.
-""")
+"""
+    try:
+        data = openai_structured(prompt, QUERY_SCHEMA, name="search_query", task="boolean-query")
+    except Exception as e:
+        print(f"Boolean query generation failed: {e}")
+        data = {}
     out = {"boolean_query": "", "keywords": [], "year_from": None, "year_to": None}
     if isinstance(data, dict):
         out["boolean_query"] = data.get("boolean_query") or ""
@@ -1729,27 +3048,114 @@ Remember: ONLY return the JSON object, nothing else.
         out["year_to"] = data.get("year_to")
     return out
 
-def openai_extract_from_text(raw_text: str):
+def _segment_pieces(segment: str, max_chars: int) -> list:
     """
-    Extract refs from pasted text (e.g., Google Scholar page).
-    Returns list of {title, authors:[...], year, doi?}
+    Split an oversized segment (e.g. a Google Scholar paste with no blank lines or numbers)
+    at line boundaries, accumulating whole lines up to max_chars, so a reference is never
+    cut in half. Only a single line longer than max_chars is cut, at its last space.
     """
-    data = openai_json(f"""
+    if len(segment) <= max_chars:
+        return [segment]
+    pieces, current = [], ""
+    for line in segment.splitlines():
+        while len(line) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            cut = line.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(line[:cut])
+            line = line[cut:].lstrip()
+        if current and len(current) + 1 + len(line) > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        pieces.append(current)
+    return [piece for piece in pieces if piece.strip()]
+
+def _chunk_segments(indexed_segments, max_tokens: int) -> list:
+    """Group (index, segment) pairs into chunks of about max_tokens; oversized segments are split by lines."""
+    chunks, current, size = [], [], 0
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    for index, segment in indexed_segments:
+        for piece in _segment_pieces(segment, max_chars):
+            if current and size + approx_tokens(piece) > max_tokens:
+                chunks.append(current)
+                current, size = [], 0
+            current.append((index, piece))
+            size += approx_tokens(piece)
+    if current:
+        chunks.append(current)
+    return chunks
+
+def merge_references(refs) -> list:
+    """De-duplicate by DOI, else by normalized title, keeping the first copy and filling its gaps from later ones."""
+    merged, by_doi, by_title = [], {}, {}
+    for ref in refs:
+        doi = DoiResolver.normalize(ref.get("doi") or "").lower()
+        title = re.sub(r"[^a-z0-9]+", " ", (ref.get("title") or "").lower()).strip()
+        existing = by_doi.get(doi) if doi else None
+        if existing is None and title in by_title:
+            # Same title only counts as a duplicate when the DOIs don't disagree
+            candidate = by_title[title]
+            if not doi or not candidate.get("doi"):
+                existing = candidate
+        if existing is None:
+            existing = dict(ref)
+            merged.append(existing)
+        else:
+            for field, value in ref.items():
+                if value and not existing.get(field):
+                    existing[field] = value
+        if doi:
+            by_doi.setdefault(doi, existing)
+        if title:
+            by_title.setdefault(title, existing)
+    return merged
+
+def _resolve_identifier_refs(dois) -> dict:
+    """{doi: {title, authors, year, doi}} from one Semantic Scholar batch call, Crossref for the misses."""
+    found = semantic_scholar_batch_by_doi(dois)
+    missing = [doi for doi in dois if doi.lower() not in found]
+    for doi, record, error in iter_in_threads(crossref_enrich, missing, ANALYSIS_MAX_WORKERS):
+        if error is None and record:
+            found[doi.lower()] = record
+    resolved = {}
+    for doi in dois:
+        paper = found.get(doi.lower()) or {}
+        authors = paper.get("authors_info") or ""
+        resolved[doi] = {
+            "title": (paper.get("title") or "").strip(),
+            "authors": [a.strip() for a in authors.split(",") if a.strip()],
+            "year": paper.get("year"),
+            "doi": doi,
+        }
+    return resolved
+
+def _llm_extract_chunk(chunk_text: str) -> list:
+    """One LLM extraction request for a chunk of reference text; [] on failure."""
+    prompt = f"""
 You are an academic reference extractor.
-From the text below, extract a list of references as JSON array. Each object must have:
+From the text below, extract a list of references as a JSON object {{"references": [...]}}. Each reference must have:
 - "title" (string)
 - "authors" (list of names)
 - "year" (int if available else null)
 - "doi" (string DOI without https://doi.org/ if present else null)
 
 Text:
-{raw_text}
+{chunk_text}
 
-Return strictly a JSON array.
-""")
+Return strictly the JSON object.
+"""
+    try:
+        data = openai_structured(prompt, REFERENCES_SCHEMA, name="extracted_references", task="extract-refs")
+    except Exception as e:
+        print(f"Reference extraction failed for a chunk: {e}")
+        return []
     out = []
-    if isinstance(data, list):
-        for it in data:
+    if isinstance(data, dict):
+        for it in data["references"]:
             if not isinstance(it, dict):
                 continue
             title = (it.get("title") or "").strip()
@@ -1763,105 +3169,115 @@ Return strictly a JSON array.
             if isinstance(doi, str):
                 m = DOI_RE.search(doi)
                 doi = m.group(0) if m else doi.strip()
-            out.append({"title": title, "authors": authors, "year": year, "doi": doi})
+            out.append({"title": title, "authors": authors, "year": year, "doi": doi, "parser": "llm"})
     return out
 
-def openai_annotate_paper(title, authors, snippet, pdf_text, url, user_query):
+def openai_extract_from_text(raw_text: str, local_parser: bool = True):
     """
-    Return: abstract (10 to 15 sentences), tags [aRT..., aTa..., aTy..., aMe..., ai score-n], score3 (0..3)
+    Extract refs from pasted text (e.g., Google Scholar page).
+    Returns list of {title, authors:[...], year, doi?, parser, confidence?}
+    Pieces with a DOI or arXiv ID are taken as-is (metadata from Semantic Scholar /
+    Crossref, no LLM; parser "identifier"). With local_parser, well-formed APA, Vancouver
+    and Nature references are parsed locally (parser = style, with its confidence). The
+    rest is cut into ~EXTRACT_CHUNK_TOKENS chunks that are extracted by the LLM
+    concurrently (parser "llm"). Results are de-duplicated and kept in text order.
     """
-    # Get user preferences from session state
-    prefs = st.session_state.get('user_profile', {})
-    
-    # Use admin defaults if no user preferences defined
-    admin_defaults = {
-        'topics': ['physical chemistry', 'biochemistry', 'structural biology', 'protein folding', 'molecular dynamics', 'enzyme kinetics'],
-        'authors': [],
-        'journals': ['Nature', 'Science', 'Cell', 'PNAS', 'Journal of Physical Chemistry', 'Biochemistry', 'Nature Structural & Molecular Biology']
-    }
-    
-    # Get effective preferences (user preferences or admin defaults)
-    effective_topics = prefs.get('topics', []) if prefs.get('topics') else admin_defaults['topics']
-    effective_authors = prefs.get('authors', []) if prefs.get('authors') else admin_defaults['authors']
-    effective_journals = prefs.get('journals', []) if prefs.get('journals') else admin_defaults['journals']
-    
-    prompt = f"""
-You are an academic assistant focused on the user's specific research interests. Analyze this paper and return JSON with keys:
+    segments = reference_segments(raw_text)
+    identified, parsed, remainder = [], [], []
+    local_parses = {}  # segment index -> local parse, fills gaps of unresolvable identifiers
+    for index, segment in enumerate(segments):
+        dois = reference_identifiers(segment)
+        identified.extend((index, doi) for doi in dois)
+        if local_parser and len(dois) == 1:
+            local_parses[index] = parse_citation(segment)
+        # Longer than its identifiers account for: may hold references without one
+        if len(segment) > 600 * len(dois):
+            local = parse_citations_locally(segment, CITATION_MIN_CONFIDENCE) if local_parser and not dois else []
+            if local:
+                parsed.extend((index, ref) for ref in local)
+            else:
+                remainder.append((index, segment))
+    chunks = _chunk_segments(remainder, EXTRACT_CHUNK_TOKENS)
+
+    def extract_identified():
+        resolved = _resolve_identifier_refs([doi for _, doi in identified])
+        refs = []
+        for index, doi in identified:
+            ref = {**resolved[doi], "parser": "identifier"}
+            local = local_parses.get(index)
+            for field in ("title", "authors", "year"):
+                if local and not ref.get(field):
+                    ref[field] = local[field]
+            refs.append((index, ref))
+        return refs
+
+    def extract_chunks():
+        found = []
+        workers = max(1, LLM_MAX_CONCURRENCY)
+        for chunk, refs, error in iter_in_threads(lambda c: _llm_extract_chunk("\n\n".join(p for _, p in c)), chunks, workers):
+            found.extend((chunk[0][0], ref) for ref in (refs or []))
+        return found
+
+    results = run_concurrently({"identifiers": extract_identified, "chunks": extract_chunks})
+    debug_utils.log_info(
+        f"Reference extraction: {len(segments)} pieces, {len(identified)} identifiers taken directly, "
+        f"{len(parsed)} parsed locally, {len(chunks)} chunks sent to the LLM"
+    )
+    ordered = sorted(results["identifiers"] + parsed + results["chunks"], key=lambda pair: pair[0])
+    refs = merge_references(ref for _, ref in ordered)
+    # Unresolvable identifiers still need something to show and search by
+    for ref in refs:
+        if not ref.get("title"):
+            ref["title"] = f"DOI {ref['doi']}"
+    return refs
+
+def annotation_prompt(title, authors, snippet, pdf_text, url, user_query, streaming=False):
+    """
+    JSON annotation prompt ({"abstract", "tags", "score3"}), see parse_annotation.
+    streaming=True asks for plain text instead (abstract first, then Score/Tags lines) so
+    the abstract can be shown while it streams, see parse_streamed_reply.
+    """
+    # Field names as they appear in the reply
+    abstract_key, tags_key, score_key = ("Abstract", "Tags", "Score") if streaming else ('"abstract"', '"tags"', '"score3"')
+    builder = PromptBuilder()
+    builder.add("instructions", f"""You are an academic assistant focused on the user's specific research interests. Analyze this paper and {"provide" if streaming else "return JSON with keys"}:
 IMPORTANT: All output must be in English regardless of the source document language.
 
-- "abstract": a 10 to 15 sentence abstract in English (self-contained; no references; factual only)
-- "tags": list of strings in English with REQUIRED prefixes:
+- {abstract_key}: a 10 to 15 sentence abstract in English (self-contained; no references; factual only)
+- {tags_key}: list of strings in English with REQUIRED prefixes:
     * aRT-Research Topic (1-2 precise tags, e.g., "aRT-Protein Folding", "aRT-Drug Discovery")
-    * aTa-Topic Tags (3-6 specific tags, e.g., "aTa-Machine Learning", "aTa-Structural Biology")  
+    * aTa-Topic Tags (3-6 specific tags, e.g., "aTa-Machine Learning", "aTa-Structural Biology")
     * aTy-Paper Type (e.g., "aTy-Review Article", "aTy-Experimental Study", "aTy-Meta Analysis")
     * aMe-Methods (key methods, e.g., "aMe-Molecular Dynamics", "aMe-Statistical Analysis")
     * Plus exactly one tag "ai score-N" where N is 0..3
-  
 IMPORTANT: Use hyphens (-) NOT colons (:) in tags. Format: "aRT-Topic Name" NOT "aRT:Topic Name"
 
-- "score3": integer 0..3 based on RIGOROUS ACADEMIC EVALUATION:
-
-USER'S SPECIFIC RESEARCH INTERESTS:
-Primary Topics: {effective_topics}
-Preferred Authors: {effective_authors if effective_authors else "No specific author preferences"}
-Preferred Journals: {effective_journals}
-
-SCORING CRITERIA (Based ENTIRELY on User Interest Relevance):
-SCORE 3 (Perfect Match - Exactly What User Needs):
-- DIRECTLY addresses user's primary research topics: {effective_topics}
-- Published in user's preferred journals: {effective_journals}
-- Authored by user's preferred researchers (if specified): {effective_authors}
-- High-quality methodology within user's field of interest
-- Perfect alignment with user's research objectives
-
-SCORE 2 (Good Match - Highly Relevant to User):
-- SIGNIFICANTLY overlaps with user's topics: {effective_topics}
-- Strong relevance to user's research focus
-- Published in reputable journals (may include user's preferred ones)
-- Good methodology and meaningful findings in user's area
-- Would be valuable for user's research
-
-SCORE 1 (Partial Match - Some User Relevance):
-- PARTIALLY relevant to user's research interests
-- Tangential connection to user's topics
-- May provide useful background or comparative context
-- Acceptable quality but limited direct applicability
-- Might be useful for comprehensive literature review
-
-SCORE 0 (No Match - Not Useful for User):
-- NO relevance to user's research interests: {effective_topics}
-- Does not address any of user's topic areas
-- Would not be useful for user's research objectives
-- Complete mismatch with user's focus
-- Not worth user's time to read
-
-Paper info:
-Title: {title}
-Authors: {authors}
-Context: {snippet if snippet is not None else ''}
-PDF: {pdf_text if pdf_text is not None else ''}
-URL: {url if url is not None else ''}
-
-EFFECTIVE USER INTERESTS (the primary scoring factors):
-Primary Topics: {effective_topics}
-Preferred Authors: {effective_authors if effective_authors else "No specific preferences"}
-Preferred Journals: {effective_journals}
-
-CRITICAL SCORING INSTRUCTIONS:
-1. PRIMARY FACTOR: How well does this paper address the user's topics: {effective_topics}?
-2. SECONDARY FACTOR: Is it in user's preferred journals: {effective_journals}?
-3. TERTIARY FACTOR: Is it by user's preferred authors: {effective_authors}?
-4. Score 3 ONLY if paper perfectly matches user's research interests
-5. Score 0 if paper has NO relevance to user's topics
-6. Ignore general academic prestige if it doesn't match user's interests
-
-CRITICAL: Respond with ONLY valid JSON. No additional text, explanations, or formatting.
+- {score_key}: integer 0..3, based ENTIRELY on relevance to the user's interests below""")
+    builder.add("interests", interests_block())
+    builder.add("criteria", """SCORING CRITERIA:
+SCORE 3 (Perfect Match): directly addresses the primary topics; preferred journals or authors count in its favour; high-quality methodology in the user's field
+SCORE 2 (Good Match): significantly overlaps with the topics; reputable journal; would be valuable for the user's research
+SCORE 1 (Partial Match): tangential connection to the topics; useful background or comparative context
+SCORE 0 (No Match): does not address any of the user's topic areas; not worth the user's time
+
+Weigh topics first, then preferred journals, then preferred authors. Ignore general academic prestige if the paper doesn't match the user's interests.""")
+    builder.add("paper", f"Paper info:\nTitle: {title}\nAuthors: {authors}\nURL: {url or ''}")
+    # Source snippet first (short, high signal), PDF text gets whatever budget is left
+    builder.add_context("snippet", "Context", snippet or "", ANNOTATION_CONTEXT_TOKENS // 3)
+    builder.add_context("pdf", "PDF", pdf_text or "", builder.context_left(ANNOTATION_CONTEXT_TOKENS))
+    if streaming:
+        builder.add("format", """CRITICAL: Respond in this EXACT plain-text format, in this order (no JSON, no markdown):
+Abstract: [the abstract as one paragraph]
+Score: [0-3]
+Tags: [tag1, tag2, tag3]""")
+        return builder.build("annotate-stream")
+    builder.add("format", """CRITICAL: Respond with ONLY valid JSON. No additional text, explanations, or formatting.
 Required JSON format:
-{{"abstract": "your abstract here", "tags": ["tag1", "tag2", "tag3"], "score3": 2}}
+{"abstract": "your abstract here", "tags": ["tag1", "tag2", "tag3"], "score3": 2}""")
+    return builder.build("annotate")
 
-Output ONLY the JSON object, nothing else.
-"""
-    data = openai_json(prompt)
+def parse_annotation(data):
+    """Annotation JSON -> (abstract, tags, score3) with normalized tags and a matching 'ai score-n' tag."""
     abstract, tags, score3_val = "", [], 0
     if isinstance(data, dict):
         abstract = data.get("abstract", "") or ""
@@ -1882,6 +3298,150 @@ Output ONLY the JSON object, nothing else.
         tags.append(score_tag)
     return abstract.strip(), tags, max(0, min(3, score3_val))
 
+def openai_annotate_paper(title, authors, snippet, pdf_text, url, user_query, on_text=None):
+    """
+    Return: abstract (10 to 15 sentences), tags [aRT..., aTa..., aTy..., aMe..., ai score-n], score3 (0..3)
+    With on_text, the reply is streamed as plain text and on_text(delta) sees it as it arrives.
+    """
+    if not OPENAI_API_KEY or not openai_client:
+        print("Warning: No valid OpenAI API key found - using fallback")
+        return parse_annotation({})
+    if on_text is not None:
+        text = llm_stream(annotation_prompt(title, authors, snippet, pdf_text, url, user_query, streaming=True),
+                          task="annotate-stream", on_text=on_text, use_profile=True,
+                          accept=streamed_reply_complete)
+        abstract, score3, tags = parse_streamed_reply(text)
+        return parse_annotation({"abstract": abstract, "tags": tags, "score3": score3})
+    prompt = annotation_prompt(title, authors, snippet, pdf_text, url, user_query)
+    # Raises StructuredOutputError rather than silently scoring an unreadable reply 0
+    return parse_annotation(openai_structured(prompt, ANNOTATION_SCHEMA, name="paper_annotation",
+                                              task="annotate", use_profile=True))
+
+# ============================
+# OPENAI BATCH API (offline bulk annotation)
+# ============================
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+def build_batch_jsonl(prompts: dict, model: str = "gpt-5-mini", **create_kwargs) -> bytes:
+    """One /v1/chat/completions request per line, keyed by custom_id."""
+    lines = []
+    for custom_id, prompt in prompts.items():
+        lines.append(json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": model, "messages": [{"role": "user", "content": prompt}], **create_kwargs},
+        }))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+def submit_openai_batch(prompts: dict, model: str = "gpt-5-mini", description: str = "bulk annotation", **create_kwargs) -> str:
+    """Upload the JSONL request file and start a batch job; returns the batch id."""
+    batch_file = openai_client.files.create(
+        file=("annotations.jsonl", build_batch_jsonl(prompts, model, **create_kwargs)),
+        purpose="batch",
+    )
+    batch = openai_client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata={"description": description},
+    )
+    print(f"Submitted OpenAI batch {batch.id} with {len(prompts)} requests")
+    return batch.id
+
+def wait_for_openai_batch(batch_id: str, on_tick=None):
+    """
+    Poll until the batch reaches a terminal status, calling on_tick(batch) after every poll.
+    Raises TimeoutError after BATCH_MAX_WAIT_MINUTES. Whenever the wait ends without a
+    terminal status (timeout, error, or Streamlit stopping the run) the job is cancelled,
+    so nobody is billed for results that will never be read.
+    """
+    deadline = monotonic() + BATCH_MAX_WAIT_MINUTES * 60
+    finished = False
+    try:
+        while True:
+            batch = openai_client.batches.retrieve(batch_id)
+            if batch.status in BATCH_TERMINAL_STATUSES:
+                finished = True
+            if on_tick:
+                on_tick(batch)
+            if finished:
+                return batch
+            if monotonic() >= deadline:
+                raise TimeoutError(f"OpenAI batch {batch_id} still '{batch.status}' after {BATCH_MAX_WAIT_MINUTES} min (cancelled)")
+            sleep(BATCH_POLL_SECONDS)
+    finally:
+        if not finished:
+            try:
+                openai_client.batches.cancel(batch_id)
+                debug_utils.log_info(f"Cancelled OpenAI batch {batch_id}")
+            except Exception as e:
+                debug_utils.log_warning(f"Could not cancel OpenAI batch {batch_id}: {e}")
+
+def read_openai_batch_results(batch, model: str) -> dict:
+    """
+    custom_id -> reply text for every request that succeeded (failed ones are simply missing).
+    Usage is recorded under the submitted model: the reply names a dated snapshot instead.
+    """
+    if not batch.output_file_id:
+        return {}
+    replies = {}
+    for line in openai_client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            response = row.get("response") or {}
+            if row.get("error") or response.get("status_code") != 200:
+                print(f"Batch request {row.get('custom_id')} failed: {row.get('error') or response.get('status_code')}")
+                continue
+            replies[row["custom_id"]] = (response["body"]["choices"][0]["message"]["content"] or "").strip()
+            record_llm_usage("batch", model, response["body"].get("usage"), batch=True)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            print(f"Unreadable batch result line: {e}")
+    return replies
+
+def run_openai_batch(prompts: dict, *, model: str = "gpt-5-mini", use_profile: bool = False, on_tick=None, **create_kwargs) -> dict:
+    """
+    Answer many independent prompts through the Batch API; returns custom_id -> reply text.
+    Prompts already in the LLM cache are answered locally and never submitted; fresh
+    replies are written to the cache, so the interactive path reuses them on later runs.
+    The estimated tokens of the whole batch are reserved against the user's daily budget
+    before submitting (LLMBudgetExceeded if they do not fit) and held until the results
+    are recorded, so calls made meanwhile see them as spent.
+    """
+    replies = {}
+    pending = {}
+    for custom_id, prompt in prompts.items():
+        cached = llm_cached_reply(prompt, model=model, use_profile=use_profile, **create_kwargs)
+        if cached is not None:
+            replies[custom_id] = cached
+            record_llm_usage("batch", model, cached=True)
+        else:
+            pending[custom_id] = prompt
+    if not pending:
+        return replies
+
+    username = llm_username()
+    reply_tokens = create_kwargs.get("max_completion_tokens") or BATCH_REPLY_TOKENS
+    estimate = sum(approx_tokens(prompt) + reply_tokens for prompt in pending.values())
+    if not get_llm_usage().reserve(username, estimate, user_token_budget(username)):
+        raise LLMBudgetExceeded(
+            f"Batch of {len(pending)} requests (~{estimate:,} tokens) does not fit in the {llm_tokens_left(username):,} "
+            f"tokens left today of '{username}' (daily budget {user_token_budget(username):,})"
+        )
+    try:
+        batch = wait_for_openai_batch(submit_openai_batch(pending, model, **create_kwargs), on_tick=on_tick)
+        if batch.status != "completed":
+            raise RuntimeError(f"OpenAI batch {batch.id} ended with status '{batch.status}'")
+        for custom_id, text in read_openai_batch_results(batch, model).items():
+            if custom_id in pending:
+                replies[custom_id] = text
+                llm_remember(pending[custom_id], text, model=model, use_profile=use_profile, **create_kwargs)
+    finally:
+        get_llm_usage().release(username, estimate)
+    return replies
+
 # ============================
 # SEARCH PROVIDERS (S2 + PubMed) + Crossref + Google fallback
 # ============================
@@ -1903,7 +3463,7 @@ def search_semantic_scholar_with_dates(query, limit=10, year_from=None, year_to=
     params = {
         "query": query,
         "limit": limit,
-        "fields": "title,authors,url,abstract,openAccessPdf,externalIds,venue,year,citationCount,publicationDate,publicationTypes"
+        "fields": S2_PAPER_FIELDS
     }
     
     # Add year filtering if specified
@@ -1916,9 +3476,15 @@ def search_semantic_scholar_with_dates(query, limit=10, year_from=None, year_to=
             params["year"] = f"-{year_to.year}"
     
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=30)
+        response = cached_http_request("GET", url, provider="semantic_scholar_search", headers=headers, params=params, timeout=30)
         response.raise_for_status()
         data = response.json()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 429:
+            st.error("Semantic Scholar rate limit (429) persisted after retries — the API key's quota is exhausted, try again shortly.")
+        else:
+            st.error(f"Semantic Scholar error: {e}")
+        return []
     except Exception as e:
         st.error(f"Semantic Scholar error: {e}")
         return []
@@ -1956,353 +3522,337 @@ def search_semantic_scholar(query, limit=10):
     """Compatibility function for existing code"""
     return search_semantic_scholar_with_dates(query, limit)
 
-def search_pubmed_with_dates(query, limit=10, year_from=None, year_to=None):
-    """PubMed search with date filtering and improved error handling"""
+class PubMedError(Exception):
+    """An E-utilities request failed after the retry policy gave up."""
+
+class PubMedClient:
+    """
+    The one ESearch → ESummary → EFetch engine behind search_pubmed_with_dates,
+    search_pubmed and fetch_pubmed_metadata(_batch). Date filters, batching, retries,
+    timeouts and XML parsing live here once; every request goes through the response
+    cache and the NCBI token bucket.
+    """
+
     base = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
-    
-    # Add date filtering to query
-    term = (query or "")[:300]
-    if year_from or year_to:
-        if year_from and year_to:
-            # Use more reliable PubMed date format - just year range for better compatibility
-            date_range = f'("{year_from.year}"[Date - Publication] : "{year_to.year}"[Date - Publication])'
-        elif year_from:
-            date_range = f'"{year_from.year}"[Date - Publication] : "3000"[Date - Publication]'
-        else:  # year_to only
-            date_range = f'"1900"[Date - Publication] : "{year_to.year}"[Date - Publication]'
-        
-        term = f"({term}) AND {date_range}"
-    
-    es_params = {"db": "pubmed", "term": term, "retmode": "json", "retmax": limit, "email": NCBI_EMAIL}
-    if NCBI_API_KEY:
-        es_params["api_key"] = NCBI_API_KEY
-    
-    # Improved error handling with retries and longer timeout
-    for attempt in range(3):
-        try:
-            timeout = 45 + (attempt * 15)  # Increase timeout on each retry
-            es = requests.get(f"{base}/esearch.fcgi", params=es_params, timeout=timeout).json()
-            break
-        except requests.exceptions.ConnectTimeout:
-            if attempt == 2:  # Last attempt
-                st.warning(f"⚠️ PubMed connection timeout after {attempt + 1} attempts. This can happen due to network issues or high server load. Skipping PubMed search.")
-                return []
-            st.info(f"🔄 PubMed connection timeout, retrying... (attempt {attempt + 1}/3)")
-            sleep(2 + attempt)  # Exponential backoff
-        except requests.exceptions.RequestException as e:
-            if attempt == 2:  # Last attempt
-                st.warning(f"⚠️ PubMed connection error: {str(e)[:100]}... Skipping PubMed search.")
-                return []
-            st.info(f"🔄 PubMed connection error, retrying... (attempt {attempt + 1}/3)")
-            sleep(2 + attempt)
-        except Exception as e:
-            st.warning(f"⚠️ PubMed ESearch error: {str(e)[:100]}... Skipping PubMed search.")
-            return []
 
-    ids = (es.get("esearchresult", {}) or {}).get("idlist", []) or []
-    if not ids:
-        return []
+    def __init__(self, timeout=PUBMED_TIMEOUT, retries=PUBMED_RETRIES, batch_size=PUBMED_BATCH_SIZE,
+                 backoff=PUBMED_BACKOFF_SECONDS):
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.batch_size = batch_size
+        self.backoff = max(1.0, backoff)
 
-    # ESummary (basic metadata) with retry logic
-    sum_params = {"db": "pubmed", "id": ",".join(ids), "retmode": "json", "email": NCBI_EMAIL}
-    if NCBI_API_KEY:
-        sum_params["api_key"] = NCBI_API_KEY
-    
-    # ESummary with retry logic
-    for attempt in range(3):
-        try:
-            timeout = 45 + (attempt * 15)
-            sm = requests.get(f"{base}/esummary.fcgi", params=sum_params, timeout=timeout).json()
-            break
-        except requests.exceptions.ConnectTimeout:
-            if attempt == 2:
-                st.warning("⚠️ PubMed metadata timeout, returning basic results only")
-                return []
-            sleep(2 + attempt)
-        except Exception as e:
-            if attempt == 2:
-                st.warning(f"⚠️ PubMed ESummary error: {str(e)[:100]}...")
-                return []
-            sleep(2 + attempt)
-
-    # EFetch to get abstracts and DOIs (XML) — best effort with timeout handling
-    abstracts = {}
-    dois = {}
-    try:
-        ef_params = {"db": "pubmed", "retmode": "xml", "email": NCBI_EMAIL}
+    @staticmethod
+    def _params(**params) -> dict:
+        params.update({"db": "pubmed", "email": NCBI_EMAIL})
         if NCBI_API_KEY:
-            ef_params["api_key"] = NCBI_API_KEY
-        ef = requests.post(f"{base}/efetch.fcgi", params=ef_params, data={"id": ",".join(ids)}, timeout=60)
-        ef.raise_for_status()
-        root = ET.fromstring(ef.text)
-        for art in root.findall(".//PubmedArticle"):
-            pmid = art.findtext(".//PMID")
-            
-            # Extract abstract
-            abst_nodes = art.findall(".//Abstract/AbstractText")
-            abs_text = " ".join((n.text or "") for n in abst_nodes).strip()
-            if abs_text:
-                abstracts[pmid] = clean_snippet(abs_text)
-            
-            # Extract DOI from ArticleIdList
-            doi = None
-            for article_id in art.findall(".//ArticleIdList/ArticleId"):
-                if article_id.get("IdType") == "doi":
-                    doi = article_id.text
-                    break
-            if doi:
-                dois[pmid] = doi
-    except Exception:
-        pass
-
-    out, block = [], sm.get("result", {}) or {}
-    for pmid in ids[:limit]:
-        r = block.get(pmid, {}) or {}
-        jrnl = r.get("fulljournalname") or r.get("source")
-        # year parsing
-        year = None
+            params["api_key"] = NCBI_API_KEY
+        return params
+
+    def _retrying(self, what: str, call):
+        """Run call() under the shared retry policy: transport errors and 5xx are retried."""
+        for attempt in range(1, self.retries + 1):
+            try:
+                return call()
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code < 500 or attempt == self.retries:
+                    raise PubMedError(f"{what}: {e}") from e
+            except (httpx.TransportError, ET.ParseError, ValueError) as e:
+                if attempt == self.retries:
+                    raise PubMedError(f"{what} failed after {attempt} attempts: {e}") from e
+            # Exponential backoff with jitter so concurrent sessions don't retry in lockstep
+            delay = self.backoff * 2 ** (attempt - 1)
+            sleep(delay + random.uniform(0, delay / 2))
+
+    def _json(self, endpoint: str, provider: str, params: dict, data=None) -> dict:
+        def call():
+            resp = cached_http_request("POST" if data else "GET", f"{self.base}/{endpoint}", provider=provider,
+                                       params=params, data=data, timeout=self.timeout, accept=ncbi_reply_ok)
+            resp.raise_for_status()
+            return resp.json() or {}
+        return self._retrying(endpoint, call)
+
+    @staticmethod
+    def date_term(query: str, year_from=None, year_to=None) -> str:
+        """ESearch term (capped to 300 chars) with an optional publication-year range."""
+        term = (query or "")[:300]
+        if year_from or year_to:
+            if year_from and year_to:
+                # Use more reliable PubMed date format - just year range for better compatibility
+                date_range = f'("{year_from.year}"[Date - Publication] : "{year_to.year}"[Date - Publication])'
+            elif year_from:
+                date_range = f'"{year_from.year}"[Date - Publication] : "3000"[Date - Publication]'
+            else:  # year_to only
+                date_range = f'"1900"[Date - Publication] : "{year_to.year}"[Date - Publication]'
+            term = f"({term}) AND {date_range}"
+        return term
+
+    def search_ids(self, query: str, limit=10, year_from=None, year_to=None) -> list:
+        es = self._json("esearch.fcgi", "pubmed_search",
+                        self._params(term=self.date_term(query, year_from, year_to), retmode="json", retmax=limit))
+        return (es.get("esearchresult", {}) or {}).get("idlist", []) or []
+
+    def summaries(self, ids) -> dict:
+        """pmid -> ESummary record, batched POSTs."""
+        out = {}
+        for chunk in _chunks(list(ids), self.batch_size):
+            sm = self._json("esummary.fcgi", "pubmed", self._params(retmode="json"), data={"id": ",".join(chunk)})
+            for pmid, rec in (sm.get("result", {}) or {}).items():
+                if isinstance(rec, dict) and not rec.get("error"):
+                    out[pmid] = rec
+        return out
+
+    def articles(self, ids) -> dict:
+        """pmid -> {"pmid", "abstract", "doi"} from streamed EFetch XML, batched POSTs."""
+        out = {}
+        for chunk in _chunks(list(ids), self.batch_size):
+            def call():
+                body = cached_http_stream("POST", f"{self.base}/efetch.fcgi", provider="pubmed",
+                                          params=self._params(retmode="xml"), data={"id": ",".join(chunk)},
+                                          timeout=self.timeout)
+                return {rec["pmid"]: rec for rec in iter_pubmed_articles(body)}
+            out.update(self._retrying("efetch.fcgi", call))
+        return out
+
+    def _articles_best_effort(self, ids) -> dict:
+        # Abstracts/DOIs are a bonus on top of ESummary; never fail the whole call for them
         try:
-            dp = r.get("pubdate") or ""
-            m = re.search(r"\b(19|20)\d{2}\b", dp)
+            return self.articles(ids)
+        except PubMedError as e:
+            print(f"PubMed EFetch skipped: {e}")
+            return {}
+
+    @staticmethod
+    def _authors(summary: dict) -> str:
+        authors = summary.get("authors", [])
+        if isinstance(authors, list):
+            return ", ".join([a.get("name", "") for a in authors])
+        return str(authors or "")
+
+    def search(self, query: str, limit=10, year_from=None, year_to=None) -> list:
+        """Search results in the app's paper-dict shape."""
+        ids = self.search_ids(query, limit, year_from, year_to)
+        if not ids:
+            return []
+        block = self.summaries(ids)
+        arts = self._articles_best_effort(ids)
+
+        out = []
+        for pmid in ids[:limit]:
+            r = block.get(pmid, {}) or {}
+            art = arts.get(pmid, {})
+            # year parsing
+            year = None
+            m = re.search(r"\b(19|20)\d{2}\b", r.get("pubdate") or "")
             if m:
                 year = int(m.group(0))
-        except Exception:
-            pass
-
-        out.append({
-            "title": r.get("title", ""),
-            "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
-            "authors_info": ", ".join([a.get("name","") for a in (r.get("authors") or [])]) if isinstance(r.get("authors", []), list) else "",
-            "snippet": abstracts.get(pmid) or clean_snippet(r.get("source", "") or ""),
-            "pdf_url": "",
-            "doi": dois.get(pmid),  # Use extracted DOI instead of None
-            "venue": jrnl,
-            "year": year,
-            "citationCount": None,
-            "publicationDate": r.get("pubdate"),
-            "publicationTypes": r.get("pubtype"),
-        })
-    return out
+            out.append({
+                "title": r.get("title", ""),
+                "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
+                "authors_info": self._authors(r),
+                "snippet": clean_snippet(art.get("abstract") or "") or clean_snippet(r.get("source", "") or ""),
+                "pdf_url": "",
+                "doi": art.get("doi"),
+                "venue": r.get("fulljournalname") or r.get("source"),
+                "year": year,
+                "citationCount": None,
+                "publicationDate": r.get("pubdate"),
+                "publicationTypes": r.get("pubtype"),
+                "pmid": pmid,
+            })
+        return out
+
+    def metadata(self, pmids) -> list:
+        """Detailed records (professor's metadata shape) in input order; unknown PMIDs skipped."""
+        pmids = list(dict.fromkeys(str(p).strip() for p in pmids if str(p).strip()))
+        if not pmids:
+            return []
+        summaries = self.summaries(pmids)
+        arts = self._articles_best_effort([p for p in pmids if p in summaries])
+        out = []
+        for pmid in pmids:
+            result = summaries.get(pmid)
+            if not result:
+                continue
+            art = arts.get(pmid, {})
+            out.append({
+                "Title": result.get("title", ""),
+                "Authors": self._authors(result),
+                "Journal": result.get("fulljournalname", "") or result.get("source", ""),
+                "Year": result.get("pubdate", "").split()[0] if result.get("pubdate") else "",
+                "Abstract": art.get("abstract", ""),
+                "DOI": art.get("doi") or "",
+                "PMID": pmid,
+                "URL": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
+                "Volume": result.get("volume", ""),
+                "Issue": result.get("issue", ""),
+                "Pages": result.get("pages", ""),
+                "PublicationType": result.get("pubtype", [])
+            })
+        return out
+
+PUBMED = PubMedClient()
+
+def search_pubmed_with_dates(query, limit=10, year_from=None, year_to=None):
+    """PubMed search with date filtering (see PubMedClient)"""
+    try:
+        return PUBMED.search(query, limit, year_from, year_to)
+    except PubMedError as e:
+        st.warning(f"⚠️ PubMed error: {str(e)[:150]}... Skipping PubMed search.")
+        return []
+
+S2_PAPER_FIELDS = "title,authors,url,abstract,openAccessPdf,externalIds,venue,year,citationCount,publicationDate,publicationTypes"
+S2_BATCH_SIZE = 500  # /paper/batch accepts at most 500 ids per request
+
+def _s2_paper_to_result(p: dict, doi: str = None) -> dict:
+    """Map a Semantic Scholar paper object onto the app's paper dict."""
+    return {
+        "title": p.get("title", ""),
+        "url": p.get("url", "") or (f"https://doi.org/{doi}"),
+        "authors_info": ", ".join([a.get("name", "") for a in p.get("authors", []) or []]),
+        "snippet": clean_snippet(p.get("abstract", "") or ""),
+        "pdf_url": (p.get("openAccessPdf") or {}).get("url", ""),
+        "doi": (p.get("externalIds") or {}).get("DOI") or doi,
+        "venue": p.get("venue"),
+        "year": p.get("year"),
+        "citationCount": p.get("citationCount"),
+        "publicationDate": p.get("publicationDate"),
+        "publicationTypes": p.get("publicationTypes"),
+    }
 
 def semantic_scholar_by_doi(doi: str):
     if not doi:
         return None
     url = f"https://api.semanticscholar.org/graph/v1/paper/DOI:{doi}"
     headers = {"x-api-key": SEMANTIC_SCHOLAR_API_KEY} if SEMANTIC_SCHOLAR_API_KEY else {}
-    params = {"fields": "title,authors,url,abstract,openAccessPdf,externalIds,venue,year,citationCount,publicationDate,publicationTypes"}
+    params = {"fields": S2_PAPER_FIELDS}
     try:
-        r = requests.get(url, headers=headers, params=params, timeout=20)
+        r = cached_http_request("GET", url, provider="semantic_scholar", headers=headers, params=params, timeout=20)
         r.raise_for_status()
-        p = r.json()
-        return {
-            "title": p.get("title", ""),
-            "url": p.get("url", "") or (f"https://doi.org/{doi}"),
-            "authors_info": ", ".join([a.get("name", "") for a in p.get("authors", [])]),
-            "snippet": clean_snippet(p.get("abstract", "") or ""),
-            "pdf_url": (p.get("openAccessPdf") or {}).get("url", ""),
-            "doi": (p.get("externalIds") or {}).get("DOI") or doi,
-            "venue": p.get("venue"),
-            "year": p.get("year"),
-            "citationCount": p.get("citationCount"),
-            "publicationDate": p.get("publicationDate"),
-            "publicationTypes": p.get("publicationTypes"),
-        }
+        return _s2_paper_to_result(r.json(), doi)
     except Exception:
         return None
 
-def search_pubmed(query, limit=10):
+def semantic_scholar_batch_by_doi(dois) -> dict:
     """
-    Simple, robust PubMed: GET ESearch + ESummary + (best-effort) EFetch abstracts; term capped to 300 chars.
-    Improved with better timeout and retry logic.
+    Resolve many DOIs with the Semantic Scholar /paper/batch endpoint (500 ids per request).
+    Returns {doi.lower(): paper dict} for the DOIs S2 knows; unknown DOIs are simply absent.
     """
-    base = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
-    term = (query or "")[:300]  # PubMed truncation
-    es_params = {"db": "pubmed", "term": term, "retmode": "json", "retmax": limit, "email": NCBI_EMAIL}
-    if NCBI_API_KEY:
-        es_params["api_key"] = NCBI_API_KEY
-    
-    # Improved error handling with retries and longer timeout
-    for attempt in range(3):
+    unique = list(dict.fromkeys(d.strip() for d in dois if d and d.strip()))
+    if not unique:
+        return {}
+    url = "https://api.semanticscholar.org/graph/v1/paper/batch"
+    headers = {"x-api-key": SEMANTIC_SCHOLAR_API_KEY} if SEMANTIC_SCHOLAR_API_KEY else {}
+    found = {}
+    for chunk in _chunks(unique, S2_BATCH_SIZE):
         try:
-            timeout = 45 + (attempt * 15)  # Increase timeout on each retry
-            es = requests.get(f"{base}/esearch.fcgi", params=es_params, timeout=timeout).json()
-            break
-        except requests.exceptions.ConnectTimeout:
-            if attempt == 2:  # Last attempt
-                st.warning(f"⚠️ PubMed connection timeout after {attempt + 1} attempts. This can happen due to network issues or high server load. Skipping PubMed search.")
-                return []
-            st.info(f"🔄 PubMed connection timeout, retrying... (attempt {attempt + 1}/3)")
-            sleep(2 + attempt)  # Exponential backoff
-        except requests.exceptions.RequestException as e:
-            if attempt == 2:  # Last attempt
-                st.warning(f"⚠️ PubMed connection error: {str(e)[:100]}... Skipping PubMed search.")
-                return []
-            st.info(f"🔄 PubMed connection error, retrying... (attempt {attempt + 1}/3)")
-            sleep(2 + attempt)
+            r = cached_http_request("POST", url, provider="semantic_scholar", headers=headers,
+                                    params={"fields": S2_PAPER_FIELDS},
+                                    json_body={"ids": [f"DOI:{d}" for d in chunk]}, timeout=60)
+            r.raise_for_status()
+            papers = r.json() or []
         except Exception as e:
-            st.warning(f"⚠️ PubMed ESearch error: {str(e)[:100]}... Skipping PubMed search.")
-            return []
-
-    ids = (es.get("esearchresult", {}) or {}).get("idlist", []) or []
-    if not ids:
-        return []
+            print(f"Semantic Scholar batch lookup error: {e}")
+            continue
+        # The response is aligned with the request ids; null marks an unknown id
+        for doi, p in zip(chunk, papers):
+            if p:
+                found[doi.lower()] = _s2_paper_to_result(p, doi)
+    return found
 
-    # ESummary (basic metadata) with retry logic
-    sum_params = {"db": "pubmed", "id": ",".join(ids), "retmode": "json", "email": NCBI_EMAIL}
-    if NCBI_API_KEY:
-        sum_params["api_key"] = NCBI_API_KEY
-    
-    for attempt in range(3):
-        try:
-            timeout = 45 + (attempt * 15)
-            sm = requests.get(f"{base}/esummary.fcgi", params=sum_params, timeout=timeout).json()
-            break
-        except requests.exceptions.ConnectTimeout:
-            if attempt == 2:
-                st.warning("⚠️ PubMed metadata timeout, returning basic results only")
-                return []
-            sleep(2 + attempt)
-        except Exception as e:
-            if attempt == 2:
-                st.warning(f"⚠️ PubMed ESummary error: {str(e)[:100]}...")
-                return []
-            sleep(2 + attempt)
-
-    # EFetch to get abstracts and DOIs (XML) — best effort
-    abstracts = {}
-    dois = {}
-    try:
-        ef_params = {"db": "pubmed", "retmode": "xml", "email": NCBI_EMAIL}
-        if NCBI_API_KEY:
-            ef_params["api_key"] = NCBI_API_KEY
-        ef = requests.post(f"{base}/efetch.fcgi", params=ef_params, data={"id": ",".join(ids)}, timeout=40)
-        ef.raise_for_status()
-        root = ET.fromstring(ef.text)
-        for art in root.findall(".//PubmedArticle"):
-            pmid = art.findtext(".//PMID")
-            
-            # Extract abstract
-            abst_nodes = art.findall(".//Abstract/AbstractText")
-            abs_text = " ".join((n.text or "") for n in abst_nodes).strip()
-            if abs_text:
-                abstracts[pmid] = clean_snippet(abs_text)
-            
-            # Extract DOI from ArticleIdList
-            doi = None
-            for article_id in art.findall(".//ArticleIdList/ArticleId"):
-                if article_id.get("IdType") == "doi":
-                    doi = article_id.text
-                    break
-            if doi:
-                dois[pmid] = doi
-    except Exception:
-        pass
-
-    out, block = [], sm.get("result", {}) or {}
-    for pmid in ids[:limit]:
-        r = block.get(pmid, {}) or {}
-        jrnl = r.get("fulljournalname") or r.get("source")
-        # year parsing
-        year = None
-        try:
-            dp = r.get("pubdate") or ""
-            m = re.search(r"\b(19|20)\d{2}\b", dp)
-            if m:
-                year = int(m.group(0))
-        except Exception:
-            pass
-
-        out.append({
-            "title": r.get("title", ""),
-            "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
-            "authors_info": ", ".join([a.get("name","") for a in (r.get("authors") or [])]) if isinstance(r.get("authors", []), list) else "",
-            "snippet": abstracts.get(pmid) or clean_snippet(r.get("source", "") or ""),
-            "pdf_url": "",
-            "doi": dois.get(pmid),  # Use extracted DOI instead of None
-            "venue": jrnl,
-            "year": year,
-            "citationCount": None,
-            "publicationDate": r.get("pubdate"),
-            "publicationTypes": r.get("pubtype"),
-        })
-    return out
+def search_pubmed(query, limit=10):
+    """PubMed search without date filters (see PubMedClient)"""
+    return search_pubmed_with_dates(query, limit)
 
 def fetch_pubmed_metadata(pmid):
     """
     Fetch detailed metadata for a single PMID
     Returns structured metadata dict compatible with professor's workflow
     """
-    try:
-        base = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
-        
-        # First get basic info
-        esummary_params = {"db": "pubmed", "retmode": "json", "id": pmid}
-        if NCBI_API_KEY:
-            esummary_params["api_key"] = NCBI_API_KEY
-            
-        summary_resp = requests.get(f"{base}/esummary.fcgi", params=esummary_params, timeout=30)
-        summary_resp.raise_for_status()
-        summary_data = summary_resp.json()
-        
-        result = summary_data.get("result", {}).get(pmid, {})
-        if not result:
-            return None
-            
-        # Get detailed info with abstract
-        efetch_params = {"db": "pubmed", "retmode": "xml", "id": pmid}
-        if NCBI_API_KEY:
-            efetch_params["api_key"] = NCBI_API_KEY
-            
-        detail_resp = requests.get(f"{base}/efetch.fcgi", params=efetch_params, timeout=30)
-        detail_resp.raise_for_status()
-        
-        # Parse XML for abstract
-        root = ET.fromstring(detail_resp.text)
-        abstract_nodes = root.findall(".//Abstract/AbstractText")
-        abstract = " ".join((n.text or "") for n in abstract_nodes).strip()
-        
-        # Parse DOI
-        doi_nodes = root.findall(".//ArticleId[@IdType='doi']")
-        doi = doi_nodes[0].text if doi_nodes else ""
-        
-        # Build metadata dict in expected format
-        authors_list = result.get("authors", [])
-        if isinstance(authors_list, list):
-            authors_str = ", ".join([a.get("name", "") for a in authors_list])
-        else:
-            authors_str = str(authors_list)
-            
-        metadata = {
-            "Title": result.get("title", ""),
-            "Authors": authors_str,
-            "Journal": result.get("fulljournalname", "") or result.get("source", ""),
-            "Year": result.get("pubdate", "").split()[0] if result.get("pubdate") else "",
-            "Abstract": abstract,
-            "DOI": doi,
-            "PMID": pmid,
-            "URL": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
-            "Volume": result.get("volume", ""),
-            "Issue": result.get("issue", ""),
-            "Pages": result.get("pages", ""),
-            "PublicationType": result.get("pubtype", [])
-        }
-        
-        return metadata
-        
-    except Exception as e:
-        st.warning(f"Error fetching PMID {pmid}: {e}")
-        return None
+    records = fetch_pubmed_metadata_batch([pmid])
+    return records[0] if records else None
+
+def fetch_pubmed_metadata_batch(pmids):
+    """
+    Fetch detailed metadata for many PMIDs with chunked POST ESummary + EFetch calls.
+    Returns metadata dicts in the same shape as fetch_pubmed_metadata, in input order.
+    """
+    pmids = list(dict.fromkeys(str(p).strip() for p in pmids if str(p).strip()))
+    out = []
+    for chunk in _chunks(pmids, PUBMED.batch_size):
+        try:
+            out.extend(PUBMED.metadata(chunk))
+        except PubMedError as e:
+            st.warning(f"Error fetching PMIDs {', '.join(chunk[:5])}{'…' if len(chunk) > 5 else ''}: {e}")
+    return out
+
+# ---------- Per-run DOI resolver ----------
+class DoiResolver:
+    """
+    Fetches each DOI source (Crossref work, bioRxiv details, universal lookup) at most once
+    per DOI and keeps the parsed record. Thread-safe: concurrent workers asking for the same
+    DOI wait for the first fetch instead of repeating it.
+    """
+
+    def __init__(self):
+        self._memo = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(doi: str) -> str:
+        doi = (doi or "").strip()
+        for prefix in ("https://doi.org/", "http://doi.org/", "http://dx.doi.org/", "https://dx.doi.org/"):
+            if doi.lower().startswith(prefix):
+                doi = doi[len(prefix):]
+        return doi
+
+    def get(self, source: str, doi: str, fetch):
+        """Return the memoized fetch(doi) result for (source, doi), fetching it once."""
+        doi = self.normalize(doi)
+        key = (source, doi.lower())
+        with self._lock:
+            if key in self._memo:
+                return self._memo[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._memo:
+                    return self._memo[key]
+            value = fetch(doi)
+            with self._lock:
+                self._memo[key] = value
+            return value
+
+    def crossref_work(self, doi: str) -> dict:
+        return self.get("crossref", doi, _fetch_crossref_work) if doi else {}
+
+    def biorxiv(self, doi: str) -> dict:
+        return self.get("biorxiv", doi, _fetch_biorxiv) if doi else {}
+
+    def lookup(self, doi: str) -> dict:
+        return self.get("universal", doi, _universal_doi_lookup) if doi else {}
+
+# The script body re-executes on every Streamlit run, so this starts empty for each run
+DOI_RESOLVER = DoiResolver()
 
 # ---------- Crossref enrichment (if DOI is known) ----------
+def _fetch_crossref_work(doi: str) -> dict:
+    """Raw Crossref `message` for a DOI ({} if unavailable). Use DOI_RESOLVER.crossref_work."""
+    url = f"https://api.crossref.org/works/{doi}"
+    try:
+        data = _request_json_with_retries(url, timeout=30, provider="crossref")
+        return (data or {}).get("message", {}) or {}
+    except Exception:
+        return {}
+
 def crossref_enrich(doi: str) -> dict:
     if not doi:
         return {}
-    url = f"https://api.crossref.org/works/{doi}"
+    msg = DOI_RESOLVER.crossref_work(doi)
+    if not msg:
+        return {}
     try:
-        data = _request_json_with_retries(url, timeout=30)
-        msg = (data or {}).get("message", {})
-        if not msg:
-            return {}
         title = (msg.get("title") or [""])[0]
         journal = (msg.get("container-title") or [""])[0]
         date_parts = (msg.get("issued") or {}).get("date-parts", [[]])
@@ -2329,6 +3879,12 @@ def crossref_enrich(doi: str) -> dict:
         return {}
 
 def biorxiv_api_fetch(doi: str) -> dict:
+    """Fetch paper metadata from bioRxiv API using DOI (memoized per run)."""
+    if not doi or not doi.startswith("10.1101/"):
+        return {}
+    return DOI_RESOLVER.biorxiv(doi)
+
+def _fetch_biorxiv(doi: str) -> dict:
     """Fetch paper metadata from bioRxiv API using DOI.
     
     Args:
@@ -2351,7 +3907,7 @@ def biorxiv_api_fetch(doi: str) -> dict:
         # bioRxiv API format: /details/{server}/{doi}/na/json
         api_url = f"https://api.biorxiv.org/details/biorxiv/{clean_doi}/na/json"
         
-        response = requests.get(api_url, timeout=30)
+        response = cached_http_request("GET", api_url, provider="biorxiv", timeout=30, accept=biorxiv_reply_ok)
         response.raise_for_status()
         data = response.json()
         
@@ -2427,6 +3983,12 @@ def biorxiv_api_fetch(doi: str) -> dict:
     return {}
 
 def universal_doi_lookup(doi: str) -> dict:
+    """Universal DOI lookup; the result is memoized per run (see DoiResolver)."""
+    if not doi:
+        return {}
+    return DOI_RESOLVER.lookup(doi)
+
+def _universal_doi_lookup(doi: str) -> dict:
     """Universal DOI lookup that works for any publisher using Crossref API.
     
     Args:
@@ -2457,13 +4019,8 @@ def universal_doi_lookup(doi: str) -> dict:
         if not crossref_data:
             return {}
         
-        # Try to get abstract from Crossref (some publishers provide it)
-        url = f"https://api.crossref.org/works/{doi}"
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        full_data = response.json()
-        
-        work = full_data.get("message", {})
+        # Abstract from the same Crossref work record (some publishers provide it)
+        work = DOI_RESOLVER.crossref_work(doi)
         abstract = work.get("abstract", "")
         
         # Clean HTML tags from abstract if present
@@ -2578,7 +4135,7 @@ def fetch_url_and_guess_pdf(url: str) -> tuple[bool, str]:
         if 'biorxiv.org' in url.lower():
             url = optimize_biorxiv_url(url)
         
-        r = requests.get(url, timeout=45, allow_redirects=True)
+        r = get_http_client().get(url, timeout=45)
         r.raise_for_status()
         ctype = r.headers.get("content-type", "").lower()
         content = r.content
@@ -2822,7 +4379,7 @@ def extract_metadata_from_pdf_text(pdf_text: str) -> dict:
 def google_search_fallback(query: str):
     """Very light fallback via Google Custom Search (requires valid key & cx)."""
     try:
-        r = requests.get(
+        r = get_http_client().get(
             "https://www.googleapis.com/customsearch/v1",
             params={
                 "q": query,
@@ -2884,6 +4441,10 @@ if execute_search:
     # Clear the flag to prevent repeated execution
     if 'should_execute_search' in st.session_state:
         st.session_state.should_execute_search = False
+    if openai_client and llm_tokens_left() == 0:
+        st.error("🧾 Your daily AI token budget is used up, so papers cannot be rated. "
+                 "Try again tomorrow or ask an admin to raise it.")
+        st.stop()
     progress = st.progress(0)
     status = st.empty()
 
@@ -2955,28 +4516,23 @@ if execute_search:
                             
                             if fallback_pmids:
                                 st.success(f"✅ Fallback found {len(fallback_pmids)} papers!")
-                                # Convert PMIDs to your paper format
-                                for pmid in fallback_pmids:
-                                    try:
-                                        metadata = fetch_pubmed_metadata(pmid)
-                                        if metadata:
-                                            pubmed_results.append({
-                                                "title": metadata.get("Title", ""),
-                                                "url": metadata.get("URL", f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"),
-                                                "authors_info": metadata.get("Authors", ""),
-                                                "snippet": metadata.get("Abstract", "")[:300] + "..." if metadata.get("Abstract") else "",
-                                                "pdf_url": "",
-                                                "doi": metadata.get("DOI"),
-                                                "venue": metadata.get("Journal", ""),
-                                                "year": metadata.get("Year"),
-                                                "citationCount": None,
-                                                "publicationDate": metadata.get("Year"),
-                                                "publicationTypes": metadata.get("PublicationType", []),
-                                                "pmid": pmid
-                                            })
-                                    except Exception as e:
-                                        st.warning(f"Could not fetch metadata for PMID {pmid}: {e}")
-                                        continue
+                                # Convert PMIDs to your paper format (batched ESummary/EFetch)
+                                for metadata in fetch_pubmed_metadata_batch(fallback_pmids):
+                                    pmid = metadata["PMID"]
+                                    pubmed_results.append({
+                                        "title": metadata.get("Title", ""),
+                                        "url": metadata.get("URL", f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"),
+                                        "authors_info": metadata.get("Authors", ""),
+                                        "snippet": metadata.get("Abstract", "")[:300] + "..." if metadata.get("Abstract") else "",
+                                        "pdf_url": "",
+                                        "doi": metadata.get("DOI"),
+                                        "venue": metadata.get("Journal", ""),
+                                        "year": metadata.get("Year"),
+                                        "citationCount": None,
+                                        "publicationDate": metadata.get("Year"),
+                                        "publicationTypes": metadata.get("PublicationType", []),
+                                        "pmid": pmid
+                                    })
                             else:
                                 st.warning("❌ Both API and fallback methods returned no results")
                         
@@ -2994,15 +4550,28 @@ if execute_search:
         # 2) PASTE CITATION / TEXT (using edited references from workflow)
         elif search_mode == "Paste citation / page text":
             status.info("🔎 Enriching edited references…")
-            collected = []
-            
-            for i, ref in enumerate(edited_refs):
-                title, authors, year, doi = ref.get("title"), ref.get("authors"), ref.get("year"), ref.get("doi")
-                enriched = None
 
-                # 1. DOI → Semantic Scholar enrichment
-                if doi:
-                    enriched = semantic_scholar_by_doi(doi)
+            # 1. DOI → Semantic Scholar enrichment, resolved in bulk
+            ref_dois = [ref.get("doi") for ref in edited_refs if ref.get("doi")]
+            s2_by_doi = semantic_scholar_batch_by_doi(ref_dois) if ref_dois else {}
+            progress.progress(0.30)
+
+            def edited_ref_as_paper(ref):
+                authors = ref.get("authors")
+                return {
+                    "title": ref.get("title"),
+                    "authors_info": ", ".join(authors) if isinstance(authors, list) else (authors or ""),
+                    "snippet": "",
+                    "url": "",
+                    "pdf_url": "",
+                    "doi": ref.get("doi"),
+                    "year": ref.get("year"),
+                    "venue": None
+                }
+
+            def enrich_ref(ref):
+                title, doi = ref.get("title"), ref.get("doi")
+                enriched = s2_by_doi.get(doi.strip().lower()) if doi else None
 
                 # 2. PubMed by title
                 if not enriched and title:
@@ -3015,21 +4584,13 @@ if execute_search:
                     enriched = gg[0] if gg else None
 
                 # 4. If still nothing → use edited metadata
-                if not enriched:
-                    enriched = {
-                        "title": title,
-                        "authors_info": ", ".join(authors) if isinstance(authors, list) else (authors or ""),
-                        "snippet": "",
-                        "url": "",
-                        "pdf_url": "",
-                        "doi": doi,
-                        "year": year,
-                        "venue": None
-                    }
-                collected.append(enriched)
-                
-                # Update progress
-                progress.progress(0.30 + (i / len(edited_refs)) * 0.30)
+                return enriched or edited_ref_as_paper(ref)
+
+            # Misses fan out to the per-title fallbacks concurrently; order is preserved
+            collected = []
+            for i, (ref, enriched, error) in enumerate(iter_in_threads(enrich_ref, edited_refs, analysis_workers)):
+                collected.append(enriched if error is None else edited_ref_as_paper(ref))
+                progress.progress(0.30 + ((i + 1) / len(edited_refs)) * 0.30)
 
             papers_meta = collected
             progress.progress(0.60)
@@ -3195,6 +4756,16 @@ if execute_search:
             st.caption("Try tweaking the query or switching modes. Even librarians have off days.")
             st.stop()
 
+        # Local relevance pre-filter: only the best profile matches go to the LLM
+        skipped_papers = []
+        if search_mode == "Keyword Search" and prefilter_enabled and len(papers_meta) > 1:
+            pre_scores = bm25_prescores(papers_meta, *_rating_preferences())
+            keep = prefilter_keep(pre_scores, prefilter_top_k, PREFILTER_MIN_SCORE)
+            for paper, pre_score in zip(papers_meta, pre_scores):
+                paper["pre_score"] = float(pre_score)
+            skipped_papers = [paper for paper, kept in zip(papers_meta, keep) if not kept]
+            papers_meta = [paper for paper, kept in zip(papers_meta, keep) if kept]
+
         # Render + Gemini analysis (UNIFIED)
         status.info("🧪 Analyzing and annotating…")
         progress.progress(0.75)
@@ -3202,17 +4773,95 @@ if execute_search:
         # Map Zotero threshold: score3 (0..3)
         zotero_threshold_score3 = min(3, max(0, int(min_score3)))
 
-        for i, paper in enumerate(papers_meta):
+        # pyzotero clients are not thread-safe, and duplicate check + create must be atomic
+        zotero_lock = threading.Lock()
+
+        # Get user's research area classification for better rating
+        query_classification = st.session_state.get('query_classification', 1)  # Default to general
+        # Use professor's rating system if we have the classification
+        use_prof_rating = bool(query_classification and hasattr(st.session_state, 'query_classification'))
+
+        def prepare_paper(paper):
+            """PDF text, user query context and professor-format metadata needed to rate a paper."""
+            pdf_url = paper.get("pdf_url", "")
+            url = paper.get("url", "")
+            snippet = paper.get("snippet", "")
+            year = paper.get("year")
+            # Pull PDF text when useful
+            pdf_text = extract_pdf_text(pdf_url or url)
+            prof_metadata = {
+                "Title": paper.get("title", ""),
+                "Authors": paper.get("authors_info", ""),
+                "Journal": paper.get("venue") or "Unknown",
+                "Year": str(year) if year else "Unknown",
+                "Abstract": snippet or pdf_text[:500] if pdf_text else "",
+                "DOI": paper.get("doi") or ""
+            }
+            # Determine user query context  
+            if search_mode == 'Keyword Search':
+                user_query = st.session_state.query_metadata.get('original_input', '')
+            elif search_mode == 'Paste citation / page text':
+                user_query = paper.get("title", "") or "extracted reference"
+            else:
+                user_query = url_or_doi
+            return {"pdf_text": pdf_text, "prof_metadata": prof_metadata, "user_query": user_query}
+
+        def bulk_prompt(paper, prepared):
+            """The exact prompt the interactive path would send, so replies double as cache entries."""
+            if use_prof_rating:
+                return rating_prompt(prepared["prof_metadata"])
+            return annotation_prompt(paper.get("title", ""), paper.get("authors_info", ""), paper.get("snippet", ""),
+                                     prepared["pdf_text"], paper.get("url", ""), prepared["user_query"])
+
+        def analyze_batch(batch):
+            """
+            Rate a batch of (paper, prepared) pairs with one LLM request, then finish each
+            paper. Papers already rated by a bulk job are skipped; papers missing from the
+            batch reply are rated individually.
+            Returns one (result, error) pair per paper so a bad paper never sinks its batch.
+            """
+            ratings = [prepared.get("rating") for _, prepared in batch]
+            pending = [k for k, rating in enumerate(ratings) if rating is None]
+            if use_prof_rating and len(pending) > 1:
+                try:
+                    batch_ratings = rate_publications_batch(
+                        [batch[k][1]["prof_metadata"] for k in pending], query_classification
+                    )
+                    for k, rating in zip(pending, batch_ratings):
+                        ratings[k] = rating
+                except Exception as e:
+                    print(f"Batch rating failed, rating papers one by one: {e}")
+            outcomes = []
+            for (paper, prepared), rating in zip(batch, ratings):
+                try:
+                    outcomes.append((analyze_paper(paper, prepared, rating), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+            return outcomes
+
+        def analyze_paper(paper, prepared, rating=None):
+            """
+            Network/LLM half of the per-paper pipeline: AI rating (unless already rated by
+            a batch or bulk job), Zotero save. Runs on a worker thread and only collects what should
+            be shown; rendering happens in the loop below, in the original paper order.
+            """
             title = paper.get("title", "")
             url = paper.get("url", "")
             authors_info = paper.get("authors_info", "")
             snippet = paper.get("snippet", "")
-            pdf_url = paper.get("pdf_url", "")
             doi = paper.get("doi")
             venue = paper.get("venue")
             year = paper.get("year")
+            result = {
+                "abstract_ai": "",
+                "tags": [],
+                "score3": 0,
+                "institutional_links": [],
+                "ai_messages": [],      # (st method name, text) shown before the AI output
+                "zotero_messages": [],  # (st method name, text) shown after the AI output
+            }
 
-            # Store comprehensive paper metadata in session state for Zotero enhancement
+            # Comprehensive paper metadata for Zotero enhancement
             comprehensive_metadata = {
                 'citationCount': paper.get('citationCount'),
                 'publicationDate': paper.get('publicationDate'), 
@@ -3221,117 +4870,78 @@ if execute_search:
                 'year': year,
                 'source_data': paper  # Store the complete paper object
             }
-            st.session_state.current_paper_metadata = comprehensive_metadata
 
-            # Pull PDF text when useful
-            pdf_text = extract_pdf_text(pdf_url or url)
+            pdf_text = prepared["pdf_text"]
+            user_query = prepared["user_query"]
+            # Streaming mode: the reply goes to the paper's LiveText as it arrives
+            on_text = prepared["live"].append if "live" in prepared else None
 
-            with st.expander(f"📄 {title or 'Untitled'}", expanded=True):
-                if authors_info:
-                    st.markdown(f"**Authors:** {authors_info}")
-                if venue or year:
-                    st.markdown(f"**Venue / Year:** {venue or '—'} — {year or '—'}")
-                if snippet:
-                    st.markdown(f"**Abstract (source):** {snippet}")
+            try:
+                if use_prof_rating:
+                    # Get professor's rating (from the batch request when available)
+                    if rating is None and on_text is not None:
+                        rating_text = rate_publication(prepared["prof_metadata"], query_classification, on_text)
+                        rating = parse_streamed_rating(rating_text)
+                    elif rating is None:
+                        rating_text = rate_publication(prepared["prof_metadata"], query_classification)
+                        rating = parse_gpt4_output(rating_text)
+                    score_prof, keywords_prof, note_prof = rating
+
+                    # Generate institutional links
+                    result["institutional_links"] = remotexs_links(doi) if doi else []
+
+                    # Use professor's results as primary, with fallback to your system
+                    result["tags"] = keywords_prof if keywords_prof else []
+                    result["score3"] = score_prof
+                    result["abstract_ai"] = note_prof
+
+                elif rating is not None:
+                    # Annotation from the bulk job, same shape as a rating
+                    result["score3"], result["tags"], result["abstract_ai"] = rating
 
-                # Enhanced AI annotation with professor's GPT-5-mini rating system
-                
-                # Determine user query context  
-                if search_mode == 'Keyword Search':
-                    user_query = st.session_state.query_metadata.get('original_input', '')
-                elif search_mode == 'Paste citation / page text':
-                    user_query = title or "extracted reference"
                 else:
-                    user_query = url_or_doi
-                
+                    # Fallback to your existing OpenAI system
+                    result["abstract_ai"], result["tags"], result["score3"] = openai_annotate_paper(
+                        title, authors_info, snippet, pdf_text, url, user_query, on_text
+                    ) if OPENAI_API_KEY else ("", [], 0)
+
+            except Exception as e:
+                result["ai_messages"].append(("error", f"Enhanced AI rating error: {e}"))
+                # Fallback to your existing system
                 try:
-                    # Get user's research area classification for better rating
-                    query_classification = st.session_state.get('query_classification', 1)  # Default to general
-                    
-                    # Use professor's rating system if we have the classification
-                    if query_classification and hasattr(st.session_state, 'query_classification'):
-                        # Removed: st.info("🧠 Using Professor's Enhanced GPT-5-mini Rating System")
-                        
-                        # Create metadata dict in professor's format
-                        prof_metadata = {
-                            "Title": title,
-                            "Authors": authors_info,
-                            "Journal": venue or "Unknown",
-                            "Year": str(year) if year else "Unknown",
-                            "Abstract": snippet or pdf_text[:500] if pdf_text else "",
-                            "DOI": doi or ""
-                        }
-                        
-                        # Get professor's rating
-                        rating_text = rate_publication(prof_metadata, query_classification)
-                        score_prof, keywords_prof, note_prof = parse_gpt4_output(rating_text)
-                        
-                        # Generate institutional links
-                        institutional_links = remotexs_links(doi) if doi else []
-                        
-                        # Generate institutional links (display them here)
-                        if institutional_links:
-                            st.markdown("**🏫 Institutional Access Links:**")
-                            for description, link in institutional_links:
-                                st.markdown(f"[{description}]({link})")
-                        # Use professor's results as primary, with fallback to your system
-                        tags = keywords_prof if keywords_prof else []
-                        score3 = score_prof
-                        abstract_ai = note_prof
-                        
-                    else:
-                        # Fallback to your existing OpenAI system
-                        abstract_ai, tags, score3 = openai_annotate_paper(
-                            title, authors_info, snippet, pdf_text, url, user_query
-                        ) if OPENAI_API_KEY else ("", [], 0)
-                        
-                except Exception as e:
-                    st.error(f"Enhanced AI rating error: {e}")
-                    # Fallback to your existing system
-                    try:
-                        abstract_ai, tags, score3 = openai_annotate_paper(
-                            title, authors_info, snippet, pdf_text, url, user_query
-                        ) if OPENAI_API_KEY else ("", [], 0)
-                    except Exception as e2:
-                        st.error(f"OpenAI API error: {e2}")
-                        abstract_ai, tags, score3 = "", [], 0
-
-                # Only display tags, abstract, and AI relevance once (after fallback/primary logic)
-                if abstract_ai:
-                    st.markdown("**Abstract (AI):**")
-                    st.write(abstract_ai)
-                if tags:
-                    display_tags = normalize_tags(tags)
-                    st.markdown("**🏷️ Tags:** " + ", ".join(display_tags))
-                st.markdown(f"**AI Relevance (0-3):** `{score3}`")
-
-                # Zotero save with enhanced metadata extraction from all sources  
-                # Allow saving to default library (root) when user_zotero_collection is empty
-                if add_to_zotero and zot and (score3 >= zotero_threshold_score3):
-                    # Normalize tags to ensure consistent format across all modes
-                    normalized_tags = normalize_tags(tags or [])
-                    
+                    result["abstract_ai"], result["tags"], result["score3"] = openai_annotate_paper(
+                        title, authors_info, snippet, pdf_text, url, user_query
+                    ) if OPENAI_API_KEY else ("", [], 0)
+                except Exception as e2:
+                    result["ai_messages"].append(("error", f"OpenAI API error: {e2}"))
+                    result["abstract_ai"], result["tags"], result["score3"] = "", [], 0
+
+            tags, score3, abstract_ai = result["tags"], result["score3"], result["abstract_ai"]
+
+            # Zotero save with enhanced metadata extraction from all sources  
+            # Allow saving to default library (root) when user_zotero_collection is empty
+            if add_to_zotero and zot and (score3 >= zotero_threshold_score3):
+                messages = result["zotero_messages"]
+
+                # Normalize tags to ensure consistent format across all modes
+                normalized_tags = normalize_tags(tags or [])
+
+                # Collect comprehensive metadata from all available sources
+                doi_or_url = f"https://doi.org/{doi}" if doi else url
+                proxy_url = with_ntu_proxy(doi_or_url, style=1) or with_ntu_proxy(doi_or_url, style=2) or url
+
+                # Get enhanced metadata from Crossref if DOI available
+                crossref_data = crossref_enrich(doi) if doi else {}
+
+                # Get bioRxiv data if applicable
+                biorxiv_data = {}
+                if doi and doi.startswith("10.1101/"):
+                    biorxiv_data = biorxiv_api_fetch(doi)
+
+                with zotero_lock:
                     # Smart tag processing to reduce redundancy
                     processed_tags, tag_suggestions = smart_tag_processing(normalized_tags, zot)
-                    
-                    # Collect comprehensive metadata from all available sources
-                    doi_or_url = f"https://doi.org/{doi}" if doi else url
-                    proxy_url = with_ntu_proxy(doi_or_url, style=1) or with_ntu_proxy(doi_or_url, style=2) or url
-                    
-                    # Get enhanced metadata from Crossref if DOI available
-                    crossref_data = crossref_enrich(doi) if doi else {}
-                    
-                    # Get bioRxiv data if applicable
-                    biorxiv_data = {}
-                    if doi and doi.startswith("10.1101/"):
-                        biorxiv_data = biorxiv_api_fetch(doi)
-                    
-                    # Prepare semantic scholar data from current metadata
-                    semantic_scholar_data = {}
-                    if hasattr(st.session_state, 'current_paper_metadata'):
-                        # This would be set during search processing if available
-                        semantic_scholar_data = getattr(st.session_state, 'current_paper_metadata', {})
-                    
+
                     # Create comprehensive Zotero item
                     item = create_enhanced_zotero_item(
                         title=title,
@@ -3344,7 +4954,7 @@ if execute_search:
                         venue=venue,
                         crossref_data=crossref_data,
                         biorxiv_data=biorxiv_data,
-                        semantic_scholar_data=semantic_scholar_data,
+                        semantic_scholar_data=comprehensive_metadata,
                         tags=processed_tags,
                         collection_id=user_zotero_collection,
                         proxy_url=proxy_url
@@ -3366,25 +4976,173 @@ if execute_search:
                                         duplicate_found = True
                                         break
                         except Exception as e:
-                            st.warning(f"⚠️ Zotero duplicate check failed: {e}")
+                            messages.append(("warning", f"⚠️ Zotero duplicate check failed: {e}"))
 
                     if duplicate_found and not allow_duplicates:
-                        st.warning(f"⚠️ Skipped Zotero save: duplicate found for '{title}'")
+                        messages.append(("warning", f"⚠️ Skipped Zotero save: duplicate found for '{title}'"))
                     else:
                         try:
-                            result = zot.create_items([item])
+                            zot.create_items([item])
                             if processed_tags != tags:
-                                st.success(f"✅ Added to Zotero with optimized tags (ai_score={score3})")
+                                messages.append(("success", f"✅ Added to Zotero with optimized tags (ai_score={score3})"))
                             else:
-                                st.success(f"✅ Added to Zotero (ai_score={score3})")
+                                messages.append(("success", f"✅ Added to Zotero (ai_score={score3})"))
                         except Exception as e:
-                            st.error(f"❌ Zotero error: {e}")
-                # If not saving to Zotero, no need to show debug reasons
+                            messages.append(("error", f"❌ Zotero error: {e}"))
+            return result
+
+        # PDFs are fetched concurrently first, so every paper has its abstract text
+        # before it is rated
+        prepared_papers = []
+        # Re-sending the current progress value is what lets Streamlit interrupt a stopped run
+        keep_alive = lambda: progress.progress(0.75 + 0.25 * (0.4 * len(prepared_papers) + 0.6 * rendered) / len(papers_meta))
+        rendered = 0
+        for j, (paper, prepared, error) in enumerate(iter_in_threads(prepare_paper, papers_meta, analysis_workers, on_tick=keep_alive)):
+            # On failure, rate from the source snippet alone (empty URLs skip the PDF fetch)
+            prepared_papers.append(prepared if error is None else prepare_paper({**paper, "pdf_url": "", "url": ""}))
+            progress.progress(0.75 + 0.10 * (j + 1) / len(papers_meta))
+
+        # Bulk mode: every paper's rating request goes out as one Batch API job; the
+        # replies are attached to the prepared papers and flow through the usual
+        # result + Zotero path below without further LLM calls
+        if bulk_annotation and openai_client:
+            status.info("📦 Submitting bulk annotation job (OpenAI Batch API)…")
+            prompts = {f"paper-{n}": bulk_prompt(paper, prepared)
+                       for n, (paper, prepared) in enumerate(zip(papers_meta, prepared_papers))}
+
+            def show_batch_progress(batch):
+                counts = batch.request_counts
+                done = (counts.completed + counts.failed) if counts else 0
+                status.info(f"📦 Bulk annotation {batch.status}: {done}/{len(prompts)} requests done…")
+
+            # Annotation prompts use the same structured-output format as the interactive call
+            create_kwargs = {} if use_prof_rating else {
+                "response_format": structured_response_format(ANNOTATION_SCHEMA, "paper_annotation")
+            }
+            try:
+                # Same model as the interactive route, so bulk replies double as its cache entries
+                replies = run_openai_batch(prompts, model=llm_route("rate" if use_prof_rating else "annotate")["models"][0],
+                                           use_profile=True, on_tick=show_batch_progress, **create_kwargs)
+            except Exception as e:
+                replies = {}
+                st.warning(f"⚠️ Bulk annotation failed, rating interactively instead: {e}")
+            for n, prepared in enumerate(prepared_papers):
+                reply = replies.get(f"paper-{n}")
+                if not reply:
+                    continue
+                if use_prof_rating:
+                    prepared["rating"] = parse_gpt4_output(reply)
+                else:
+                    data, errors = check_structured_reply(reply, ANNOTATION_SCHEMA)
+                    if errors:
+                        continue  # annotated interactively (with its corrective retry) instead
+                    abstract, tags, score3 = parse_annotation(data)
+                    prepared["rating"] = (score3, tags, abstract)
+            if replies:
+                st.info(f"📦 Bulk annotation returned {len(replies)}/{len(prompts)} ratings.")
+            status.info("🧪 Analyzing and annotating…")
+
+        # Streaming: one request per paper, each reply shown in its expander as it arrives
+        streaming = stream_ai_output and not bulk_annotation and bool(openai_client)
+        if streaming:
+            for prepared in prepared_papers:
+                prepared["live"] = LiveText()
+        live_paper = []  # LiveText of the paper whose expander is waiting for its result
+
+        def keep_alive_streaming():
+            keep_alive()
+            if live_paper:
+                live_paper[0].refresh()
+
+        # Papers are rated RATING_BATCH_SIZE per LLM request, batches run concurrently but
+        # are rendered strictly in order, each as soon as it and every batch before it finish
+        batch_size = max(1, RATING_BATCH_SIZE) if use_prof_rating and not streaming else 1
+        batches = list(_chunks(list(zip(papers_meta, prepared_papers)), batch_size))
+
+        def iter_analyzed_papers():
+            for batch, outcomes, error in iter_in_threads(analyze_batch, batches, analysis_workers,
+                                                          on_tick=keep_alive_streaming if streaming else keep_alive,
+                                                          tick=0.1 if streaming else 0.5):
+                for k, (paper, _) in enumerate(batch):
+                    yield (paper, *outcomes[k]) if error is None else (paper, None, error)
+
+        # Each expander is opened before its paper's result is awaited, so streamed text
+        # can be shown in it while the worker is still rating
+        analyzed = iter_analyzed_papers()
+        for i, (paper, prepared) in enumerate(zip(papers_meta, prepared_papers)):
+            title = paper.get("title", "")
+            authors_info = paper.get("authors_info", "")
+            snippet = paper.get("snippet", "")
+            venue = paper.get("venue")
+            year = paper.get("year")
+
+            with st.expander(f"📄 {title or 'Untitled'}", expanded=True):
+                if authors_info:
+                    st.markdown(f"**Authors:** {authors_info}")
+                if venue or year:
+                    st.markdown(f"**Venue / Year:** {venue or '—'} — {year or '—'}")
+                if snippet:
+                    st.markdown(f"**Abstract (source):** {snippet}")
+                if "pre_score" in paper:
+                    st.caption(f"🎯 Profile pre-score: {paper['pre_score']:.2f}")
+
+                live_view = st.empty()
+                if "live" in prepared:
+                    live_paper[:] = [prepared["live"]]
+                    prepared["live"].attach(live_view)
+                _, result, error = next(analyzed)
+                live_paper.clear()
+                live_view.empty()
+
+                if error is not None:
+                    st.error(f"❌ Analysis failed for this paper: {error}")
+                else:
+                    for kind, message in result["ai_messages"]:
+                        getattr(st, kind)(message)
+
+                    # Institutional links (professor's rating system only)
+                    if result["institutional_links"]:
+                        st.markdown("**🏫 Institutional Access Links:**")
+                        for description, link in result["institutional_links"]:
+                            st.markdown(f"[{description}]({link})")
+
+                    # Only display tags, abstract, and AI relevance once (after fallback/primary logic)
+                    if result["abstract_ai"]:
+                        st.markdown("**Abstract (AI):**")
+                        st.write(result["abstract_ai"])
+                    if result["tags"]:
+                        display_tags = normalize_tags(result["tags"])
+                        st.markdown("**🏷️ Tags:** " + ", ".join(display_tags))
+                    st.markdown(f"**AI Relevance (0-3):** `{result['score3']}`")
+
+                    for kind, message in result["zotero_messages"]:
+                        getattr(st, kind)(message)
+
+            rendered = i + 1
+            progress.progress(0.85 + 0.15 * rendered / len(papers_meta))
+
+        if skipped_papers:
+            with st.expander(f"⏭️ {len(skipped_papers)} papers skipped by the relevance pre-filter (not rated or saved)"):
+                for paper in sorted(skipped_papers, key=lambda p: -p["pre_score"]):
+                    link = paper.get("url") or (f"https://doi.org/{paper['doi']}" if paper.get("doi") else "")
+                    title = paper.get("title") or "Untitled"
+                    st.markdown(f"- `{paper['pre_score']:.2f}` " + (f"[{title}]({link})" if link else title))
 
         status.success("Done ✅")
         progress.progress(1.0)
+        run_usage = get_llm_usage().run_summary(LLM_RUN_ID)
+        if run_usage["calls"]:
+            st.caption(
+                f"🧾 AI usage for this search: {run_usage['calls']} calls ({run_usage['cached']} from cache), "
+                f"{run_usage['tokens']:,} tokens, ~${run_usage['cost']:.4f}"
+            )
+            debug_utils.log_info(f"Run {LLM_RUN_ID} ({llm_username()}): {run_usage}")
 
     finally:
+        # Run stopped or finished: abort LLM requests nobody will read
+        cancelled = LLM_CALLS.cancel()
+        if cancelled:
+            print(f"Cancelled {cancelled} outstanding LLM requests")
         # Clear status after a short delay to avoid lingering messages
         sleep(0.4)
         status.empty()
@@ -3438,63 +5196,6 @@ def is_admin():
 # PROFESSOR'S ALIGNED FUNCTIONS
 # ============================
 
-def what_is_requested(text_list):
-    """
-    Classify input text using GPT-5-mini to determine search intent.
-    Returns: (classification_int, classification_text)
-    1 = topic/keyword search, 2 = evolution research, 3 = chemistry research, 4 = PMIDs
-    """
-    try:
-        text = text_list[0] if isinstance(text_list, list) else str(text_list)
-        
-        # Check for PMIDs first
-        pmid_pattern = r'\b\d{8,}\b'
-        pmids_found = re.findall(pmid_pattern, text)
-        if len(pmids_found) >= 2:  # Multiple PMIDs found
-            return [4], ["PMID list"]
-            
-        prompt = f"""
-        Analyze this research query and classify it into one of these categories:
-        1. General topic/keyword search
-        2. Evolution/evolutionary biology research  
-        3. Physical chemistry/biochemistry research
-        4. PMID numbers (8+ digit numbers)
-        
-        Text: "{text}"
-        
-        Respond with just the number (1-4) and a brief classification.
-        Format: "Classification: X - Description"
-        """
-        
-        if not openai_client:
-            # Fallback if no OpenAI client available
-            return [1], ["General topic search"]
-            
-        response = openai_client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        result_text = response.choices[0].message.content.strip()
-        
-        # Parse response
-        if "Classification: 1" in result_text:
-            return [1], ["General topic search"]
-        elif "Classification: 2" in result_text:
-            return [2], ["Evolution research"]
-        elif "Classification: 3" in result_text:
-            return [3], ["Physical chemistry research"]
-        elif "Classification: 4" in result_text:
-            return [4], ["PMID list"]
-        else:
-            return [1], ["General topic search"]  # Default fallback
-            
-    except Exception as e:
-        st.warning(f"Classification error: {e}")
-        return [1], ["General topic search"]
-
 def get_zotero_group_for_research_area(research_area):
     """
     Map research area to specific Zotero group/collection IDs
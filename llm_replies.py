@@ -0,0 +1,105 @@
+import json
+import re
+
+# Parsing and validation of LLM replies (structured-output JSON and streamed plain text).
+# Kept free of Streamlit so it can be imported (and tested) on its own.
+
+_JSON_TYPES = {
+    "object": dict, "array": list, "string": str, "integer": int,
+    "number": (int, float), "boolean": bool, "null": type(None),
+}
+
+def validate_json(value, schema: dict, path: str = "$") -> list:
+    """
+    Check value against the subset of JSON Schema the app's schemas use (type, enum, minimum/maximum,
+    properties/required/additionalProperties, items). Returns a list of error strings.
+    """
+    types = schema.get("type")
+    if types:
+        types = [types] if isinstance(types, str) else types
+        # bool is an int subclass in Python but not a JSON integer/number
+        if not any(isinstance(value, _JSON_TYPES[t]) and not (isinstance(value, bool) and t in ("integer", "number"))
+                   for t in types):
+            return [f"{path}: expected {' or '.join(types)}, got {type(value).__name__}"]
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: {value} is below the minimum {schema['minimum']}")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: {value} is above the maximum {schema['maximum']}")
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: missing required key '{key}'")
+        for key, item in value.items():
+            if key in properties:
+                errors.extend(validate_json(item, properties[key], f"{path}.{key}"))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected key '{key}'")
+    if isinstance(value, list) and "items" in schema:
+        for n, item in enumerate(value):
+            errors.extend(validate_json(item, schema["items"], f"{path}[{n}]"))
+    return errors
+
+def check_structured_reply(text: str, schema: dict):
+    """(data, errors) for a structured-output reply; data is None when it is not JSON at all."""
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        return None, [f"$: not valid JSON ({e})"]
+    return data, validate_json(data, schema)
+
+def structured_response_format(schema: dict, name: str) -> dict:
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+def ratings_by_paper(data, expected: int) -> list:
+    """
+    Batch rating reply {"ratings": [{"id", "score", "tags", "explanation"}, ...]} (already
+    schema-checked) -> one rating per paper in prompt order, where id is the paper's 1-based
+    number. Papers the reply skipped come back as None; out-of-range and repeated ids are ignored.
+    """
+    ratings = [None] * expected
+    for rating in (data or {}).get("ratings", []):
+        index = rating["id"] - 1
+        if 0 <= index < expected and ratings[index] is None:
+            ratings[index] = rating
+    return ratings
+
+_STREAM_TAIL_RE = re.compile(r"^\s*(Score|Tags)\s*:", re.M)
+_STREAM_BODY_RE = re.compile(r"^\s*(?:Abstract|Note)\s*:\s*", re.I | re.M)
+
+def _streamed_tags(value: str) -> list:
+    """Tags line value, "[a, b]" or "a, b" -> ["a", "b"]; an unclosed "[" (cut-off reply) gives []."""
+    value = value.strip()
+    if value.startswith("["):
+        if "]" not in value:
+            return []
+        value = value[1:value.index("]")]
+    return [t.strip().strip("'\"") for t in value.split(",") if t.strip().strip("'\"")]
+
+def parse_streamed_reply(text: str):
+    """
+    Split a streamed reply ("Abstract:"/"Note:" body, then "Score:" and "Tags:" lines)
+    into (body, score or None, tags). Also works on partial text: the body is whatever
+    has arrived before the first Score/Tags line. Replies that put the body last
+    (Score/Tags/Note, as the canned fallbacks do) are read too.
+    """
+    text = text or ""
+    tail = _STREAM_TAIL_RE.search(text)
+    body = text[:tail.start()] if tail else text
+    label = _STREAM_BODY_RE.match(body)
+    body = body[label.end():].strip() if label else body.strip()
+    if not body and tail:
+        late = _STREAM_BODY_RE.search(text, tail.start())
+        body = _STREAM_TAIL_RE.split(text[late.end():])[0].strip() if late else ""
+    score = re.search(r"^\s*Score:\s*\[?(\d+)", text, re.M)
+    tags = re.search(r"^\s*Tags:[ \t]*(.*)$", text, re.M)
+    return body, int(score.group(1)) if score else None, _streamed_tags(tags.group(1)) if tags else []
+
+def streamed_reply_complete(text: str) -> bool:
+    """True when a streamed reply has its body, score and tags, i.e. was not cut off (safe to cache)."""
+    body, score, tags = parse_streamed_reply(text)
+    return bool(body) and score is not None and bool(tags)
@@ -0,0 +1,277 @@
+"""
+Local stand-in for the parts of the OpenAI API the lab app uses, for offline testing.
+
+Serves /v1/models, /v1/chat/completions (also streamed), /v1/files and /v1/batches with
+canned but well-formed replies (schema-shaped when a json_schema response_format is
+requested), so bulk annotation (Batch API), the interactive rating path and streaming
+can be exercised end to end without a network connection or API credits.
+
+Usage:
+    python openai_batch_stub.py --port 8787 --batch-seconds 5
+
+then in .streamlit/secrets.toml:
+    OPENAI_BASE_URL = "http://127.0.0.1:8787/v1"
+    OPENAI_API_KEY = "stub"          # any value is accepted
+    BATCH_POLL_SECONDS = 1
+"""
+import argparse
+import json
+import re
+import threading
+import uuid
+import zlib
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+
+FILES = {}    # file id -> {"meta": {...}, "content": bytes}
+BATCHES = {}  # batch id -> batch object (dict)
+LOCK = threading.Lock()
+BATCH_SECONDS = 5.0
+STREAM_DELAY = 0.03  # seconds between streamed chunks
+
+
+def _new_id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def _stub_score(prompt):
+    """Deterministic 0..3 score so the same paper always gets the same rating."""
+    return zlib.crc32(prompt.encode("utf-8")) % 4
+
+
+def stub_reply(prompt):
+    """Reply in whichever format the app's prompt asks for."""
+    score = _stub_score(prompt)
+    tags = ["aRT-stub-topic", "aTa-stub-technique", "aTy-Experimental", "aMe-stub-method"]
+    streamed = re.search(r"EXACT plain-text format[^\n]*\n(\w+):", prompt)
+    if streamed:
+        body = ("Stub rating for offline testing." if streamed.group(1) == "Note" else
+                "Stub abstract generated offline. It only checks the streaming plumbing, one word at a time.")
+        return f"{streamed.group(1)}: {body}\nScore: {score}\nTags: [{', '.join(tags + [f'ai-score_{score}'])}]"
+    if "Provide rating in this EXACT format" in prompt:
+        return f"Score: {score}\nTags: [{', '.join(tags + [f'ai-score_{score}'])}]\nNote: Stub rating for offline testing."
+    if "exactly one object per paper" in prompt:
+        ids = [int(n) for n in re.findall(r"^\s*\[(\d+)\]\s*$", prompt, re.M)]
+        return json.dumps({"ratings": [
+            {"id": n, "score": (score + n) % 4, "tags": tags, "explanation": "Stub rating for offline testing."}
+            for n in ids
+        ]})
+    if '"score3"' in prompt:
+        return json.dumps({
+            "abstract": "Stub abstract generated offline. It only checks the annotation plumbing.",
+            "tags": tags + [f"ai score-{score}"],
+            "score3": score,
+        })
+    return "{}"
+
+
+def example_from_schema(schema):
+    """Smallest instance of a structured-output JSON schema (arrays get one item)."""
+    types = schema.get("type", "object")
+    kind = next((t for t in ([types] if isinstance(types, str) else types) if t != "null"), "null")
+    if kind == "object":
+        return {key: example_from_schema(sub) for key, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [example_from_schema(schema.get("items", {"type": "string"}))]
+    if kind in ("integer", "number"):
+        return schema.get("minimum", 0)
+    return {"string": "stub", "boolean": False}.get(kind)
+
+
+def chat_completion(body):
+    prompt = "\n".join(m.get("content", "") for m in body.get("messages", []) if isinstance(m.get("content"), str))
+    content = stub_reply(prompt)
+    response_format = body.get("response_format") or {}
+    if content == "{}" and response_format.get("type") == "json_schema":
+        content = json.dumps(example_from_schema(response_format["json_schema"]["schema"]))
+    return {
+        "id": _new_id("chatcmpl"),
+        "object": "chat.completion",
+        "created": int(time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                  "total_tokens": (len(prompt) + len(content)) // 4},
+    }
+
+
+def completion_chunks(completion, include_usage=False):
+    """Split a chat.completion into the chat.completion.chunk events of a streamed reply."""
+    base = {"id": completion["id"], "object": "chat.completion.chunk",
+            "created": completion["created"], "model": completion["model"]}
+    content = completion["choices"][0]["message"]["content"]
+    yield {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+    for piece in re.findall(r"\S+\s*|\s+", content):
+        yield {**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    if include_usage:
+        yield {**base, "choices": [], "usage": completion["usage"]}
+
+
+def _file_meta(file_id, filename, size, purpose):
+    return {"id": file_id, "object": "file", "bytes": size, "created_at": int(time()),
+            "filename": filename, "purpose": purpose, "status": "processed"}
+
+
+def _store_file(filename, content, purpose):
+    file_id = _new_id("file")
+    FILES[file_id] = {"meta": _file_meta(file_id, filename, len(content), purpose), "content": content}
+    return FILES[file_id]["meta"]
+
+
+def _run_batch(batch):
+    """Answer every request line of the input file and attach output/error files."""
+    output, errors = [], []
+    for line in FILES[batch["input_file_id"]]["content"].decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if row.get("url") != "/v1/chat/completions":
+            errors.append({"id": _new_id("batch_req"), "custom_id": row.get("custom_id"), "response": None,
+                           "error": {"code": "invalid_url", "message": f"unsupported url {row.get('url')}"}})
+            continue
+        output.append({"id": _new_id("batch_req"), "custom_id": row.get("custom_id"), "error": None,
+                       "response": {"status_code": 200, "request_id": _new_id("req"),
+                                    "body": chat_completion(row.get("body", {}))}})
+    jsonl = lambda rows: ("".join(json.dumps(r) + "\n" for r in rows)).encode("utf-8")
+    batch["output_file_id"] = _store_file("batch_output.jsonl", jsonl(output), "batch_output")["id"]
+    if errors:
+        batch["error_file_id"] = _store_file("batch_errors.jsonl", jsonl(errors), "batch_output")["id"]
+    batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output), "failed": len(errors)}
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time())
+
+
+def _refresh(batch):
+    """Batches sit in_progress for BATCH_SECONDS, then complete on the next poll."""
+    if batch["status"] in ("validating", "in_progress"):
+        if time() - batch["created_at"] >= BATCH_SECONDS:
+            _run_batch(batch)
+        else:
+            batch["status"] = "in_progress"
+            batch.setdefault("in_progress_at", int(time()))
+    return batch
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "OpenAIBatchStub/1.0"
+
+    def _send(self, status, payload=None, raw=None, content_type="application/json"):
+        body = raw if raw is not None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, completion, include_usage):
+        """Server-sent events, one word per chunk; HTTP/1.0 so closing the connection ends the body."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for chunk in completion_chunks(completion, include_usage):
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            sleep(STREAM_DELAY)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _not_found(self):
+        self._send(404, {"error": {"message": f"No route for {self.command} {self.path}", "type": "invalid_request_error"}})
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        with LOCK:
+            if path == "/v1/models":
+                return self._send(200, {"object": "list", "data": [{"id": model, "object": "model", "owned_by": "stub"}
+                                                                 for model in ("gpt-5-nano", "gpt-5-mini", "gpt-5")]})
+            m = re.fullmatch(r"/v1/files/([\w-]+)(/content)?", path)
+            if m and m.group(1) in FILES:
+                entry = FILES[m.group(1)]
+                if m.group(2):
+                    return self._send(200, raw=entry["content"], content_type="application/jsonl")
+                return self._send(200, entry["meta"])
+            m = re.fullmatch(r"/v1/batches/([\w-]+)", path)
+            if m and m.group(1) in BATCHES:
+                return self._send(200, _refresh(BATCHES[m.group(1)]))
+        self._not_found()
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        body = self._body()
+        if path == "/v1/chat/completions":
+            request = json.loads(body or b"{}")
+            if request.get("stream"):
+                # Streamed outside the lock so concurrent streams interleave like the real API
+                include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+                return self._send_stream(chat_completion(request), include_usage)
+        with LOCK:
+            if path == "/v1/chat/completions":
+                return self._send(200, chat_completion(json.loads(body or b"{}")))
+            if path == "/v1/files":
+                # multipart/form-data with "file" and "purpose" fields
+                head = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("latin-1")
+                message = BytesParser(policy=HTTP).parsebytes(head + body)
+                fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+                if "file" not in fields:
+                    return self._send(400, {"error": {"message": "missing file", "type": "invalid_request_error"}})
+                purpose = (fields["purpose"].get_content() if "purpose" in fields else "batch").strip()
+                return self._send(200, _store_file(fields["file"].get_filename() or "upload.jsonl",
+                                                   fields["file"].get_payload(decode=True), purpose))
+            if path == "/v1/batches":
+                req = json.loads(body or b"{}")
+                if req.get("input_file_id") not in FILES:
+                    return self._send(400, {"error": {"message": "unknown input_file_id", "type": "invalid_request_error"}})
+                batch_id = _new_id("batch")
+                BATCHES[batch_id] = {
+                    "id": batch_id, "object": "batch", "endpoint": req.get("endpoint"),
+                    "input_file_id": req["input_file_id"], "completion_window": req.get("completion_window", "24h"),
+                    "status": "validating", "created_at": int(time()), "output_file_id": None, "error_file_id": None,
+                    "request_counts": {"total": 0, "completed": 0, "failed": 0}, "metadata": req.get("metadata"),
+                }
+                return self._send(200, BATCHES[batch_id])
+            m = re.fullmatch(r"/v1/batches/([\w-]+)/cancel", path)
+            if m and m.group(1) in BATCHES:
+                batch = BATCHES[m.group(1)]
+                if batch["status"] not in ("completed", "failed", "expired"):
+                    batch["status"] = "cancelled"
+                    batch["cancelled_at"] = int(time())
+                return self._send(200, batch)
+        self._not_found()
+
+    def log_message(self, fmt, *args):
+        print(f"[stub] {self.address_string()} {fmt % args}")
+
+
+def main():
+    global BATCH_SECONDS, STREAM_DELAY
+    parser = argparse.ArgumentParser(description="Offline stub for the OpenAI chat/files/batches endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--batch-seconds", type=float, default=BATCH_SECONDS,
+                        help="how long a batch stays in_progress before completing")
+    parser.add_argument("--stream-delay", type=float, default=STREAM_DELAY,
+                        help="seconds between chunks of a streamed chat completion")
+    args = parser.parse_args()
+    BATCH_SECONDS = args.batch_seconds
+    STREAM_DELAY = args.stream_delay
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"OpenAI stub listening on http://{args.host}:{args.port}/v1 (batches complete after {BATCH_SECONDS}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
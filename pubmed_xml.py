@@ -0,0 +1,71 @@
+import io
+import xml.etree.ElementTree as ET
+
+# Streaming parser for PubMed EFetch XML (PubmedArticleSet).
+# Kept free of Streamlit so it can be imported (and tested) on its own.
+
+class _ChunkReader(io.RawIOBase):
+    """Read-only file object over an iterable of byte chunks (feeds ET.iterparse)."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(buf), len(self._pending))
+        buf[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+# Record kinds EFetch returns -> (PMID path, ArticleIdList paths). The id lists are named
+# explicitly: ReferenceList entries carry their own ArticleIds (the cited papers' DOIs).
+_ARTICLE_PATHS = {
+    "PubmedArticle": ("MedlineCitation/PMID", ["PubmedData/ArticleIdList"]),
+    # NCBI Bookshelf chapters and reports
+    "PubmedBookArticle": ("BookDocument/PMID", ["BookDocument/ArticleIdList", "PubmedBookData/ArticleIdList"]),
+}
+
+def _article_record(elem) -> dict:
+    """{"pmid", "abstract", "doi"} of one PubmedArticle / PubmedBookArticle element."""
+    # itertext() keeps the text inside inline markup (<i>, <sup>, <sub>) and after it
+    abstract = " ".join(
+        " ".join("".join(n.itertext()).split()) for n in elem.findall(".//Abstract/AbstractText")
+    ).strip()
+    pmid_path, id_list_paths = _ARTICLE_PATHS[elem.tag]
+    doi = None
+    for article_id in (a for path in id_list_paths for a in elem.findall(f"{path}/ArticleId")):
+        if article_id.get("IdType") == "doi":
+            doi = (article_id.text or "").strip() or None
+            break
+    pmid = (elem.findtext(pmid_path) or "").strip() or None
+    return {"pmid": pmid, "abstract": abstract, "doi": doi}
+
+def iter_pubmed_articles(chunks):
+    """
+    Incrementally parse an EFetch PubmedArticleSet from an iterable of raw byte chunks.
+    Yields {"pmid", "abstract", "doi"} per PubmedArticle or PubmedBookArticle and drops
+    every element once it has been read, so memory stays flat however many ids are fetched.
+    """
+    depth = 0
+    root = None
+    for event, elem in ET.iterparse(io.BufferedReader(_ChunkReader(chunks)), events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:  # only act on direct children of PubmedArticleSet
+            continue
+        if elem.tag in _ARTICLE_PATHS:
+            yield _article_record(elem)
+        elem.clear()
+        root.remove(elem)
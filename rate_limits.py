@@ -0,0 +1,120 @@
+import threading
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep, time
+
+# Client-side rate control for the metadata providers (NCBI token bucket,
+# Semantic Scholar AIMD throttle).
+# Kept free of Streamlit so it can be imported (and tested) on its own.
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() blocks until a token is available, so callers
+    queue at the configured rate instead of failing and backing off.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            sleep(wait)
+
+def retry_after_seconds(resp, default: float, cap: float = 60.0) -> float:
+    """Seconds to wait according to a Retry-After header (delta-seconds or HTTP date)."""
+    value = (resp.headers.get("retry-after") or "").strip()
+    if value:
+        try:
+            return min(cap, max(0.0, float(value)))
+        except ValueError:
+            try:
+                return min(cap, max(0.0, parsedate_to_datetime(value).timestamp() - time()))
+            except (TypeError, ValueError):
+                pass
+    return min(cap, default)
+
+class AdaptiveThrottle:
+    """
+    AIMD concurrency control for a quota-limited API. The number of requests allowed in
+    flight halves on every 429 and grows by 1/limit per success; a 429 also pauses new
+    requests for the Retry-After period before the request is retried.
+    Counters are kept so the admin panel can show when we hit the key's quota.
+    """
+
+    def __init__(self, initial: int = 2, maximum: int = 8, max_retries: int = 4):
+        self.limit = float(max(1, initial))
+        self.maximum = max(1, maximum)
+        self.max_retries = max_retries
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.gave_up = 0
+        self._in_flight = 0
+        self._resume_at = 0.0
+        self._cond = threading.Condition()
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                pause = self._resume_at - monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self._in_flight >= int(self.limit):
+                    self._cond.wait()
+                else:
+                    break
+            self._in_flight += 1
+            self.requests += 1
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def send(self, send_fn):
+        """Call send_fn() (returning an httpx.Response) under the throttle, retrying 429s."""
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            try:
+                resp = send_fn()
+            finally:
+                self._release()
+            if resp.status_code != 429:
+                if 200 <= resp.status_code < 300:
+                    with self._cond:
+                        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                        self._cond.notify_all()
+                return resp
+            delay = retry_after_seconds(resp, default=2.0 ** attempt)
+            with self._cond:
+                self.throttled += 1
+                self.limit = max(1.0, self.limit / 2)
+                self._resume_at = max(self._resume_at, monotonic() + delay)
+                if attempt == self.max_retries:
+                    self.gave_up += 1
+                    return resp
+                self.retries += 1
+            resp.close()
+        return resp
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+            }
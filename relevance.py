@@ -0,0 +1,56 @@
+import math
+import re
+from collections import Counter
+
+# Local BM25 relevance pre-filter, run before any LLM rating.
+# Kept free of Streamlit so it can be imported (and tested) on its own.
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in into is of on or the to with via using based study studies analysis".split()
+)
+
+def _terms(text: str) -> list:
+    return [t for t in re.findall(r"[a-z0-9]+", (text or "").lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+def bm25_prescores(papers, topics, authors, journals, k1=1.5, b=0.75) -> list:
+    """
+    Okapi BM25 of each paper (title + abstract + venue + authors) against the profile
+    interests, scaled so the best paper scores 1.0 (all zeros when nothing matches).
+    Topic terms weigh 1.0, journal and author terms 0.5. IDF comes from the fetched set.
+    """
+    weights = {}
+    for phrases, weight in ((journals, 0.5), (authors, 0.5), (topics, 1.0)):
+        for term in _terms(" ".join(phrases or [])):
+            weights[term] = max(weights.get(term, 0.0), weight)
+    if not papers or not weights:
+        return [0.0] * len(papers)
+
+    counts, lengths = [], []
+    for paper in papers:
+        terms = _terms(" ".join(str(paper.get(k) or "") for k in ("title", "snippet", "venue", "authors_info")))
+        lengths.append(len(terms))
+        counts.append(Counter(term for term in terms if term in weights))
+
+    df = Counter(term for tf in counts for term in tf)
+    idf = {term: math.log1p((len(papers) - n + 0.5) / (n + 0.5)) for term, n in df.items()}
+    mean_length = max(sum(lengths) / len(lengths), 1.0)
+    scores = []
+    for tf, length in zip(counts, lengths):
+        length_norm = k1 * (1 - b + b * length / mean_length)
+        scores.append(sum(idf[term] * n * (k1 + 1) / (n + length_norm) * weights[term] for term, n in tf.items()))
+    best = max(scores)
+    return [score / best for score in scores] if best > 0 else scores
+
+def prefilter_keep(pre_scores, top_k: int, floor: float) -> list:
+    """
+    Which papers go on to AI rating: the top_k by pre-score plus any at/above `floor`.
+    Papers sharing no term with the profile (score 0) never pass, unless no paper
+    matched at all, in which case the pre-filter has no signal and everything passes.
+    """
+    if not pre_scores or max(pre_scores) <= 0:
+        return [True] * len(pre_scores)
+    keep = [score >= floor for score in pre_scores]
+    # sorted() is stable: ties keep the fetched order
+    for i in sorted(range(len(pre_scores)), key=lambda i: -pre_scores[i])[:max(0, top_k)]:
+        keep[i] = True
+    return [kept and score > 0 for kept, score in zip(keep, pre_scores)]
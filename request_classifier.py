@@ -0,0 +1,58 @@
+import re
+
+from citation_parser import DOI_RE
+
+# Rule/lexicon request classifier that settles PMID/DOI lists and clear field requests
+# without a model call.
+# Kept free of Streamlit so it can be imported (and tested) on its own.
+
+# Field vocabulary for the local classifier (matched at word starts, case-insensitive)
+EVOLUTION_LEXICON = [
+    r"phylogen", r"evolution", r"macroevolution", r"microevolution", r"natural selection",
+    r"(positive|purifying|balancing|sexual) selection", r"speciation", r"ortholog", r"paralog",
+    r"ancestral", r"common ancestor", r"adaptive radiation", r"molecular clock", r"population genetic",
+    r"coalescen", r"dn/ds\b", r"horizontal gene transfer", r"gene duplication", r"convergent evolution",
+    r"fitness landscape", r"genetic drift", r"phylogenom", r"clade",
+]
+PHYSCHEM_LEXICON = [
+    r"thermodynamic", r"calorimetr", r"nmr\b", r"spectroscop", r"molecular dynamics", r"free energ",
+    r"binding affinit", r"dissociation constant", r"crystal structure", r"crystallograph", r"cryo-?em\b",
+    r"enthalp", r"entrop", r"enzyme kinetic", r"michaelis", r"rate constant", r"quantum chemi", r"dft\b",
+    r"allosteri", r"conformational", r"protein folding", r"ligand binding", r"redox potential",
+    r"solvation", r"physical chemistry", r"biophysic",
+]
+_EVOLUTION_RES = [re.compile(r"\b(?:" + p + ")", re.I) for p in EVOLUTION_LEXICON]
+_PHYSCHEM_RES = [re.compile(r"\b(?:" + p + ")", re.I) for p in PHYSCHEM_LEXICON]
+# Words that may surround a pasted identifier list without making it a topic request
+_ID_LIST_WORDS = {"pmid", "pmids", "doi", "dois", "and", "the", "these", "paper", "papers", "list",
+                  "https", "http", "www", "org", "pubmed", "ncbi", "nlm", "nih", "gov"}
+PMID_RE = re.compile(r"\b\d{8,}\b")
+
+def request_identifiers(text):
+    """(pmids, dois) found in a request; DOIs lose trailing punctuation."""
+    dois = [doi.rstrip(".,;)") for doi in DOI_RE.findall(text)]
+    pmids = PMID_RE.findall(DOI_RE.sub(" ", text))
+    return pmids, dois
+
+def classify_request_locally(text):
+    """
+    Rule/lexicon classification for requests that need no model.
+    Returns (classification_int, reason) when confident, None when the request is ambiguous.
+    """
+    pmids, dois = request_identifiers(text)
+    if pmids or dois:
+        rest = PMID_RE.sub(" ", DOI_RE.sub(" ", text))
+        leftover = [w for w in re.findall(r"[A-Za-z]{3,}", rest) if w.lower() not in _ID_LIST_WORDS]
+        if len(pmids) + len(dois) >= 2 or len(leftover) <= 3:
+            if dois:
+                return 5, f"{len(dois)} DOI(s)" + (f" and {len(pmids)} PMID(s)" if pmids else "")
+            return 4, f"{len(pmids)} PMID(s)"
+
+    evolution = [r.pattern for r in _EVOLUTION_RES if r.search(text)]
+    physchem = [r.pattern for r in _PHYSCHEM_RES if r.search(text)]
+    # Two distinct field terms and none from the other field; anything else goes to the model
+    if len(evolution) >= 2 and not physchem:
+        return 2, f"{len(evolution)} evolution terms"
+    if len(physchem) >= 2 and not evolution:
+        return 3, f"{len(physchem)} physical chemistry terms"
+    return None
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The app's helper modules live at the repository root next to laboratory_literature_app.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,93 @@
+import time
+
+from citation_parser import (
+    CITATION_MAX_CHARS, parse_citation, parse_citations_locally, reference_identifiers, reference_segments,
+)
+
+
+def test_parses_each_style():
+    cases = {
+        "vancouver": "Smith-Jones JA, van der Berg B. Amyloid fibrils by solid state NMR. Nat Struct Biol. 2019 Mar;26:45-67.",
+        "apa": "O'Brien, J.-P., & de la Cruz, B. (2018). A study of hyphenated names. Science, 3, 1-9.",
+        "nature": "Garcia-Lopez, M., Doe, B. & Lee, C. Title of the work here. Nature 580, 123-127 (2020).",
+    }
+    for style, text in cases.items():
+        parsed = parse_citation(text)
+        assert parsed["parser"] == style
+        assert parsed["confidence"] >= 0.75
+    assert parse_citation(cases["vancouver"])["authors"] == ["JA Smith-Jones", "B van der Berg"]
+    assert parse_citation(cases["apa"])["authors"] == ["J.-P. O'Brien", "B. de la Cruz"]
+
+
+def test_long_hyphenated_author_lists_fail_fast():
+    # Regression: "-" was allowed both inside a name and between name parts, so a
+    # reference that did not match backtracked exponentially in the number of authors.
+    texts = [
+        ", ".join("Smith-Jones Brown-Lee JA" for _ in range(40)) + ". A title without any year. J Chem.",
+        ", ".join(f"Smith-Jones-Ng{i} Brown-Lee JA" for i in range(40)) + ". A title without any year.",
+        ", ".join("Smith-Jones, J.-A." for _ in range(40)) + " A title without any year. Nature",
+    ]
+    for text in texts:
+        started = time.perf_counter()
+        assert parse_citation(text) is None
+        assert time.perf_counter() - started < 0.5
+
+
+def test_overlong_text_is_left_to_the_llm():
+    reference = "Smith JA, Doe B. Title of the work here. J Biol Chem. 2020;12(3):45-67."
+    assert parse_citation(reference) is not None
+    assert parse_citation(reference + " x" * CITATION_MAX_CHARS) is None
+
+
+def test_one_parse_per_line_only_when_every_line_parses():
+    lines = [
+        "Smith JA, Doe B. Title of the first work. J Biol Chem. 2020;12(3):45-67.",
+        "Lee C, Park D. Title of the second work. Nat Chem. 2021;13:1-9.",
+    ]
+    assert [p["title"] for p in parse_citations_locally("\n".join(lines), 0.75)] == [
+        "Title of the first work", "Title of the second work",
+    ]
+    wrapped = "Smith JA, Doe B. Title of a reference that\nwraps onto a second line. J Biol Chem. 2020;12:45-67."
+    assert [p["title"] for p in parse_citations_locally(wrapped, 0.75)] == [
+        "Title of a reference that wraps onto a second line",
+    ]
+    assert parse_citations_locally("Some notes pasted\nalong with nothing citable", 0.75) == []
+
+
+def test_mixed_list_keeps_references_without_a_doi():
+    # Regression: one reference per line, no blank lines, only some with a DOI. The whole
+    # list was one segment, short enough for its DOIs, so the other lines were dropped.
+    lines = []
+    for n in range(10):
+        line = f"Author{chr(65 + n)}, J. A., & Doe, B. (20{10 + n}). Title of reference number {n}. Journal of Tests, {n + 1}, 1-9."
+        lines.append(line + (f" https://doi.org/10.1000/ref.{n}" if n % 2 == 0 else ""))
+    pieces = reference_segments("\n".join(lines))
+    assert pieces == lines
+    assert [reference_identifiers(p) for p in pieces[::2]] == [[f"10.1000/ref.{n}"] for n in range(0, 10, 2)]
+    # The lines without a DOI go to the local parser (or, failing that, the LLM)
+    for n, piece in enumerate(pieces[1::2]):
+        assert not reference_identifiers(piece)
+        assert [p["title"] for p in parse_citations_locally(piece, 0.75)] == [f"Title of reference number {2 * n + 1}"]
+
+
+def test_wrapped_references_with_identifiers_stay_whole():
+    text = (
+        "Smith JA, Doe B. A long title that wraps\n"
+        "onto the next line. J Biol Chem. 2020;12:45-67. doi:10.1000/abc.1\n"
+        "Lee C, Park D. A reference without any identifier. Nat Chem. 2021;13:1-9.\n"
+        "Kim E, Cho F. A reference with its DOI on the line below. Cell. 2019;7:3-8.\n"
+        "https://doi.org/10.1000/abc.2\n"
+        "Ng G. A preprint. arXiv:2101.01234"
+    )
+    pieces = reference_segments(text)
+    assert [reference_identifiers(p) for p in pieces] == [
+        ["10.1000/abc.1"], [], ["10.1000/abc.2"], ["10.48550/arXiv.2101.01234"],
+    ]
+    assert pieces[0].startswith("Smith JA") and pieces[2].startswith("Kim E")
+
+
+def test_segments_without_identifiers_are_left_whole():
+    text = "[1] Smith JA. First title here. J Chem. 2020;1:2-3.\n[2] Lee C. Second title\nwrapped. Nat. 2021;4:5.\n\nNotes"
+    assert reference_segments(text) == [
+        "[1] Smith JA. First title here. J Chem. 2020;1:2-3.", "[2] Lee C. Second title\nwrapped. Nat. 2021;4:5.", "Notes",
+    ]
@@ -0,0 +1,108 @@
+import json
+
+from llm_replies import (
+    check_structured_reply, parse_streamed_reply, ratings_by_paper, streamed_reply_complete,
+    structured_response_format, validate_json,
+)
+
+ANNOTATION = {
+    "type": "object",
+    "properties": {
+        "abstract": {"type": "string"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "score3": {"type": "integer", "minimum": 0, "maximum": 3},
+        "kind": {"type": ["string", "null"], "enum": ["review", "article", None]},
+    },
+    "required": ["abstract", "tags", "score3", "kind"],
+    "additionalProperties": False,
+}
+
+VALID = {"abstract": "Fibrils.", "tags": ["NMR", "amyloid"], "score3": 2, "kind": None}
+
+
+def test_valid_reply_has_no_errors():
+    assert validate_json(VALID, ANNOTATION) == []
+    assert check_structured_reply(json.dumps(VALID), ANNOTATION) == (VALID, [])
+
+
+def test_type_errors_name_the_path():
+    assert validate_json({**VALID, "score3": "2"}, ANNOTATION) == ["$.score3: expected integer, got str"]
+    assert validate_json({**VALID, "tags": ["NMR", 7]}, ANNOTATION) == ["$.tags[1]: expected string, got int"]
+    assert validate_json([VALID], ANNOTATION) == ["$: expected object, got list"]
+
+
+def test_bool_is_not_an_integer():
+    assert validate_json({**VALID, "score3": True}, ANNOTATION) == ["$.score3: expected integer, got bool"]
+
+
+def test_bounds_and_enum():
+    assert validate_json({**VALID, "score3": 4}, ANNOTATION) == ["$.score3: 4 is above the maximum 3"]
+    assert validate_json({**VALID, "score3": -1}, ANNOTATION) == ["$.score3: -1 is below the minimum 0"]
+    assert validate_json({**VALID, "kind": "letter"}, ANNOTATION) == [
+        "$.kind: 'letter' is not one of ['review', 'article', None]"
+    ]
+
+
+def test_missing_and_unexpected_keys():
+    partial = {key: value for key, value in VALID.items() if key != "tags"}
+    assert validate_json({**partial, "score": 2}, ANNOTATION) == [
+        "$: missing required key 'tags'",
+        "$: unexpected key 'score'",
+    ]
+
+
+def test_non_json_reply_is_rejected_without_data():
+    data, errors = check_structured_reply('Sure! {"abstract": "x"', ANNOTATION)
+    assert data is None
+    assert errors[0].startswith("$: not valid JSON")
+
+
+def test_response_format_is_strict():
+    assert structured_response_format(ANNOTATION, "paper_annotation") == {
+        "type": "json_schema",
+        "json_schema": {"name": "paper_annotation", "strict": True, "schema": ANNOTATION},
+    }
+
+
+def _rating(paper_id, score=2):
+    return {"id": paper_id, "score": score, "tags": ["aRT-amyloid"], "explanation": f"paper {paper_id}"}
+
+
+def test_batch_ratings_map_to_papers_by_id_not_by_position():
+    data = {"ratings": [_rating(3, 0), _rating(1, 3), _rating(2, 1)]}
+    ratings = ratings_by_paper(data, 3)
+    assert [r["explanation"] for r in ratings] == ["paper 1", "paper 2", "paper 3"]
+    assert [r["score"] for r in ratings] == [3, 1, 0]
+
+
+def test_papers_missing_from_the_batch_reply_come_back_as_none():
+    # None is the caller's signal to rate that paper with its own single-paper request
+    data = {"ratings": [_rating(2), _rating(2, 0), _rating(7), _rating(0)]}
+    ratings = ratings_by_paper(data, 4)
+    assert ratings[0] is None and ratings[2] is None and ratings[3] is None
+    assert ratings[1]["score"] == 2  # the first answer for a repeated id wins
+    assert ratings_by_paper({"ratings": []}, 2) == [None, None]
+
+
+def test_streamed_tags_with_and_without_brackets():
+    bracketed = "Note: Solid-state NMR of fibrils.\nScore: 3\nTags: [aRT-Amyloid, 'aTa-NMR', ai-score_3]"
+    plain = "Abstract: Solid-state NMR of fibrils.\nScore: [2]\nTags: aRT-Amyloid, aTa-NMR"
+    assert parse_streamed_reply(bracketed) == ("Solid-state NMR of fibrils.", 3, ["aRT-Amyloid", "aTa-NMR", "ai-score_3"])
+    assert parse_streamed_reply(plain) == ("Solid-state NMR of fibrils.", 2, ["aRT-Amyloid", "aTa-NMR"])
+    assert streamed_reply_complete(bracketed) and streamed_reply_complete(plain)
+
+
+def test_body_after_score_and_tags_is_read():
+    assert parse_streamed_reply("Score: 1\nTags: [unrated]\nNote: OpenAI API not available") == (
+        "OpenAI API not available", 1, ["unrated"],
+    )
+
+
+def test_truncated_streams_are_not_complete():
+    full = "Note: Solid-state NMR of fibrils.\nScore: 3\nTags: [aRT-Amyloid, aTa-NMR]"
+    # Cut inside the tag list, before the tags, and before the score
+    for cut in (full.index("aTa-NMR"), full.index("Tags:"), full.index("Score:")):
+        assert not streamed_reply_complete(full[:cut])
+    assert parse_streamed_reply(full[:full.index("Score:")]) == ("Solid-state NMR of fibrils.", None, [])
+    # A score and tags without any explanation are not a usable reply either
+    assert not streamed_reply_complete("Score: 2\nTags: aRT-Amyloid")
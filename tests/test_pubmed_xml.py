@@ -0,0 +1,85 @@
+from pubmed_xml import iter_pubmed_articles
+
+EFETCH_XML = b"""<?xml version="1.0" ?>
+<!DOCTYPE PubmedArticleSet PUBLIC "-//NLM//DTD PubMedArticle, 1st January 2024//EN" "https://dtd.nlm.nih.gov/ncbi/pubmed/out/pubmed_240101.dtd">
+<PubmedArticleSet>
+  <PubmedArticle>
+    <MedlineCitation Status="MEDLINE" Owner="NLM">
+      <PMID Version="1">31234567</PMID>
+      <Article>
+        <ArticleTitle>Amyloid fibrils</ArticleTitle>
+        <Abstract>
+          <AbstractText Label="BACKGROUND">Fibrils of A<i>\xce\xb2</i><sub>42</sub> were
+            studied by <sup>13</sup>C NMR.</AbstractText>
+          <AbstractText Label="RESULTS">Two polymorphs.</AbstractText>
+        </Abstract>
+      </Article>
+    </MedlineCitation>
+    <PubmedData>
+      <ArticleIdList>
+        <ArticleId IdType="pubmed">31234567</ArticleId>
+        <ArticleId IdType="doi">10.1000/fibrils.1</ArticleId>
+      </ArticleIdList>
+      <ReferenceList>
+        <Reference><ArticleIdList><ArticleId IdType="doi">10.1000/cited</ArticleId></ArticleIdList></Reference>
+      </ReferenceList>
+    </PubmedData>
+  </PubmedArticle>
+  <PubmedBookArticle>
+    <BookDocument>
+      <PMID Version="1">20301295</PMID>
+      <ArticleIdList><ArticleId IdType="bookaccession">NBK1116</ArticleId></ArticleIdList>
+      <Abstract><AbstractText>A <b>GeneReviews</b> chapter.</AbstractText></Abstract>
+    </BookDocument>
+    <PubmedBookData>
+      <ArticleIdList><ArticleId IdType="pubmed">20301295</ArticleId></ArticleIdList>
+    </PubmedBookData>
+  </PubmedBookArticle>
+  <PubmedArticle>
+    <MedlineCitation><PMID>30000001</PMID><Article><ArticleTitle>No abstract</ArticleTitle></Article></MedlineCitation>
+    <PubmedData>
+      <ReferenceList>
+        <Reference><ArticleIdList><ArticleId IdType="doi">10.1000/not-this-one</ArticleId></ArticleIdList></Reference>
+      </ReferenceList>
+    </PubmedData>
+  </PubmedArticle>
+</PubmedArticleSet>
+"""
+
+
+def _chunks(data, size):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def test_articles_with_inline_markup_and_book_articles():
+    records = list(iter_pubmed_articles([EFETCH_XML]))
+    assert records == [
+        {"pmid": "31234567", "doi": "10.1000/fibrils.1",
+         "abstract": "Fibrils of Aβ42 were studied by 13C NMR. Two polymorphs."},
+        {"pmid": "20301295", "doi": None, "abstract": "A GeneReviews chapter."},
+        # A DOI from the reference list is not the article's own
+        {"pmid": "30000001", "doi": None, "abstract": ""},
+    ]
+
+
+def test_result_does_not_depend_on_chunk_boundaries():
+    whole = list(iter_pubmed_articles([EFETCH_XML]))
+    for size in (1, 7, 64):
+        assert list(iter_pubmed_articles(_chunks(EFETCH_XML, size))) == whole
+
+
+def test_records_are_yielded_before_the_stream_ends():
+    article = EFETCH_XML.split(b"<PubmedArticleSet>")[1].split(b"<PubmedBookArticle>")[0]
+    data = b"<PubmedArticleSet>" + article * 2000 + b"</PubmedArticleSet>"
+    chunks = list(_chunks(data, 1024))
+    consumed = []
+
+    def feed():
+        for chunk in chunks:
+            consumed.append(chunk)
+            yield chunk
+
+    records = iter_pubmed_articles(feed())
+    assert next(records)["pmid"] == "31234567"
+    assert len(consumed) < len(chunks) // 10
+    assert sum(1 for _ in records) == 1999
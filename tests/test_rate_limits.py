@@ -0,0 +1,104 @@
+import threading
+import time
+from email.utils import formatdate
+
+from rate_limits import AdaptiveThrottle, TokenBucket, retry_after_seconds
+
+
+def _elapsed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def test_bucket_starts_full_and_spends_capacity_without_waiting():
+    bucket = TokenBucket(rate=1, capacity=3)
+    assert _elapsed(lambda: [bucket.acquire() for _ in range(3)]) < 0.05
+
+
+def test_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=50)
+    # 1 token up front, then 5 refills at 50/s
+    assert 0.09 <= _elapsed(lambda: [bucket.acquire() for _ in range(6)]) < 0.5
+
+
+def test_idle_time_never_refills_past_capacity():
+    bucket = TokenBucket(rate=50, capacity=1)
+    bucket.acquire()
+    time.sleep(0.1)  # would be 5 tokens without the cap
+    assert _elapsed(lambda: [bucket.acquire() for _ in range(3)]) >= 0.035
+
+
+def test_bucket_is_shared_fairly_across_threads():
+    bucket = TokenBucket(rate=100)
+
+    def worker():
+        for _ in range(5):
+            bucket.acquire()
+
+    def run():
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # 20 acquisitions from one bucket: 1 immediate + 19 refills at 100/s
+    assert _elapsed(run) >= 0.18
+
+
+class FakeResponse:
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.headers = {"retry-after": retry_after} if retry_after is not None else {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_retry_after_accepts_seconds_and_http_dates_and_caps():
+    assert retry_after_seconds(FakeResponse(429, "3"), default=1) == 3
+    assert retry_after_seconds(FakeResponse(429), default=2) == 2
+    assert retry_after_seconds(FakeResponse(429, "999"), default=1, cap=60) == 60
+    assert retry_after_seconds(FakeResponse(429, "garbage"), default=1.5) == 1.5
+    in_ten_seconds = formatdate(time.time() + 10, usegmt=True)
+    assert 8 <= retry_after_seconds(FakeResponse(429, in_ten_seconds), default=1) <= 10
+
+
+def test_throttle_grows_additively_on_success():
+    throttle = AdaptiveThrottle(initial=2, maximum=3)
+    for _ in range(2):
+        throttle.send(lambda: FakeResponse(200))
+    assert abs(throttle.limit - 2.9) < 1e-9  # 2 + 1/2 + 1/2.5
+    throttle.send(lambda: FakeResponse(200))
+    assert throttle.limit == 3.0  # capped at maximum
+    assert throttle.stats()["requests"] == 3
+
+
+def test_throttle_halves_on_429_and_retries_after_the_pause():
+    throttle = AdaptiveThrottle(initial=8, maximum=8, max_retries=3)
+    replies = iter([FakeResponse(429, "0.2"), FakeResponse(429, "0"), FakeResponse(200)])
+    sent = []
+
+    def send():
+        sent.append(time.perf_counter())
+        return next(replies)
+
+    resp = throttle.send(send)
+    assert resp.status_code == 200
+    assert len(sent) == 3
+    assert sent[1] - sent[0] >= 0.19  # waited out Retry-After before retrying
+    stats = throttle.stats()
+    assert (stats["throttled"], stats["retries"], stats["gave_up"]) == (2, 2, 0)
+    assert stats["limit"] == 2.0 + 1.0 / 2.0  # 8 -> 4 -> 2, then one success
+
+
+def test_throttle_gives_up_after_max_retries_and_never_drops_below_one():
+    throttle = AdaptiveThrottle(initial=1, max_retries=2)
+    resp = throttle.send(lambda: FakeResponse(429, "0"))
+    assert resp.status_code == 429 and not resp.closed  # the last 429 goes back to the caller
+    stats = throttle.stats()
+    assert (stats["throttled"], stats["retries"], stats["gave_up"]) == (3, 2, 1)
+    assert stats["limit"] == 1.0
+    assert stats["in_flight"] == 0
@@ -0,0 +1,54 @@
+from relevance import bm25_prescores, prefilter_keep
+
+TOPICS = ["amyloid fibrils", "solid-state NMR"]
+JOURNALS = ["Biophysical Journal"]
+
+
+def _paper(title, snippet="", venue="", authors=""):
+    return {"title": title, "snippet": snippet, "venue": venue, "authors_info": authors}
+
+
+PAPERS = [
+    _paper("Crop yields in drought years", "Field trials of wheat.", "Agronomy"),
+    _paper("Solid-state NMR of amyloid fibrils", "Amyloid fibrils of Abeta studied by solid-state NMR.",
+           "Biophysical Journal"),
+    _paper("Amyloid aggregation kinetics", "Fibrils grow by secondary nucleation.", "PNAS"),
+    _paper("Protein NMR relaxation", "Backbone dynamics by NMR.", "Biophysical Journal"),
+]
+
+
+def test_bm25_orders_papers_by_profile_match():
+    scores = bm25_prescores(PAPERS, TOPICS, [], JOURNALS)
+    assert scores[1] == 1.0  # the best match is scaled to 1
+    assert scores[0] == 0.0  # no shared term
+    assert scores[1] > scores[2] > 0
+    assert scores[1] > scores[3] > 0
+
+
+def test_bm25_without_interests_or_papers_scores_zero():
+    assert bm25_prescores(PAPERS, [], [], []) == [0.0] * 4
+    assert bm25_prescores([], TOPICS, [], JOURNALS) == []
+
+
+def test_topic_terms_outweigh_journal_terms():
+    by_topic = _paper("Amyloid")
+    by_journal = _paper("", venue="Biophysical")  # same length, same document frequency
+    scores = bm25_prescores([by_topic, by_journal], ["amyloid"], [], ["Biophysical"])
+    assert scores[0] == 1.0
+    assert abs(scores[1] - 0.5) < 1e-9
+
+
+def test_keep_top_k_plus_everything_above_the_floor():
+    scores = [0.2, 1.0, 0.5, 0.4, 0.0]
+    assert prefilter_keep(scores, top_k=2, floor=0.45) == [False, True, True, False, False]
+    assert prefilter_keep(scores, top_k=1, floor=0.3) == [False, True, True, True, False]
+
+
+def test_keep_never_passes_zero_scores_and_breaks_ties_in_fetched_order():
+    assert prefilter_keep([0.0, 1.0, 0.0], top_k=3, floor=0.0) == [False, True, False]
+    assert prefilter_keep([0.5, 1.0, 0.5], top_k=2, floor=0.9) == [True, True, False]
+
+
+def test_keep_everything_when_nothing_matched():
+    assert prefilter_keep([0.0, 0.0], top_k=1, floor=0.5) == [True, True]
+    assert prefilter_keep([], top_k=1, floor=0.5) == []
@@ -0,0 +1,29 @@
+from request_classifier import classify_request_locally, request_identifiers
+
+
+def test_identifier_lists():
+    assert classify_request_locally("PMIDs: 31452104, 30012345 and 29876543")[0] == 4
+    assert classify_request_locally("10.1038/s41586-020-2649-2\n10.1126/science.abc1234")[0] == 5
+    # DOIs decide the class even when PMIDs are pasted alongside
+    assert classify_request_locally("these papers: 10.1038/nature12373, 31452104") == (5, "1 DOI(s) and 1 PMID(s)")
+    assert classify_request_locally("https://doi.org/10.1016/j.cell.2019.01.001")[0] == 5
+
+
+def test_doi_digits_are_not_read_as_pmids():
+    pmids, dois = request_identifiers("see 10.1101/2020.12345678v1.")
+    assert pmids == []
+    assert dois == ["10.1101/2020.12345678v1"]
+
+
+def test_single_identifier_inside_a_topic_request_is_not_a_list():
+    text = "papers like 31452104 on amyloid aggregation kinetics in neurons and their membrane toxicity"
+    assert classify_request_locally(text) is None
+
+
+def test_field_lexicons():
+    assert classify_request_locally("phylogenetic analysis of gene duplication in plants")[0] == 2
+    assert classify_request_locally("isothermal titration calorimetry and binding affinity of ligands")[0] == 3
+    # Terms from both fields, or a single term, are left to the model
+    assert classify_request_locally("molecular dynamics of ancestral enzyme evolution") is None
+    assert classify_request_locally("speciation in birds") is None
+    assert classify_request_locally("machine learning for microscopy images") is None